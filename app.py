@@ -2,13 +2,37 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
-import statsmodels.formula.api as smf
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
-import seaborn as sns
-from scipy import stats
+import contextlib
 import io
 import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from bootstrap import WEIGHT_TYPES, WildClusterBootstrap
+from data_cache import content_hash, deep_nbytes, get_dataset_cache, memory_report
+from diagnostics import ResidualDiagnostics
+from estimates import EXPORT_FORMATS, SCALAR_LABELS, EstimatesStore, StoredEstimates, esttab
+from hypothesis import HypothesisParser, bootstrap_pvalues, evaluate
+from hdfe import fit_hdfe, prune_singletons
+from jackknife import cluster_jackknife
+from jobs import CANCELLED, FAILED, JobRegistry
+from loader import read_columns, read_header
+from margins import MARGIN_TYPES
+from outliers import RULES as OUTLIER_RULES, ResidualIndex, coefficient_path, default_grid
+from perf import DEFAULT_LOG, ProfileCapture, StageRecorder, append_jsonl, run_record
+from pipeline import (VCE_TYPES, coef_frame, column_cardinality, interaction_margins, is_categorical,
+                      margins_frame, prepare_frame, run_batch, run_subgroups, safe_rename, side_by_side, spec_columns, spec_label,
+                      stage2_cross_products, stage2_design, with_columns)
+from plots import (FIGURE_FORMATS, FIGURE_MIME, PLOT_DEFAULTS, PREVIEW_DPI, FigureSpec, get_figure_cache,
+                   render_cached)
+from regression import translate_name
+from result_cache import get_result_cache, result_key
+from speccurve import DEFAULT_MAX_SPECS, run_spec_curve
 
 # --- 页面配置 ---
 st.set_page_config(
@@ -60,28 +84,233 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- 辅助函数：处理中文列名 ---
-def safe_rename(df):
-    """将中文列名映射为安全变量名 (v1, v2...)，避免 patsy 公式报错"""
-    col_map = {col: f"v_{i}" for i, col in enumerate(df.columns)}
-    reverse_map = {v: k for k, v in col_map.items()}
-    df_safe = df.rename(columns=col_map)
-    return df_safe, col_map, reverse_map
-
-def get_formula_term(original_name, col_map, is_cat=False):
-    safe_name = col_map[original_name]
-    if is_cat:
-        return f"C({safe_name})"
-    return safe_name
-
-def is_categorical(series, threshold=15):
-    """判断是否为分类变量"""
-    # 如果是 object 类型或者是 category 类型，或者是数值类型但唯一值很少
-    if pd.api.types.is_object_dtype(series) or pd.api.types.is_categorical_dtype(series):
-        return True
-    if pd.api.types.is_numeric_dtype(series) and series.nunique() < threshold:
-        return True
-    return False
+# --- 辅助函数：数据读取与缓存 ---
+def upload_digest(uploaded_file):
+    """上传文件的内容哈希；同一上传对象只计算一次，避免每次重跑都扫描整个文件"""
+    digests = st.session_state.setdefault('_upload_digests', {})
+    file_key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, 'file_id', None))
+    if file_key not in digests:
+        digests[file_key] = content_hash(uploaded_file.getbuffer())
+    return digests[file_key]
+
+def load_schema(uploaded_file):
+    """第一阶段读取：只读表头与值标签 (结果按内容哈希放入跨会话共享缓存)"""
+    return get_dataset_cache().get_or_load(
+        (upload_digest(uploaded_file), 'schema'),
+        lambda: read_header(uploaded_file.name, uploaded_file),
+    )[0]
+
+def load_columns(uploaded_file, columns):
+    """第二阶段读取：只读取所选列；每列按 (内容哈希, 列名) 单独缓存，新增变量时只补读缺少的列
+
+    返回的 DataFrame 由缓存中的列拼接而成，调用方应视为只读。
+    """
+    cache = get_dataset_cache()
+    digest = upload_digest(uploaded_file)
+    columns = list(dict.fromkeys(columns))
+    cached = {c: cache.get((digest, 'col', c)) for c in columns}
+    missing = [c for c in columns if cached[c] is None]
+    if missing:
+        fresh = read_columns(uploaded_file.name, uploaded_file, missing)
+        for c in missing:
+            cached[c] = cache.put((digest, 'col', c), fresh[c])
+    # copy=False：直接引用缓存中的列，不复制数据
+    return pd.DataFrame({c: cached[c] for c in columns}, copy=False), len(missing)
+
+def outlier_config():
+    """残差诊断标签页中选定的极端值规则 (批量分析、子样本对比与设定曲线沿用同一规则)"""
+    return {'outlier_rule': st.session_state.get("outlier_rule"),
+            'outlier_k': st.session_state.get("outlier_k", 3.0),
+            'outlier_pct': st.session_state.get("outlier_pct", 1.0)}
+
+def parse_at_values(text):
+    """margins 的 at() 取值 (逗号或空格分隔)；含非数值时抛出 ValueError"""
+    return [float(v) for v in re.split(r"[,，\s]+", str(text).strip()) if v]
+
+def prepare_sample(uploaded_file, df_raw, base_mask, used_cols, sample_filter, fe_vars):
+    """分析样本 (过滤后所选变量均无缺失、且在各固定效应中都不是单例的行)，按 (内容哈希, 变量, 固定效应, 过滤条件) 缓存
+
+    这是整个流程唯一的一份整表数据，被所有会话共享、只读；残差、极端值等以数组/掩码另行保存。
+    返回 (DataFrame, 各列取值数, 样本标识, 剔除缺失后的样本量)。
+    """
+    cache = get_dataset_cache()
+    key = (upload_digest(uploaded_file), 'sample', tuple(used_cols), tuple(fe_vars), sample_filter)
+    base = df_raw[used_cols] if base_mask is None else df_raw.loc[base_mask, used_cols]
+    df_clean, _ = cache.get_or_load(key, lambda: prune_singletons(prepare_frame(base.dropna()), fe_vars)[0])
+    cardinality, _ = cache.get_or_load(key + ('cardinality',), lambda: column_cardinality(df_clean))
+    n_complete, _ = cache.get_or_load(key + ('complete',), lambda: int(base.notna().all(axis=1).sum()))
+    return df_clean, cardinality, key, n_complete
+
+def stage2_cp_key(design, vce, safe_cluster):
+    return (st.session_state.get('stage1_run_id'), str(design), vce, safe_cluster)
+
+def cached_cross_products(key):
+    """会话中已缓存的第二阶段交叉积 (标识不符时返回 None)"""
+    cached = st.session_state.get('stage2_cp')
+    return cached[1] if cached is not None and cached[0] == key else None
+
+def session_cross_products(data_all, design, vce, safe_cluster):
+    """第二阶段的交叉积 (按第一阶段结果、设定与 VCE 缓存在会话中)"""
+    key = stage2_cp_key(design, vce, safe_cluster)
+    cp = cached_cross_products(key)
+    if cp is None:
+        cp = stage2_cross_products(design, data_all, safe_cluster if vce == "cluster" else None)
+        st.session_state.stage2_cp = (key, cp)
+    return cp
+
+# --- 后台任务 ---
+# 提交后在本次运行内等待的秒数：短任务直接给出结果，长任务转入后台并显示进度
+FAST_JOB_WAIT = 1.0
+
+def job_registry():
+    """本会话的后台任务登记表"""
+    if '_jobs' not in st.session_state:
+        st.session_state._jobs = JobRegistry()
+    return st.session_state._jobs
+
+def estimates_store():
+    """本会话的 estimates store (已存储模型的紧凑摘要)"""
+    if 'estimates' not in st.session_state:
+        st.session_state.estimates = EstimatesStore()
+    return st.session_state.estimates
+
+def start_job(kind, key, func, label):
+    """提交后台任务；相同标识的任务仍在运行时挂接到该任务"""
+    if perf_recorder() is not None:
+        func = timed_job(func, label)
+    job = job_registry().submit(kind, key, func, label)
+    job.wait(FAST_JOB_WAIT)
+    return job
+
+def job_progress(kind):
+    """运行中任务的进度条与取消按钮 (局部定时刷新，任务结束后整页重跑以取回结果)"""
+    job = job_registry().get(kind)
+    if job is None or not job.active:
+        return
+
+    @st.fragment(run_every=0.5)
+    def panel():
+        job = job_registry().get(kind)
+        if job is None or not job.active:
+            st.rerun()
+        text = f"{job.label}：{job.message or '运行中'} (已用时 {job.elapsed:.0f} 秒)"
+        st.progress(job.fraction or 0.0, text=text)
+        if st.button("⏹ 取消", key=f"cancel_{kind}"):
+            job.cancel()
+
+    panel()
+
+def collect_job(kind, hint=None):
+    """取出已结束的任务：成功时返回结果；失败或取消时给出提示并返回 None"""
+    job = job_registry().pop_finished(kind)
+    if job is None:
+        return None
+    if perf_recorder() is not None:
+        # 后台任务的耗时记录在取回结果的这次运行中
+        perf_recorder().records.extend(getattr(job, 'perf_records', ()))
+    if job.status == CANCELLED:
+        st.warning(f"{job.label}已取消")
+        return None
+    if job.status == FAILED:
+        st.error(f"{job.label}出错: {job.error}")
+        if hint:
+            st.markdown(f"**Debug 提示**: {hint}")
+        return None
+    return job.result
+
+# --- 性能记录 ---
+# 本次运行的阶段记录器 (Streamlit 每个会话的脚本在各自的线程中运行)
+_perf_state = threading.local()
+
+# 侧边栏“性能”面板保留的最近运行数
+PERF_HISTORY = 30
+
+def perf_recorder():
+    """本次运行的阶段记录器；未开启性能记录时为 None"""
+    return getattr(_perf_state, 'recorder', None)
+
+def perf_stage(name, **extra):
+    """计时一个阶段 (未开启性能记录时不做任何事)"""
+    recorder = perf_recorder()
+    return recorder.stage(name, **extra) if recorder is not None else contextlib.nullcontext()
+
+def timed_job(func, label):
+    """后台任务整体计时；记录挂在任务上，取回结果时并入当次运行"""
+    def run(job):
+        job.perf_recorder = StageRecorder()
+        with job.perf_recorder.stage(label, thread="后台任务"):
+            result = func(job)
+        job.perf_records = job.perf_recorder.records
+        return result
+    return run
+
+def job_stage(job, name):
+    """后台任务内部的分阶段计时 (任务未计时时不做任何事)"""
+    recorder = getattr(job, 'perf_recorder', None)
+    return recorder.stage(name, thread="后台任务") if recorder is not None else contextlib.nullcontext()
+
+def perf_panel(recorder, capture, run_seconds):
+    """侧边栏“性能”面板：本次运行各阶段耗时与内存、JSON lines 日志、cProfile 采集"""
+    with st.sidebar:
+        with st.expander("⏱️ 性能", expanded=st.session_state.get('perf_enabled', False)):
+            st.toggle("记录各阶段耗时与内存", key="perf_enabled",
+                      help=f"每次运行的记录以 JSON lines 追加到 {DEFAULT_LOG} (环境变量 APP_PERF_LOG)")
+            if not st.session_state.get('perf_enabled'):
+                return
+            st.checkbox("同时记录 Python 分配峰值 (tracemalloc，会拖慢 pandas/patsy)", key="perf_tracemalloc")
+            if recorder is None:
+                st.caption("从下一次运行开始记录。")
+            else:
+                session_id = st.session_state.setdefault('perf_session', uuid.uuid4().hex[:8])
+                run_no = st.session_state['perf_run'] = st.session_state.get('perf_run', 0) + 1
+                record = run_record(recorder.records, session=session_id, run=run_no, run_seconds=run_seconds,
+                                    profiled=capture is not None)
+                logged = append_jsonl(DEFAULT_LOG, record)
+                history = st.session_state.setdefault('perf_history', [])
+                history.append(run_seconds)
+                del history[:-PERF_HISTORY]
+                st.metric("本次运行 (脚本线程)", f"{run_seconds:.2f} 秒")
+                if recorder.records:
+                    table = pd.DataFrame(recorder.records).rename(columns={
+                        'stage': '阶段', 'seconds': '耗时 (秒)', 'cpu_seconds': 'CPU (秒)',
+                        'rss_peak_mb': 'RSS 峰值 (MB)', 'rss_end_mb': 'RSS (MB)', 'py_peak_mb': 'Python 峰值 (MB)',
+                        'thread': '线程', 'error': '错误'})
+                    st.dataframe(table.dropna(axis=1, how="all"), hide_index=True)
+                st.caption("RSS 为整个服务进程 (含其他会话)；后台任务的耗时在取回结果的那次运行中列出。"
+                           + ("" if logged else f" 日志 {DEFAULT_LOG} 无法写入。"))
+                if len(history) > 1:
+                    st.line_chart(pd.DataFrame({'运行耗时 (秒)': history}))
+
+            if st.button("📸 采集下一次运行的 cProfile", key="perf_profile_button"):
+                st.session_state.perf_profile_next = True
+                st.rerun()
+            if capture is not None:
+                st.session_state.perf_profile = (capture.text(), capture.dump())
+            if 'perf_profile' in st.session_state:
+                text, raw = st.session_state.perf_profile
+                st.caption("cProfile 只覆盖脚本线程；后台任务中的拟合见上表中的任务耗时。")
+                st.code(text, language=None)
+                col_p1, col_p2 = st.columns(2)
+                col_p1.download_button("📥 下载 .prof", data=raw, file_name="streamlit_run.prof",
+                                       mime="application/octet-stream")
+                col_p2.download_button("📥 下载文本", data=text.encode('utf-8'), file_name="streamlit_run_profile.txt",
+                                       mime="text/plain")
+
+def run_app():
+    """运行 main()；开启性能记录时为本次运行建立阶段记录器，按需采集 cProfile，结束后显示性能面板"""
+    enabled = st.session_state.get('perf_enabled', False)
+    profiling = enabled and st.session_state.pop('perf_profile_next', False)
+    _perf_state.recorder = StageRecorder(trace_python=st.session_state.get('perf_tracemalloc', False)) \
+        if enabled else None
+    capture = ProfileCapture() if profiling else None
+    t0 = time.perf_counter()
+    try:
+        with capture if capture is not None else contextlib.nullcontext():
+            main()
+        run_seconds = time.perf_counter() - t0
+        perf_panel(_perf_state.recorder, capture, run_seconds)
+    finally:
+        _perf_state.recorder = None
 
 # --- 主程序 ---
 
@@ -104,14 +333,11 @@ def main():
 
         if uploaded_file:
             try:
-                if uploaded_file.name.endswith('.dta'):
-                    df_raw = pd.read_stata(uploaded_file)
-                elif uploaded_file.name.endswith('.csv'):
-                    df_raw = pd.read_csv(uploaded_file)
-                else:
-                    df_raw = pd.read_excel(uploaded_file)
-                st.success(f"✅ 数据加载成功: {df_raw.shape[0]} 行, {df_raw.shape[1]} 列")
-                all_cols = df_raw.columns.tolist()
+                # 先只读表头，数据行在变量选定后按列读取
+                with perf_stage("读取表头"):
+                    schema = load_schema(uploaded_file)
+                all_cols = schema.columns
+                st.success(f"✅ 表头读取成功: {len(all_cols)} 列")
             except Exception as e:
                 st.error(f"数据读取失败: {e}")
                 return
@@ -158,6 +384,22 @@ def main():
             if all(k in st.session_state for k in keys_to_save):
                 for k in keys_to_save:
                     current_config[k] = st.session_state[k]
+                # 可选项 (极端值规则等)：已设置时一并保存，供命令行批量运行使用
+                for k in ['interact_extra', 'remove_extreme', 'outlier_rule', 'outlier_k', 'outlier_pct', 'margins_type']:
+                    if k in st.session_state:
+                        current_config[k] = st.session_state[k]
+                # at() 取值：无法解析的输入 (第二阶段标签页中另行报错) 不写入配置
+                margins_at_cfg = {}
+                for k, text in st.session_state.items():
+                    if k.startswith("margins_at_") and str(text).strip():
+                        try:
+                            margins_at_cfg[k[len("margins_at_"):]] = parse_at_values(text)
+                        except ValueError:
+                            pass
+                if margins_at_cfg:
+                    current_config['margins_at'] = margins_at_cfg
+                if str(st.session_state.get('hypothesis_text', '')).strip():
+                    current_config['tests'] = [line for line in st.session_state.hypothesis_text.splitlines() if line.strip()]
                 
                 st.download_button(
                     label="💾 保存当前配置",
@@ -232,8 +474,15 @@ def main():
             key="interact_var2"
         )
         
+        interact_extra = st.multiselect(
+            "更多交互变量 (可选)",
+            [c for c in all_cols if c not in [interact_var1, interact_var2]],
+            help="与 A、B 一起构成全因子交互 A##B##C...，如 Stata 的 i.a##i.b##i.c",
+            key="interact_extra"
+        )
+
         # 确保默认选项在可用选项列表中
-        stage2_options = [c for c in all_cols if c not in [interact_var1, interact_var2]]
+        stage2_options = [c for c in all_cols if c not in [interact_var1, interact_var2] + interact_extra]
         stage2_default = [c for c in control_vars if c in stage2_options]
         
         stage2_controls = st.multiselect(
@@ -244,39 +493,67 @@ def main():
             key="stage2_controls"
         )
 
+        # 选取所有涉及的变量
+        # 保持固定顺序，使安全变量名 (v_0, v_1...) 在不同会话与重启之间一致
+        used_cols = list(dict.fromkeys([dep_var] + control_vars + fe_vars + [interact_var1, interact_var2] + interact_extra + stage2_controls))
+        if st.session_state.get("vce_mode") == "vce(cluster)" and cluster_var in all_cols and cluster_var not in used_cols:
+            used_cols.append(cluster_var)
+
         st.markdown("---")
         st.header("🔬 异质性分析 (子样本过滤)")
         hetero_var = st.selectbox("选择过滤变量 (可选)", ["(不使用)"] + all_cols, index=0, key="hetero_var")
-        df_base = df_raw
+
+        # 只读取所选变量 (及过滤变量) 对应的列
+        try:
+            load_cols = used_cols + ([hetero_var] if hetero_var != "(不使用)" else [])
+            with perf_stage("读取数据列"):
+                df_raw, n_read = load_columns(uploaded_file, load_cols)
+        except Exception as e:
+            st.error(f"数据读取失败: {e}")
+            return
+        cache_stats = get_dataset_cache().stats()
+        st.caption(f"已读取 {len(df_raw)} 行 × {len(load_cols)} 列 (本次从文件读取 {n_read} 列)；"
+                   f"数据缓存 {cache_stats['nbytes']/1024**2:.0f} / {cache_stats['budget_bytes']/1024**2:.0f} MB")
+        base_mask = None  # 子样本过滤以布尔掩码表示，不复制数据
+        sample_filter = None  # 过滤条件的标识，用于缓存分析样本
+        hetero_all = False
         if hetero_var != "(不使用)":
+            hetero_all = st.toggle("并行估计全部子样本 (森林图)", value=False, key="hetero_all",
+                                   help="按该变量的每个类别 (连续变量按分位数分组) 同时运行两阶段回归，结果见“子样本对比”标签页")
+        if hetero_all:
+            if not is_categorical(df_raw[hetero_var].dropna()):
+                st.number_input("分位数分组数", min_value=2, max_value=10, value=4, key="hetero_bins")
+            st.info("子样本对比模式：单次分析仍使用全部样本")
+        elif hetero_var != "(不使用)":
             ser = df_raw[hetero_var]
             if pd.api.types.is_numeric_dtype(ser):
                 vmin, vmax = float(ser.min()), float(ser.max())
                 rmin, rmax = st.slider("取值范围", min_value=vmin, max_value=vmax, value=(vmin, vmax))
-                df_base = df_raw[(ser >= rmin) & (ser <= rmax)]
-                st.info(f"已应用数值过滤: [{rmin:.3f}, {rmax:.3f}]，样本量 {len(df_base)}")
+                base_mask = ((ser >= rmin) & (ser <= rmax)).values
+                sample_filter = ('range', hetero_var, rmin, rmax)
+                st.info(f"已应用数值过滤: [{rmin:.3f}, {rmax:.3f}]，样本量 {int(base_mask.sum())}")
                 st.session_state['hetero_range'] = [rmin, rmax]
             else:
                 cats = sorted(ser.dropna().unique().tolist())
                 picked = st.multiselect("选择类别", cats, default=cats[:min(5, len(cats))], key="hetero_cats")
                 if picked:
-                    df_base = df_raw[ser.isin(picked)]
-                    st.info(f"已应用类别过滤: {picked}，样本量 {len(df_base)}")
+                    base_mask = ser.isin(picked).values
+                    sample_filter = ('cats', hetero_var, tuple(picked))
+                    st.info(f"已应用类别过滤: {picked}，样本量 {int(base_mask.sum())}")
                 else:
                     st.warning("未选择任何类别，保持原始数据")
                 
 
     # --- 数据预处理与安全映射 ---
-    # 选取所有涉及的变量
-    used_cols = list(set([dep_var] + control_vars + fe_vars + [interact_var1, interact_var2] + stage2_controls))
-    if st.session_state.get("vce_mode") == "vce(cluster)" and cluster_var in all_cols:
-        used_cols.append(cluster_var)
-    
     # 简单清洗：删除含有缺失值的行 (仅针对所选变量)
-    df_clean = df_base[used_cols].dropna().copy()
-    
-    # 创建变量名映射 (解决中文列名问题)
-    df_safe, col_map, reverse_map = safe_rename(df_clean)
+    # 类型压缩、分类编码与各列取值数只在数据或变量选择变化时计算一次
+    with perf_stage("样本准备"):
+        df_clean, cardinality, sample_key, n_complete = prepare_sample(uploaded_file, df_raw, base_mask, used_cols,
+                                                                       sample_filter, fe_vars)
+        # 单例观测 (某个固定效应组只有一个观测) 在第一阶段之前迭代剔除，与 reghdfe 一致
+        n_singletons = n_complete - len(df_clean)
+        # 创建变量名映射 (解决中文列名问题)
+        df_safe, col_map, reverse_map = safe_rename(df_clean)
     
     # 获取映射后的变量名
     safe_dep = col_map[dep_var]
@@ -284,25 +561,37 @@ def main():
     safe_fes = [col_map[c] for c in fe_vars]
     safe_interact1 = col_map[interact_var1]
     safe_interact2 = col_map[interact_var2]
+    safe_interacts = [safe_interact1, safe_interact2] + [col_map[c] for c in interact_extra]
     safe_stage2_controls = [col_map[c] for c in stage2_controls]
+    safe_cardinality = {col_map[c]: n for c, n in cardinality.items()}
     safe_cluster = col_map[cluster_var] if (st.session_state.get("vce_mode") == "vce(cluster)" and cluster_var in col_map) else None
 
     # --- 主界面 Tabs ---
-    tab1, tab2, tab3, tab4 = st.tabs(["📋 数据概览", "📈 第一阶段: 残差提取", "🔍 残差诊断", "🚀 第二阶段: 交互回归"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["📋 数据概览", "📈 第一阶段: 残差提取", "🔍 残差诊断", "🚀 第二阶段: 交互回归", "📦 批量分析", "🌲 子样本对比", "🧭 设定曲线"])
 
     with tab1:
         st.subheader("数据预览 (已自动剔除缺失值)")
-        st.markdown(f"有效样本量: **{len(df_clean)}** (原始: {len(df_raw)}, 剔除: {len(df_raw)-len(df_clean)})")
+        st.markdown(f"有效样本量: **{len(df_clean)}** (原始: {len(df_raw)}, 剔除: {len(df_raw)-len(df_clean)}，"
+                    f"其中固定效应单例 {n_singletons})")
         st.dataframe(df_clean.head())
         
         st.subheader("变量统计描述")
         st.dataframe(df_clean.describe())
 
+        labelled = {c: schema.value_labels[c] for c in used_cols if c in schema.value_labels}
+        if labelled:
+            with st.expander("值标签 (Stata value labels)"):
+                st.json({c: {str(k): v for k, v in lbl.items()} for c, lbl in labelled.items()})
+
     # --- Session State 管理 ---
     if 'resid_col' not in st.session_state:
         st.session_state.resid_col = None
     if 'is_stage1_done' not in st.session_state:
         st.session_state.is_stage1_done = False
+    # 第一阶段结果只在分析样本未变化时有效；残差以数组形式附加在共享的基础数据上 (浅拷贝，不复制数据)
+    stage1_ready = st.session_state.is_stage1_done and st.session_state.get('stage1_sample') == sample_key
+    stage1_stale = st.session_state.is_stage1_done and not stage1_ready
+    data_all = with_columns(df_safe, resid_sat=st.session_state.model1.resid.values) if stage1_ready else None
 
     with tab2:
         st.header("第一阶段回归")
@@ -310,113 +599,160 @@ def main():
         
         col1, col2 = st.columns([3, 1])
         with col1:
-            # 构建公式
-            fe_terms = [f"C({f})" for f in safe_fes]
-            formula_parts = safe_controls + fe_terms
-            formula_str = f"{safe_dep} ~ {' + '.join(formula_parts)}"
-            
-            st.code(f"Model: {dep_var} ~ {' + '.join(control_vars + [f'FixedEffect({f})' for f in fe_vars])}", language="python")
+            # 固定效应通过交替投影吸收 (reghdfe absorb)，不再展开为 C() 哑变量
+            st.code(f"reghdfe {dep_var} {' '.join(control_vars)}, absorb({' '.join(fe_vars)})", language="stata")
             
         with col2:
             run_stage1 = st.button("▶️ 运行回归", type="primary")
 
         if run_stage1:
-            with st.spinner("正在拟合模型..."):
-                try:
-                    model_inst = smf.ols(formula=formula_str, data=df_safe)
-                    if st.session_state.get("vce_mode") == "vce(cluster)":
-                        if safe_cluster:
-                            model1 = model_inst.fit(cov_type='cluster', cov_kwds={'groups': df_safe[safe_cluster]})
-                            st.info(f"已使用 vce(cluster): {cluster_var}")
-                        else:
-                            st.error("请选择聚类变量")
-                            return
-                    elif st.session_state.get("vce_mode") == "vce(robust)":
-                        model1 = model_inst.fit(cov_type='HC1')
-                        st.info("已使用 vce(robust)")
-                    else:
-                        model1 = model_inst.fit()
-                    
-                    # 保存残差
-                    df_safe['resid_sat'] = model1.resid
-                    df_clean['resid_sat'] = model1.resid # 同步回原数据方便展示
-                    
-                    st.session_state.model1 = model1
-                    st.session_state.df_safe_with_resid = df_safe
-                    st.session_state.df_clean_with_resid = df_clean
-                    st.session_state.is_stage1_done = True
-                    st.toast("第一阶段回归完成！", icon="✅")
-                    
-                except Exception as e:
-                    st.error(f"回归出错: {e}")
+            vce = VCE_TYPES[st.session_state.get("vce_mode", "不使用")]
+            if vce == "cluster" and not safe_cluster:
+                st.error("请选择聚类变量")
+                return
+            # 结果按 (数据指纹, 样本, 变量, 固定效应, VCE, 聚类) 缓存，重复运行或切回旧规格时直接复用
+            cluster_key = cluster_var if vce == "cluster" else None
+            key = result_key(upload_digest(uploaded_file), df_safe.index, dep_var, control_vars, fe_vars,
+                             vce, cluster_key, col_map)
+
+            def stage1_job(job):
+                job.progress(0.0, "拟合中")
+                fit = lambda: fit_hdfe(df_safe, safe_dep, safe_controls, safe_fes, vce=vce, cluster=safe_cluster,
+                                       singletons=n_singletons, callback=lambda it: job.progress(message=f"固定效应去均值：第 {it} 轮迭代"))
+                model1, source = get_result_cache().get_or_fit(key, fit, index=df_safe.index)
+                return {'model1': model1, 'source': source, 'sample_key': sample_key, 'vce': vce}
+
+            start_job('stage1', key, stage1_job, "第一阶段回归")
+
+        job_progress('stage1')
+        done = collect_job('stage1')
+        if done is not None:
+            model1 = done['model1']
+            if done['source'] != "fit":
+                st.caption("结果来自缓存" + ("(磁盘)" if done['source'] == "disk" else ""))
+            if done['vce'] == "cluster":
+                st.info(f"已使用 vce(cluster): {cluster_var}")
+            elif done['vce'] == "robust":
+                st.info("已使用 vce(robust)")
 
-        if st.session_state.is_stage1_done:
+            # 会话只保存结果 (含残差数组) 与样本标识，不保存数据副本
+            st.session_state.model1 = model1
+            st.session_state.stage1_sample = done['sample_key']
+            # 旧的第二阶段结果引用上一次的残差，一并释放
+            for stale_key in ('stage2_cp', 'stage2_result', 'stage2_active_cp', 'model2'):
+                st.session_state.pop(stale_key, None)
+            st.session_state.is_stage1_done = True
+            stage1_ready = done['sample_key'] == sample_key
+            stage1_stale = not stage1_ready
+            data_all = with_columns(df_safe, resid_sat=model1.resid.values) if stage1_ready else None
+            st.session_state.stage1_run_id = st.session_state.get('stage1_run_id', 0) + 1
+            st.toast("第一阶段回归完成！", icon="✅")
+
+        if stage1_stale:
+            st.info("变量选择或样本过滤已变化，请重新运行第一阶段回归。")
+        if stage1_ready:
             st.subheader("回归结果摘要")
             # 替换回中文变量名以便阅读
-            summary_str = st.session_state.model1.summary().as_text()
-            for safe_name, real_name in reverse_map.items():
-                summary_str = summary_str.replace(safe_name, real_name)
-            st.text(summary_str)
+            model1 = st.session_state.model1
+            with perf_stage("第一阶段摘要"):
+                st.text(model1.summary_text(title="HDFE Linear regression (absorbing fixed effects)", name_map=reverse_map))
+            if model1.dof_table is not None:
+                st.caption("吸收自由度 (Absorbed degrees of freedom)")
+                st.dataframe(model1.dof_table.replace({"absvar": reverse_map}))
 
     with tab3:
-        if not st.session_state.is_stage1_done:
+        if not stage1_ready:
             st.info("请先在“第一阶段”标签页运行回归。")
         else:
             st.header("残差诊断与清洗")
-            df_res = st.session_state.df_clean_with_resid
-            resid_vals = df_res['resid_sat']
-
-            # 1. 可视化
-            col_g1, col_g2 = st.columns(2)
-            with col_g1:
-                st.subheader("残差分布直方图")
-                fig_hist, ax_hist = plt.subplots(figsize=(6, 4))
-                sns.histplot(resid_vals, kde=True, color="skyblue", ax=ax_hist)
-                ax_hist.set_title("Histogram of Residuals")
-                st.pyplot(fig_hist)
-            
-            with col_g2:
-                st.subheader("Q-Q 图 (正态性检验)")
-                fig_qq, ax_qq = plt.subplots(figsize=(6, 4))
-                stats.probplot(resid_vals, dist="norm", plot=ax_qq)
-                ax_qq.get_lines()[0].set_color("skyblue")
-                ax_qq.get_lines()[1].set_color("red")
-                st.pyplot(fig_qq)
+            resid_vals = data_all['resid_sat']
+
+            # 1. 可视化：汇总量 (分箱、核密度、Q-Q 分位点) 每次第一阶段回归后只计算一次，绘图开销与样本量无关
+            with perf_stage("残差诊断图"):
+                cached_diag = st.session_state.get('resid_diagnostics')
+                if cached_diag is None or cached_diag[0] != st.session_state.get('stage1_run_id'):
+                    cached_diag = st.session_state.resid_diagnostics = (st.session_state.get('stage1_run_id'), ResidualDiagnostics(resid_vals.values))
+                diag = cached_diag[1]
+                col_g1, col_g2 = st.columns(2)
+                with col_g1:
+                    st.subheader("残差分布直方图")
+                    fig_hist = diag.histogram_figure()
+                    st.pyplot(fig_hist)
+                    plt.close(fig_hist)
+
+                with col_g2:
+                    st.subheader("Q-Q 图 (正态性检验)")
+                    fig_qq = diag.qq_figure()
+                    st.pyplot(fig_qq)
+                    plt.close(fig_qq)
+            if diag.n > len(diag.qq_sample):
+                st.caption(f"Q-Q 图两端尾部逐点绘制，中间部分按分位数抽取 (共 {len(diag.qq_sample)} 点 / {diag.n} 个样本)")
 
             # 2. 极端值检测
-            st.subheader("极端值检测 (3σ原则)")
-            mean_resid = resid_vals.mean()
-            std_resid = resid_vals.std()
-            threshold = 3 * std_resid
-            
-            df_res['is_extreme'] = df_res['resid_sat'].abs() > threshold
-            n_extreme = df_res['is_extreme'].sum()
+            st.subheader("极端值检测")
+            # 残差只在第一阶段结果变化时排序一次，之后每个阈值查询都是二分查找
+            cached_index = st.session_state.get('resid_index')
+            if cached_index is None or cached_index[0] != st.session_state.get('stage1_run_id'):
+                cached_index = st.session_state.resid_index = (st.session_state.get('stage1_run_id'), ResidualIndex(resid_vals.values))
+            resid_index = cached_index[1]
+
+            col_r1, col_r2 = st.columns(2)
+            with col_r1:
+                rule_label = st.selectbox("阈值规则", list(OUTLIER_RULES), index=0, key="outlier_rule")
+                rule = OUTLIER_RULES[rule_label]
+            with col_r2:
+                if rule == "percentile":
+                    rule_value = st.slider("剔除比例 p (%)", min_value=0.0, max_value=10.0, value=1.0, step=0.1, key="outlier_pct")
+                else:
+                    rule_value = st.slider("倍数 k", min_value=1.0, max_value=6.0, value=3.0, step=0.1, key="outlier_k")
+            threshold = resid_index.cutoff(rule, rule_value)
+            n_extreme = resid_index.count(rule, rule_value)
             
-            col_m1, col_m2, col_m3 = st.columns(3)
-            col_m1.metric("残差均值", f"{mean_resid:.4f}")
-            col_m2.metric("标准差 (σ)", f"{std_resid:.4f}")
-            col_m3.metric("极端值数量 (>3σ)", f"{n_extreme} ({n_extreme/len(df_res):.2%})")
+            col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+            col_m1.metric("残差均值", f"{resid_index.mean:.4f}")
+            col_m2.metric("标准差 (σ)", f"{resid_index.std:.4f}")
+            col_m3.metric("阈值 (偏离度)", f"{threshold:.4f}")
+            col_m4.metric("极端值数量", f"{n_extreme} ({n_extreme/resid_index.n:.2%})")
 
+            extreme_rows = resid_index.flagged_rows(rule, rule_value)
             if n_extreme > 0:
-                st.dataframe(df_res[df_res['is_extreme']].head())
+                # 偏离最大者在切片末尾
+                top = extreme_rows[::-1][:5]
+                st.dataframe(df_clean.iloc[top].assign(resid_sat=resid_vals.values[top]))
+
+            # 3. 阈值探索：标记数量与第二阶段交互项系数随阈值的变化
+            with st.expander("📉 阈值探索 (标记数量与交互项系数随阈值的变化)", expanded=False):
+                grid = default_grid(rule)
+                st.line_chart(pd.DataFrame({'极端值数量': resid_index.curve(rule, grid)}, index=pd.Index(grid, name=rule_label)))
+                if st.checkbox("计算交互项系数路径", value=True, key="show_coef_path"):
+                    try:
+                        vce = VCE_TYPES[st.session_state.get("vce_mode", "不使用")]
+                        design_s2, _ = stage2_design(data_all, safe_interacts, safe_stage2_controls, safe_cardinality)
+                        cp_full = session_cross_products(data_all, design_s2, vce, safe_cluster)
+                        terms = [n for n in cp_full.names if ':' in n]
+                        path = coefficient_path(cp_full, resid_index, rule, grid, vce=vce, terms=terms)
+                        path['变量'] = [translate_name(v, reverse_map) for v in path['变量']]
+                        for term, sub in path.groupby('变量', sort=False):
+                            st.caption(term)
+                            st.line_chart(sub.set_index('阈值')[['系数', 'CI下限', 'CI上限']])
+                    except Exception as e:
+                        st.warning(f"系数路径计算失败: {e}")
             
-            # 设置到 session state 供下一阶段使用
-            st.session_state.df_res_analyzed = df_res
-            st.session_state.df_safe_analyzed = st.session_state.df_safe_with_resid.copy()
-            st.session_state.df_safe_analyzed['is_extreme'] = df_res['is_extreme'].values # 确保对齐
+            # 设置到 session state 供下一阶段使用：只保存布尔掩码，不复制数据
+            st.session_state.extreme_mask = resid_index.mask(rule, rule_value)
 
     with tab4:
-        if 'df_safe_analyzed' not in st.session_state:
+        if not stage1_ready or 'extreme_mask' not in st.session_state:
              st.info("请先完成残差诊断。")
         else:
             st.header("第二阶段：交互效应分析")
             
             col_opt1, col_opt2 = st.columns(2)
             with col_opt1:
-                remove_extreme = st.toggle("剔除极端值样本", value=True)
+                remove_extreme = st.toggle("剔除极端值样本", value=True, key="remove_extreme")
             
             with col_opt2:
-                st.markdown(f"当前分析模型: **Residual ~ {interact_var1} × {interact_var2} + Controls**")
+                st.markdown(f"当前分析模型: **Residual ~ {' × '.join([interact_var1, interact_var2] + interact_extra)} + Controls**")
 
             st.subheader("图表与输出设置")
             col_set1, col_set2, col_set3 = st.columns(3)
@@ -463,143 +799,599 @@ def main():
                 ylabel_override = st.text_input("Y轴名称", value=f"Predicted Residual of {dep_var}", key="ylabel_override")
 
             run_stage2 = st.button("🚀 运行第二阶段回归", type="primary")
-            
+
+            # 不复制数据，极端值通过布尔掩码剔除
+            is_extreme = st.session_state.extreme_mask
+            # 判断是否需要Categorical处理
+            # 自动检测：如果是非数值列，或者数值列但唯一值较少，则视为分类变量
+            # 构建公式: resid ~ A * B + Controls
+            # 交互变量均为分类变量时使用稀疏的全因子设计 (A##B##...)
+            design_s2, is_cat = stage2_design(data_all, safe_interacts, safe_stage2_controls, safe_cardinality)
+            vce = VCE_TYPES[st.session_state.get("vce_mode", "不使用")]
+            cp_key = stage2_cp_key(design_s2, vce, safe_cluster)
+            # 第二阶段结果的标识：第一阶段结果、公式、VCE 与极端值掩码
+            stage2_key = cp_key + (content_hash(np.packbits(is_extreme)),)
+
             if run_stage2:
-                # 准备数据
-                data_for_reg = st.session_state.df_safe_analyzed.copy()
-                if remove_extreme:
-                    data_for_reg = data_for_reg[~data_for_reg['is_extreme']]
-                
-                # 判断是否需要Categorical处理
-                # 自动检测：如果是非数值列，或者数值列但唯一值较少，则视为分类变量
-                is_cat1 = is_categorical(data_for_reg[safe_interact1])
-                is_cat2 = is_categorical(data_for_reg[safe_interact2])
-                
-                term1 = f"C({safe_interact1})" if is_cat1 else safe_interact1
-                term2 = f"C({safe_interact2})" if is_cat2 else safe_interact2
-                
-                # 构建公式: resid ~ A * B + Controls
-                formula_s2 = f"resid_sat ~ {term1} * {term2}"
-                if safe_stage2_controls:
-                    formula_s2 += " + " + " + ".join(safe_stage2_controls)
-                
+                if vce == "cluster" and not safe_cluster:
+                    st.error("请选择聚类变量")
+                    return
+                cp_cached = cached_cross_products(cp_key)
+
+                def stage2_job(job):
+                    # 设计矩阵与交叉积只构建一次并缓存；剔除极端值的模型由低秩 downdate 得到
+                    cp_full = cp_cached
+                    if cp_full is None:
+                        job.progress(0.0, "构建设计矩阵")
+                        with job_stage(job, "第二阶段：设计矩阵与交叉积"):
+                            cp_full = stage2_cross_products(design_s2, data_all, safe_cluster if vce == "cluster" else None)
+                    job.progress(0.5, "求解")
+                    with job_stage(job, "第二阶段：剔除极端值与求解"):
+                        cp_trim = cp_full.excluding(is_extreme)
+                        model_all, model_trim = cp_full.fit(vce), cp_trim.fit(vce)
+                    return {'key': stage2_key, 'cp_key': cp_key, 'cp_full': cp_full, 'cp_trim': cp_trim,
+                            'model_all': model_all, 'model_trim': model_trim}
+
+                start_job('stage2', stage2_key, stage2_job, "第二阶段回归")
+
+            job_progress('stage2')
+            done = collect_job('stage2', hint="请检查变量类型是否正确，或者是否存在多重共线性问题。")
+            if done is not None:
+                st.session_state.stage2_cp = (done['cp_key'], done['cp_full'])
+                st.session_state.stage2_result = done
+                st.session_state.pop('boot_result', None)
+                st.session_state.pop('hypothesis_result', None)
+                st.success("分析完成！")
+
+            stage2 = st.session_state.get('stage2_result')
+            if stage2 is not None and stage2['key'] != stage2_key:
+                st.info("模型设定或极端值判定已变化，请重新运行第二阶段回归。")
+                for stale_key in ('stage2_result', 'stage2_active_cp', 'model2', 'boot_result', 'hypothesis_result'):
+                    st.session_state.pop(stale_key, None)
+                stage2 = None
+
+            if stage2 is not None:
+                model_all, model_trim = stage2['model_all'], stage2['model_trim']
+                model2 = model_trim if remove_extreme else model_all
+                rows_for_reg = ~is_extreme if remove_extreme else None
+                st.session_state.model2 = model2
+                st.session_state.stage2_active_cp = stage2['cp_trim'] if remove_extreme else stage2['cp_full']
                 try:
-                    with st.spinner("计算中..."):
-                        model_inst2 = smf.ols(formula=formula_s2, data=data_for_reg)
-                        if st.session_state.get("vce_mode") == "vce(cluster)":
-                            if safe_cluster:
-                                model2 = model_inst2.fit(cov_type='cluster', cov_kwds={'groups': data_for_reg[safe_cluster]})
-                            else:
-                                st.error("请选择聚类变量")
-                                return
-                        elif st.session_state.get("vce_mode") == "vce(robust)":
-                            model2 = model_inst2.fit(cov_type='HC1')
-                        else:
-                            model2 = model_inst2.fit()
-                        
-                        st.success("分析完成！")
-                        
-                        st.subheader("回归结果")
-                        coef_df = pd.DataFrame({
-                            '变量': model2.params.index,
-                            '系数': model2.params.values,
-                            '标准误': model2.bse.values,
-                            't值': model2.tvalues.values,
-                            'p值': model2.pvalues.values
-                        })
-                        ci = model2.conf_int()
-                        coef_df['CI下限'] = ci[0].values
-                        coef_df['CI上限'] = ci[1].values
-                        coef_df['变量'] = coef_df['变量'].replace(reverse_map)
-                        st.dataframe(coef_df)
-                        styled_html = coef_df.to_html(index=False)
-                        st.download_button("📥 下载系数表 (HTML)", data=styled_html, file_name="stage2_coefficients.html", mime="text/html")
-
-                        # --- 可视化 ---
-                        st.markdown("---")
-                        st.subheader("交互效应可视化 (Predictive Margins)")
-                        
-                        if is_cat1 and is_cat2:
-                            # 仅当两个都是分类变量时，绘图最有意义
-                            # 构造预测网格
-                            u1 = sorted(data_for_reg[safe_interact1].unique())
-                            u2 = sorted(data_for_reg[safe_interact2].unique())
-                            
-                            import itertools
-                            grid = list(itertools.product(u1, u2))
-                            pred_df = pd.DataFrame(grid, columns=[safe_interact1, safe_interact2])
-                            
-                            # 填充控制变量为均值或众数
-                            for c in safe_stage2_controls:
-                                if pd.api.types.is_numeric_dtype(data_for_reg[c]):
-                                    pred_df[c] = data_for_reg[c].mean()
-                                else:
-                                    pred_df[c] = data_for_reg[c].mode()[0]
-                            
-                            alpha = 1 - ci_level
-                            pred = model2.get_prediction(pred_df)
-                            sf = pred.summary_frame(alpha=alpha)
-                            pred_df['predicted_resid'] = sf['mean']
-                            pred_df['ci_lower'] = sf['mean_ci_lower']
-                            pred_df['ci_upper'] = sf['mean_ci_upper']
-                            
-                            # 映射回真实值用于绘图标签
-                            pred_df['Label_1'] = pred_df[safe_interact1] # 暂时保留原始值
-                            pred_df['Label_2'] = pred_df[safe_interact2]
-                            
-                            # 绘图
-                            fig_margin, ax_margin = plt.subplots(figsize=(fig_width/100, fig_height/100), dpi=fig_dpi)
-                            sns.set_style("whitegrid" if not grid_off else "white")
-                            plt.rcParams['font.size'] = font_size
-                            cats = sorted(pred_df[safe_interact1].unique())
-                            pos_map = {v:i for i,v in enumerate(cats)}
-                            for h in sorted(pred_df[safe_interact2].unique()):
-                                sub = pred_df[pred_df[safe_interact2] == h]
-                                x = [pos_map[v] for v in sub[safe_interact1]]
-                                y = sub['predicted_resid']
-                                if chart_type == "点图":
-                                    ax_margin.scatter(x, y, label=f"{interact_var2}={h}", color=line_color)
-                                elif chart_type == "折线图":
-                                    ax_margin.plot(x, y, marker='o', label=f"{interact_var2}={h}", linestyle=line_style, color=line_color)
-                                else: # 柱状图
-                                    ax_margin.bar(x, y, label=f"{interact_var2}={h}", color=line_color, alpha=0.8)
-                                if show_ci:
-                                    yerr_lower = y - sub['ci_lower']
-                                    yerr_upper = sub['ci_upper'] - y
-                                    ax_margin.errorbar(x, y, yerr=[yerr_lower, yerr_upper], fmt='none', ecolor='gray', capsize=4)
-                            ax_margin.set_xticks(list(range(len(cats))))
-                            ax_margin.set_xticklabels(cats)
-                            
-                            # 设置标签
-                            ax_margin.set_xlabel(xlabel_override)
-                            ax_margin.set_ylabel(ylabel_override)
-                            ax_margin.legend(title=interact_var2, loc=legend_loc)
-                            ax_margin.set_title(title_text, loc=title_loc)
-                            
-                            st.pyplot(fig_margin)
-                            buf = io.BytesIO()
-                            fig_margin.savefig(buf, format='png', dpi=fig_dpi, bbox_inches='tight')
-                            buf.seek(0)
-                            st.download_button("📥 下载图像 (PNG)", data=buf, file_name="margins_plot.png", mime="image/png")
-                            
-                            # 导出绘图数据
-                            export_df = pred_df.rename(columns=reverse_map)
-                            st.dataframe(export_df)
-                            st.download_button("📥 下载绘图数据 (CSV)", data=export_df.to_csv(index=False).encode('utf-8-sig'), file_name="plot_data.csv", mime="text/csv")
-                            # Excel 导出
-                            xbuf = io.BytesIO()
-                            with pd.ExcelWriter(xbuf, engine='openpyxl') as writer:
-                                export_df.to_excel(writer, index=False, sheet_name='margins')
-                            xbuf.seek(0)
-                            st.download_button("📥 下载边际效应 (Excel)", data=xbuf, file_name="margins_data.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                            margin_html = export_df.to_html(index=False)
-                            st.download_button("📥 下载边际效应数据 (HTML/Word兼容)", data=margin_html, file_name="margins_data.html", mime="text/html")
-                        else:
-                            st.warning("当前仅支持两个交互变量均为分类变量（或取值较少）时的自动绘图。")
+                    st.subheader("回归结果")
+                    with perf_stage("第二阶段结果表"):
+                        coef_df = coef_frame(model2, reverse_map)
+                    st.dataframe(coef_df)
+                    styled_html = coef_df.to_html(index=False)
+                    st.download_button("📥 下载系数表 (HTML)", data=styled_html, file_name="stage2_coefficients.html", mime="text/html")
+
+                    st.subheader("方案对比：不删除 / 删除极端值")
+                    st.dataframe(side_by_side({"方案1 (不删除极端值)": model_all, "方案2 (删除极端值)": model_trim}, reverse_map))
+
+                    # --- 可视化 ---
+                    st.markdown("---")
+                    st.subheader("交互效应可视化 (Predictive Margins)")
+
+                    col_mg1, col_mg2, col_mg3 = st.columns(3)
+                    with col_mg1:
+                        margins_type = st.selectbox("边际类型", list(MARGIN_TYPES.values()), index=0, key="margins_type",
+                                                    format_func={v: k for k, v in MARGIN_TYPES.items()}.get)
+                    # 连续交互变量的取值 (at)，留空时取分位数
+                    margins_at = {}
+                    for col_mg, var, safe_var, cat in [(col_mg2, interact_var1, safe_interact1, is_cat[0]),
+                                                       (col_mg3, interact_var2, safe_interact2, is_cat[1])]:
+                        if not cat:
+                            with col_mg:
+                                text = st.text_input(f"{var} 的取值 at() (逗号分隔)", value="", key=f"margins_at_{var}",
+                                                     help="留空时取第 10/25/50/75/90 百分位数")
+                                try:
+                                    values = parse_at_values(text)
+                                except ValueError:
+                                    # 只影响这一个变量：提示后改用默认分位数，不中断第二阶段结果的显示
+                                    st.error(f"无法解析 {var} 的 at() 取值，已改用默认分位数")
+                                    values = []
+                                if values:
+                                    margins_at[safe_var] = values
+
+                    # 预测边际由系数与协方差直接计算 (margins.Margins)；只改图形样式时沿用上次的结果
+                    alpha = 1 - ci_level
+                    margins_key = (stage2['key'], remove_extreme, margins_type,
+                                   json.dumps(margins_at, sort_keys=True), round(alpha, 6))
+                    cached_margins = st.session_state.get('margins_cache')
+                    if cached_margins is not None and cached_margins[0] == margins_key:
+                        margins2, pred_df = cached_margins[1:]
+                    else:
+                        with perf_stage("预测边际"):
+                            margins2 = interaction_margins(model2, data_all, safe_interacts, is_cat, safe_stage2_controls,
+                                                           how=margins_type, at=margins_at, rows=rows_for_reg)
+                            pred_df = margins_frame(margins2, alpha)
+                        st.session_state.margins_cache = (margins_key, margins2, pred_df)
+
+                    # 图形描述 (与命令行共用 plots.margins_figure)；DPI 只在导出时使用，不影响预览
+                    plot_cfg = {k: st.session_state[k] for k in PLOT_DEFAULTS if k in st.session_state and k != 'fig_dpi'}
+                    margins_spec = FigureSpec('margins', pred_df, {'col1': safe_interact1, 'col2': safe_interact2,
+                                                                   'settings': plot_cfg, 'label1': interact_var1,
+                                                                   'label2': interact_var2})
+                    with perf_stage("交互图预览"):
+                        preview, _ = render_cached(margins_spec, "png", PREVIEW_DPI)
+                    st.image(preview)
+
+                    # 高 DPI / 矢量格式在点击后才生成，结果按 (图形, 格式, DPI) 缓存
+                    col_ex1, col_ex2 = st.columns([1, 3])
+                    with col_ex1:
+                        ext = FIGURE_FORMATS[st.selectbox("导出格式", list(FIGURE_FORMATS), key="figure_format")]
+                    export_key = (margins_spec.key, ext, int(fig_dpi))
+                    with col_ex2:
+                        figure_data = get_figure_cache().get(export_key)
+                        if figure_data is None and st.button(f"🖼️ 生成图像 ({ext.upper()}, {int(fig_dpi)} DPI)"):
+                            with perf_stage("图像导出", fmt=ext, dpi=int(fig_dpi)):
+                                figure_data, _ = render_cached(margins_spec, ext, fig_dpi)
+                        if figure_data is not None:
+                            st.download_button(f"📥 下载图像 ({ext.upper()})", data=figure_data,
+                                               file_name=f"margins_plot.{ext}", mime=FIGURE_MIME[ext])
+
+                    # 导出绘图数据
+                    export_df = pred_df.rename(columns=reverse_map)
+                    st.dataframe(export_df)
+                    st.download_button("📥 下载绘图数据 (CSV)", data=export_df.to_csv(index=False).encode('utf-8-sig'), file_name="plot_data.csv", mime="text/csv")
+                    # Excel 导出
+                    xbuf = io.BytesIO()
+                    with pd.ExcelWriter(xbuf, engine='openpyxl') as writer:
+                        export_df.to_excel(writer, index=False, sheet_name='margins')
+                    xbuf.seek(0)
+                    st.download_button("📥 下载边际效应 (Excel)", data=xbuf, file_name="margins_data.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                    margin_html = export_df.to_html(index=False)
+                    st.download_button("📥 下载边际效应数据 (HTML/Word兼容)", data=margin_html, file_name="margins_data.html", mime="text/html")
+
+                    with st.expander("⚖️ 成对对比 (pairwise contrasts)"):
+                        direction = st.radio("比较方向", [f"在 {interact_var1} 的每个取值内比较 {interact_var2}",
+                                                          f"在 {interact_var2} 的每个取值内比较 {interact_var1}"],
+                                             key="contrast_direction")
+                        within, between = (safe_interact1, safe_interact2) if direction.startswith(f"在 {interact_var1}") \
+                            else (safe_interact2, safe_interact1)
+                        contrast_df = margins2.contrasts(between, within=within, alpha=alpha).rename(columns=reverse_map)
+                        contrast_df['对比'] = reverse_map[between] + ": " + contrast_df['对比']
+                        st.dataframe(contrast_df)
+                        st.download_button("📥 下载对比表 (CSV)", data=contrast_df.to_csv(index=False).encode('utf-8-sig'),
+                                           file_name="margins_contrasts.csv", mime="text/csv")
+
+                    with st.expander("📌 存储估计结果 (estimates store)"):
+                        st.caption("存储后可在本页底部的 esttab 面板中任选若干模型合并导出；同名覆盖。")
+                        store = estimates_store()
+                        est_index = 1
+                        while any(n.startswith(f"m{est_index}_") for n in store.names()):
+                            est_index += 1
+                        est_name = st.text_input("名称", value=f"m{est_index}")
+                        est_sources = {
+                            "方案1 (不删除极端值)": ("_all", lambda n: StoredEstimates.from_result(model_all, n, reverse_map)),
+                            "方案2 (删除极端值)": ("_trim", lambda n: StoredEstimates.from_result(model_trim, n, reverse_map)),
+                            "预测边际": ("_margins", lambda n: StoredEstimates.from_margins(margins2, n, reverse_map, model2.nobs)),
+                        }
+                        est_parts = st.multiselect("存储内容", list(est_sources), default=list(est_sources)[:2], key="est_parts")
+                        if st.button("📌 存储", key="est_store") and est_name.strip():
+                            for part in est_parts:
+                                suffix, build = est_sources[part]
+                                store.store(build(est_name.strip() + suffix))
+                            st.success(f"已存储: {', '.join(est_name.strip() + est_sources[p][0] for p in est_parts)}")
 
                 except Exception as e:
                     st.error(f"第二阶段分析出错: {e}")
                     st.markdown("**Debug 提示**: 请检查变量类型是否正确，或者是否存在多重共线性问题。")
 
+            # --- 线性约束检验 (test / lincom) ---
+            if 'model2' in st.session_state:
+                st.markdown("---")
+                with st.expander("🧮 假设检验 (test / lincom)"):
+                    model2 = st.session_state.model2
+                    parser = HypothesisParser(model2.params.index, reverse_map, model2.omitted)
+                    st.caption("每行一条命令，写法同 Stata，使用原始变量名：`test 2.A#2.B = 2.A`、"
+                               "`test (2.A = 0) (2.B = 0)` (联合检验)、`lincom 2.A + 2.A#2.B`；// 之后为注释。")
+                    st.caption("可用系数: " + "、".join(parser.labels(reverse_map)))
+                    inter_labels = [lab for lab in parser.labels(reverse_map) if '#' in lab]
+                    hyp_text = st.text_area("检验命令", value="\n".join(f"test {lab}" for lab in inter_labels[:1]),
+                                            height=120, key="hypothesis_text")
+                    try:
+                        hypotheses = parser.parse_lines(hyp_text)
+                    except ValueError as e:
+                        hypotheses = []
+                        st.error(f"无法解析: {e}")
+                    if hypotheses:
+                        hyp_table = evaluate(model2, hypotheses, alpha)
+                        if model2.vce == "cluster":
+                            st.caption("单个约束可附加野聚类自助 p 值 (重复次数、权重与种子取下方自助法面板的设置)。")
+                            hyp_opts = dict(reps=int(st.session_state.get('boot_reps', 9999)),
+                                            weights=st.session_state.get('boot_weights', WEIGHT_TYPES[0]),
+                                            seed=int(st.session_state.get('boot_seed', 12345)),
+                                            max_workers=int(st.session_state.get('boot_workers', 1)))
+                            hyp_key = (st.session_state.stage2_result['key'], remove_extreme, hyp_text, tuple(hyp_opts.items()))
+                            if st.button("▶️ 计算自助 p 值", key="hypothesis_boot"):
+                                active_cp = st.session_state.stage2_active_cp
+
+                                def hypothesis_job(job):
+                                    wcb = WildClusterBootstrap.from_cross_products(active_cp, model2)
+                                    p = bootstrap_pvalues(wcb, hypotheses, progress=job.counter("已完成检验"), **hyp_opts)
+                                    return {'key': hyp_key, 'p_boot': p}
+
+                                start_job('hypothesis', hyp_key, hypothesis_job, "假设检验自助 p 值")
+                            job_progress('hypothesis')
+                            done = collect_job('hypothesis')
+                            if done is not None:
+                                st.session_state.hypothesis_result = done
+                            hyp_boot = st.session_state.get('hypothesis_result')
+                            if hyp_boot is not None and hyp_boot['key'] == hyp_key:
+                                hyp_table['自助p值'] = hyp_boot['p_boot']
+                        st.dataframe(hyp_table)
+                        st.download_button("📥 下载检验结果 (CSV)", hyp_table.to_csv(index=False).encode('utf-8-sig'),
+                                           file_name="hypothesis_tests.csv", mime="text/csv")
+
+                # --- 野聚类自助法 (少聚类推断) ---
+                with st.expander("🎲 野聚类自助法 (Wild cluster bootstrap, 少聚类稳健推断)"):
+                    model2 = st.session_state.model2
+                    if model2.vce != "cluster":
+                        st.info("野聚类自助法需要 vce(cluster)，请选择聚类变量后重新运行第二阶段回归。")
+                    else:
+                        exog_names = list(model2.params.index)
+                        label_of = {n: translate_name(n, reverse_map) for n in exog_names}
+                        inter_terms = [n for n in exog_names if ':' in n]
+                        col_w1, col_w2, col_w3, col_w4 = st.columns(4)
+                        with col_w1:
+                            boot_reps = st.number_input("重复次数 B", min_value=199, max_value=99999, value=9999, step=1000, key="boot_reps")
+                        with col_w2:
+                            boot_weights = st.selectbox("权重", WEIGHT_TYPES, index=0, key="boot_weights")
+                        with col_w3:
+                            boot_seed = st.number_input("随机种子", min_value=0, value=12345, key="boot_seed")
+                        with col_w4:
+                            boot_workers = st.number_input("并行进程数", min_value=1, max_value=os.cpu_count() or 1, value=1, key="boot_workers")
+                        boot_terms = st.multiselect("检验的系数 (H0: 系数 = 0)", exog_names, default=inter_terms,
+                                                    format_func=label_of.get, key="boot_terms")
+                        st.caption("线性组合 (lincom)：为各项填写权重，检验 Σ 权重×系数 = 0；留空则不检验。")
+                        lincom_df = st.data_editor(
+                            pd.DataFrame({'项': [label_of[n] for n in exog_names], '权重': [None] * len(exog_names)}),
+                            disabled=['项'], hide_index=True, key="boot_lincom")
+                        weights_in = pd.to_numeric(lincom_df['权重'], errors='coerce').fillna(0).values
+                        opts = dict(reps=int(boot_reps), weights=boot_weights, seed=int(boot_seed), max_workers=int(boot_workers))
+                        boot_key = (st.session_state.stage2_result['key'], remove_extreme, tuple(boot_terms),
+                                    tuple(weights_in), tuple(opts.items()))
+                        if st.button("▶️ 运行自助检验"):
+                            active_cp = st.session_state.stage2_active_cp
+
+                            def boot_job(job):
+                                wcb = WildClusterBootstrap.from_cross_products(active_cp, model2)
+                                table = wcb.test_terms(boot_terms, progress=job.counter("已完成检验"), **opts)
+                                if np.any(weights_in != 0):
+                                    job.progress(message="线性组合检验")
+                                    res = wcb.test(dict(zip(exog_names, weights_in)), **opts)
+                                    combo = " + ".join(f"{w:g}×{label_of[n]}" for n, w in zip(exog_names, weights_in) if w != 0)
+                                    table = pd.concat([table, pd.DataFrame([{'变量': f"lincom: {combo}", **res}])], ignore_index=True)
+                                table['变量'] = [label_of.get(v, v) for v in table['变量']]
+                                return {'key': boot_key, 'table': table, 'G': wcb.G}
+
+                            start_job('bootstrap', boot_key, boot_job, "野聚类自助检验")
+
+                        job_progress('bootstrap')
+                        done = collect_job('bootstrap')
+                        if done is not None:
+                            st.session_state.boot_result = done
+                        boot = st.session_state.get('boot_result')
+                        if boot is not None and boot['key'] == boot_key:
+                            table = boot['table']
+                            if (table['enumerated']).any():
+                                st.info(f"聚类数 G={boot['G']}，2^G ≤ B，已对全部 Rademacher 符号组合枚举 (结果精确)。")
+                            st.dataframe(table.rename(columns={'estimate': '估计值', 'se': '聚类标准误', 't': 't值', 'p_boot': '自助p值', 'reps': '重复次数'}))
+
+                with st.expander("🧪 留一聚类刀切法与影响力诊断 (Jackknife / CV3)"):
+                    model2 = st.session_state.model2
+                    if model2.vce != "cluster":
+                        st.info("刀切法按聚类剔除，需要 vce(cluster)，请选择聚类变量后重新运行第二阶段回归。")
+                    else:
+                        exog_names = list(model2.params.index)
+                        label_of = {n: translate_name(n, reverse_map) for n in exog_names}
+                        jk_terms = st.multiselect("诊断的系数", exog_names, default=[n for n in exog_names if ':' in n],
+                                                  format_func=label_of.get, key="jk_terms")
+                        if jk_terms:
+                            influence, se_table = cluster_jackknife(st.session_state.stage2_active_cp, model2, terms=jk_terms)
+                            influence['变量'] = influence['变量'].map(label_of)
+                            se_table['变量'] = se_table['变量'].map(label_of)
+                            st.markdown(f"**CV3 刀切法标准误** (聚类数 G={influence['剔除聚类'].nunique()}，t 分布自由度 G-1)")
+                            st.dataframe(se_table)
+                            st.markdown(f"**逐个剔除 {cluster_var} 后的系数**")
+                            st.dataframe(influence)
+                            chart_term = st.selectbox("查看系数", se_table['变量'].tolist(), key="jk_chart_term")
+                            st.bar_chart(influence[influence['变量'] == chart_term].set_index('剔除聚类')['变化量'])
+
+            # --- 多模型表格导出 (esttab) ---
+            store = estimates_store()
+            if len(store):
+                st.markdown("---")
+                with st.expander(f"📚 估计结果表 (esttab，已存储 {len(store)} 个模型)", expanded=False):
+                    # 已删除的模型从选择中去掉，新存储的模型自动加入
+                    known = st.session_state.get('esttab_known', [])
+                    st.session_state.esttab_models = [n for n in st.session_state.get('esttab_models', []) if n in store] + \
+                        [n for n in store.names() if n not in known]
+                    st.session_state.esttab_known = store.names()
+                    if 'esttab_drop' in st.session_state:
+                        st.session_state.esttab_drop = [n for n in st.session_state.esttab_drop if n in store]
+                    tab_models = st.multiselect("选择模型 (按所选顺序排列)", store.names(), key="esttab_models")
+                    col_e1, col_e2, col_e3 = st.columns(3)
+                    with col_e1:
+                        tab_stat = st.radio("括号中", ["t", "se"], format_func={"t": "t 值", "se": "标准误"}.get,
+                                            horizontal=True, key="esttab_stat")
+                    with col_e2:
+                        tab_digits = st.number_input("小数位数", min_value=1, max_value=8, value=4, key="esttab_digits")
+                    with col_e3:
+                        tab_scalars = st.multiselect("统计量", list(SCALAR_LABELS), default=["N", "r2_a"],
+                                                     format_func=SCALAR_LABELS.get, key="esttab_scalars")
+                    if tab_models:
+                        table = esttab(store.get(tab_models), stat=tab_stat, digits=int(tab_digits), scalars=tab_scalars)
+                        st.dataframe(table.to_frame(), hide_index=True)
+                        st.caption("；".join(table.notes))
+                        mimes = {"rtf": "application/rtf", "tex": "application/x-tex", "xlsx":
+                                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                 "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+                        for col_dl, (label, fmt) in zip(st.columns(len(EXPORT_FORMATS)), EXPORT_FORMATS.items()):
+                            with col_dl:
+                                st.download_button(f"📥 {label}", data=table.export(fmt), file_name=f"esttab.{fmt}",
+                                                   mime=mimes[fmt], key=f"esttab_dl_{fmt}")
+                    drop = st.multiselect("删除已存储的模型", store.names(), key="esttab_drop")
+                    if st.button("🗑️ 删除", key="esttab_drop_btn") and drop:
+                        store.drop(drop)
+                        st.rerun()
+
+    with tab5:
+        st.header("批量交互分析")
+        st.markdown("一次运行多组交互规格 (如性别、年龄、学历、户籍……)：第一阶段规格相同的只拟合一次并复用残差，"
+                    "第二阶段在多个进程上并行，结果合并为一张表。每行可额外指定第一阶段要剔除的控制变量。")
+        default_rows = pd.DataFrame([{
+            '标签': f"{interact_var1} × {interact_var2}",
+            '交互变量A': interact_var1,
+            '交互变量B': interact_var2,
+            '第二阶段控制': ", ".join(stage2_controls),
+            '第一阶段剔除控制': "",
+        }])
+        batch_rows = st.data_editor(
+            default_rows, num_rows="dynamic", key="batch_specs",
+            column_config={
+                '交互变量A': st.column_config.SelectboxColumn(options=all_cols, required=True),
+                '交互变量B': st.column_config.SelectboxColumn(options=all_cols, required=True),
+                '第二阶段控制': st.column_config.TextColumn(help="多个变量用逗号分隔"),
+                '第一阶段剔除控制': st.column_config.TextColumn(help="从侧边栏的第一阶段控制变量中剔除，多个变量用逗号分隔"),
+            },
+        )
+        col_b1, col_b2, col_b3 = st.columns(3)
+        with col_b1:
+            batch_remove_extreme = st.toggle("剔除极端值样本", value=True, key="batch_remove_extreme")
+        with col_b2:
+            batch_workers = st.number_input("并行进程数", min_value=1, max_value=os.cpu_count() or 1,
+                                            value=min(4, os.cpu_count() or 1), key="batch_workers")
+        with col_b3:
+            batch_ci = st.slider("置信水平", min_value=0.80, max_value=0.99, value=0.95, step=0.01, key="batch_ci")
+
+        if st.button("📦 运行批量分析", type="primary"):
+            def split_vars(text):
+                return [v.strip() for v in re.split(r"[,，]", text or "") if v.strip()]
+
+            specs = []
+            for _, row in batch_rows.dropna(subset=['交互变量A', '交互变量B']).iterrows():
+                dropped = split_vars(row['第一阶段剔除控制'])
+                spec = {
+                    'label': row['标签'] or None,
+                    'dep_var': dep_var,
+                    'control_vars': [c for c in control_vars if c not in dropped],
+                    'fe_vars': fe_vars,
+                    'vce_mode': st.session_state.get("vce_mode", "不使用"),
+                    'cluster_var': cluster_var,
+                    'interact_var1': row['交互变量A'],
+                    'interact_var2': row['交互变量B'],
+                    'stage2_controls': split_vars(row['第二阶段控制']),
+                    **outlier_config(),
+                }
+                unknown = [c for c in spec_columns(spec) if c not in all_cols]
+                if unknown:
+                    st.error(f"规格「{spec_label(spec)}」包含不存在的变量: {unknown}")
+                    return
+                specs.append(spec)
+            if not specs:
+                st.warning("请至少填写一组交互规格")
+            elif st.session_state.get("vce_mode") == "vce(cluster)" and cluster_var not in all_cols:
+                st.error("请选择聚类变量")
+            else:
+                try:
+                    cols = list(dict.fromkeys(c for s in specs for c in spec_columns(s)))
+                    df_batch, _ = load_columns(uploaded_file, cols)
+                    # 与单次分析使用相同的子样本过滤
+                    if base_mask is not None:
+                        df_batch = df_batch[base_mask]
+                except Exception as e:
+                    st.error(f"批量分析出错: {e}")
+                    return
+                batch_key = (upload_digest(uploaded_file), sample_filter, json.dumps(specs, ensure_ascii=False),
+                             batch_remove_extreme, batch_ci, int(batch_workers))
+                start_job('batch', batch_key, lambda job: run_batch(
+                    df_batch, specs, remove_extreme=batch_remove_extreme, ci_level=batch_ci,
+                    max_workers=int(batch_workers), progress=job.counter("第二阶段回归"),
+                ), "批量分析")
+
+        job_progress('batch')
+        done = collect_job('batch')
+        if done is not None:
+            st.session_state.batch_result = done
+
+        if 'batch_result' in st.session_state:
+            res = st.session_state.batch_result
+            st.success(f"共 {res['n_specs']} 组规格，第一阶段实际拟合 {res['n_stage1_fits']} 次，共同样本量 {res['n_obs']}")
+            coefs = res['coefs']
+            if st.checkbox("仅显示交互项", value=True, key="batch_only_interactions"):
+                coefs = coefs[coefs['变量'].str.contains(':', regex=False)]
+            st.dataframe(coefs)
+            st.download_button("📥 下载合并系数表 (CSV)", data=res['coefs'].to_csv(index=False).encode('utf-8-sig'),
+                               file_name="batch_coefficients.csv", mime="text/csv")
+            if len(res['margins']):
+                st.subheader("预测边际 (Predictive Margins)")
+                st.dataframe(res['margins'])
+                xbuf = io.BytesIO()
+                with pd.ExcelWriter(xbuf, engine='openpyxl') as writer:
+                    res['coefs'].to_excel(writer, index=False, sheet_name='coefficients')
+                    res['margins'].to_excel(writer, index=False, sheet_name='margins')
+                xbuf.seek(0)
+                st.download_button("📥 下载合并结果 (Excel)", data=xbuf, file_name="batch_results.xlsx",
+                                   mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+    with tab6:
+        st.header("子样本对比 (异质性分析)")
+        if not hetero_all:
+            st.info("请在侧边栏“异质性分析”中选择过滤变量并开启“并行估计全部子样本”。")
+        else:
+            st.markdown(f"按 **{hetero_var}** 拆分样本，各子样本同时运行第一、二阶段回归 (多进程并行)，"
+                        "比较交互项系数。固定效应分组编码在全样本上只计算一次。")
+            col_h1, col_h2, col_h3 = st.columns(3)
+            with col_h1:
+                sub_remove_extreme = st.toggle("剔除极端值样本", value=True, key="sub_remove_extreme")
+            with col_h2:
+                sub_workers = st.number_input("并行进程数", min_value=1, max_value=os.cpu_count() or 1,
+                                              value=min(4, os.cpu_count() or 1), key="sub_workers")
+            with col_h3:
+                sub_ci = st.slider("置信水平", min_value=0.80, max_value=0.99, value=0.95, step=0.01, key="sub_ci")
+
+            if st.button("🌲 运行子样本对比", type="primary"):
+                spec = {
+                    'dep_var': dep_var, 'control_vars': control_vars, 'fe_vars': fe_vars,
+                    'vce_mode': st.session_state.get("vce_mode", "不使用"), 'cluster_var': cluster_var,
+                    'interact_var1': interact_var1, 'interact_var2': interact_var2, 'interact_extra': interact_extra,
+                    'stage2_controls': stage2_controls, **outlier_config(),
+                }
+                if spec['vce_mode'] == "vce(cluster)" and cluster_var not in all_cols:
+                    st.error("请选择聚类变量")
+                    return
+                n_bins = int(st.session_state.get("hetero_bins", 4))
+                sub_key = (upload_digest(uploaded_file), hetero_var, n_bins, json.dumps(spec, ensure_ascii=False),
+                           sub_remove_extreme, sub_ci, int(sub_workers))
+                start_job('subgroups', sub_key, lambda job: run_subgroups(
+                    df_raw, spec, hetero_var, n_bins=n_bins, remove_extreme=sub_remove_extreme, ci_level=sub_ci,
+                    max_workers=int(sub_workers), progress=job.counter("子样本"),
+                ), "子样本对比")
+
+            job_progress('subgroups')
+            done = collect_job('subgroups')
+            if done is not None:
+                st.session_state.subgroup_result = done
+
+            if 'subgroup_result' in st.session_state:
+                forest, failed = st.session_state.subgroup_result
+                for g, err in failed:
+                    st.warning(f"子样本 {g} 估计失败: {err}")
+                if len(forest):
+                    st.dataframe(forest)
+                    terms = forest['变量'].unique().tolist()
+                    term = st.selectbox("森林图展示的交互项", terms, key="forest_term")
+                    sub = forest[forest['变量'] == term].reset_index(drop=True)
+                    fig_forest, ax_forest = plt.subplots(figsize=(8, 0.6 * len(sub) + 1.5))
+                    y_pos = np.arange(len(sub))[::-1]
+                    ax_forest.errorbar(sub['系数'], y_pos, xerr=[sub['系数'] - sub['CI下限'], sub['CI上限'] - sub['系数']],
+                                       fmt='o', color='#1f77b4', ecolor='gray', capsize=4)
+                    ax_forest.axvline(0, color='red', linestyle='--', linewidth=1)
+                    ax_forest.set_yticks(y_pos)
+                    ax_forest.set_yticklabels([f"{g} (N={n})" for g, n in zip(sub['子样本'], sub['N'])])
+                    ax_forest.set_xlabel("Coefficient")
+                    ax_forest.set_title(term)
+                    st.pyplot(fig_forest)
+                    plt.close(fig_forest)
+                    st.download_button("📥 下载子样本系数表 (CSV)", data=forest.to_csv(index=False).encode('utf-8-sig'),
+                                       file_name="subgroup_coefficients.csv", mime="text/csv")
+
+    with tab7:
+        st.header("设定曲线 (Specification Curve)")
+        st.markdown("第一阶段取控制变量与固定效应的不同组合，比较交互项系数是否稳健。"
+                    "同一组固定效应下只去均值一次，第二阶段的设计矩阵与交叉积在所有规格间共用；"
+                    "所有规格使用同一个无缺失样本，极端值规则与“残差诊断”页的设置一致。")
+        if not control_vars and not fe_vars:
+            st.info("请先在侧边栏选择控制变量或固定效应。")
+        else:
+            col_s1, col_s2 = st.columns(2)
+            # 选择“始终纳入”的变量 (默认为空)：侧边栏新增的变量自动参与组合
+            with col_s1:
+                keep_controls = st.multiselect("始终纳入的控制变量 (其余参与组合)", control_vars, key="spec_keep_controls")
+            with col_s2:
+                keep_fes = st.multiselect("始终纳入的固定效应 (其余参与组合)", fe_vars, key="spec_keep_fes")
+            vary_controls = [c for c in control_vars if c not in keep_controls]
+            vary_fes = [f for f in fe_vars if f not in keep_fes]
+            col_s3, col_s4, col_s5, col_s6 = st.columns(4)
+            with col_s3:
+                spec_max = st.number_input("最多规格数 (超过时随机抽取)", min_value=2, max_value=4096,
+                                           value=DEFAULT_MAX_SPECS, key="spec_max")
+            with col_s4:
+                spec_seed = st.number_input("抽样种子", min_value=0, value=0, key="spec_seed")
+            with col_s5:
+                spec_workers = st.number_input("并行进程数", min_value=1, max_value=os.cpu_count() or 1,
+                                               value=min(4, os.cpu_count() or 1), key="spec_workers")
+            with col_s6:
+                spec_ci = st.slider("置信水平", min_value=0.80, max_value=0.99, value=0.95, step=0.01, key="spec_ci")
+            spec_remove_extreme = st.toggle("剔除极端值样本", value=True, key="spec_remove_extreme")
+            n_total = 2 ** (len(vary_controls) + len(vary_fes))
+            st.caption(f"共 {n_total} 种组合，将估计 {min(n_total, int(spec_max))} 个规格。")
+
+            if st.button("🧭 运行设定曲线", type="primary"):
+                spec = {
+                    'dep_var': dep_var, 'control_vars': control_vars, 'fe_vars': fe_vars,
+                    'vce_mode': st.session_state.get("vce_mode", "不使用"), 'cluster_var': cluster_var,
+                    'interact_var1': interact_var1, 'interact_var2': interact_var2, 'interact_extra': interact_extra,
+                    'stage2_controls': stage2_controls,
+                    **outlier_config(),
+                }
+                if spec['vce_mode'] == "vce(cluster)" and cluster_var not in all_cols:
+                    st.error("请选择聚类变量")
+                    return
+                df_spec = df_raw[base_mask] if base_mask is not None else df_raw
+                spec_key = (upload_digest(uploaded_file), sample_filter, json.dumps(spec, ensure_ascii=False),
+                            tuple(vary_controls), tuple(vary_fes), int(spec_max), int(spec_seed),
+                            spec_remove_extreme, spec_ci, int(spec_workers))
+                start_job('speccurve', spec_key, lambda job: run_spec_curve(
+                    df_spec, spec, vary_controls=vary_controls, vary_fes=vary_fes, max_specs=int(spec_max),
+                    seed=int(spec_seed), remove_extreme=spec_remove_extreme, ci_level=spec_ci,
+                    max_workers=int(spec_workers), progress=job.counter("固定效应组合"),
+                ), "设定曲线")
+
+            job_progress('speccurve')
+            done = collect_job('speccurve')
+            if done is not None:
+                st.session_state.speccurve_result = done
+
+            if 'speccurve_result' in st.session_state:
+                curve, failed = st.session_state.speccurve_result
+                for spec_id, err in failed[:10]:
+                    st.warning(f"规格 {spec_id} 估计失败: {err}")
+                if len(failed) > 10:
+                    st.warning(f"另有 {len(failed) - 10} 个规格估计失败")
+                if len(curve):
+                    terms = curve['变量'].unique().tolist()
+                    term = st.selectbox("展示的交互项", terms, key="spec_term")
+                    sub = curve[curve['变量'] == term]
+                    col_m1, col_m2, col_m3 = st.columns(3)
+                    col_m1.metric("规格数", len(sub))
+                    col_m2.metric("系数中位数", f"{sub['系数'].median():.4f}")
+                    col_m3.metric(f"p < {1 - spec_ci:.2f} 的比例", f"{(sub['p值'] < 1 - spec_ci).mean():.1%}")
+                    curve_spec = FigureSpec('speccurve', curve, {'term': term, 'significance': 1 - spec_ci})
+                    st.image(render_cached(curve_spec, "png", PREVIEW_DPI)[0])
+                    st.download_button("📥 下载设定曲线图 (PNG)", data=render_cached(curve_spec, "png", 200)[0],
+                                       file_name="specification_curve.png", mime="image/png")
+                    st.dataframe(curve)
+                    st.download_button("📥 下载设定曲线系数表 (CSV)", data=curve.to_csv(index=False).encode('utf-8-sig'),
+                                       file_name="specification_curve.csv", mime="text/csv")
+
+    # --- 本会话内存占用 ---
+    with st.sidebar:
+        with st.expander("🧠 本会话内存占用"):
+            # 基础数据在缓存中被所有会话共用；会话中只保存结果、残差与掩码
+            sizes, shared_bytes = memory_report(st.session_state.items(), shared=[df_raw, df_clean])
+            sizes = {k: v for k, v in sizes.items() if v > 0}
+            session_bytes = sum(sizes.values())
+            # 旧流程中每次分析复制的整表：df_clean、df_clean/df_safe (含残差) 各一份、df_safe_analyzed、data_for_reg
+            legacy_bytes = 5 * deep_nbytes(df_clean)
+            col_mem1, col_mem2 = st.columns(2)
+            col_mem1.metric("会话私有数据", f"{session_bytes / 1024 ** 2:.2f} MB")
+            col_mem2.metric("共享基础数据", f"{shared_bytes / 1024 ** 2:.2f} MB")
+            st.caption(f"旧流程每次分析复制整表约 5 份 (约 {legacy_bytes / 1024 ** 2:.2f} MB)，现均为共享数据的视图或掩码")
+            if sizes:
+                st.dataframe(pd.DataFrame({'项目': list(sizes), 'MB': [v / 1024 ** 2 for v in sizes.values()]})
+                             .sort_values('MB', ascending=False), hide_index=True)
+
 if __name__ == "__main__":
-    main()
+    run_app()
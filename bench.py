@@ -0,0 +1,215 @@
+"""性能基准：在合成问卷数据 (synthetic.py) 上分阶段计时并记录内存峰值
+
+阶段与界面上的操作一一对应：
+    load         读取表头与所选列 (loader.read_header / read_columns)
+    clean        剔除缺失、类型压缩与分类编码、剔除固定效应单例、safe_rename
+    stage1       第一阶段 HDFE 回归及文本摘要
+    diagnostics  极端值标记与残差诊断图 (汇总计算 + 绘图)
+    stage2       第二阶段设计矩阵、交叉积与方案1/方案2 拟合
+    margins      预测边际
+    plot         交互效应图导出 PNG
+每个样本量在单独的 (spawn) 进程中运行，内存峰值互不影响。结果以 JSON lines 追加写入
+输出文件 (每行一个样本量，含 git 提交号与软件版本)，可用 --compare 与以前的结果对比。
+
+用法:
+    python bench.py [--sizes 10000 100000 1000000 5000000] [-o bench_results.jsonl] [--compare 旧结果.jsonl]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from diagnostics import ResidualDiagnostics
+from hdfe import fit_hdfe, prune_singletons
+from loader import read_columns, read_header
+from outliers import ResidualIndex
+from perf import StageRecorder, peak_rss
+from pipeline import (VCE_TYPES, coef_frame, config_columns, interaction_margins, make_pool, margins_frame,
+                      prepare_frame, safe_rename, spec_columns, stage2_cross_products, stage2_design, with_columns)
+from plots import PLOT_DEFAULTS, figure_png, margins_figure
+from synthetic import default_config, make_survey, write_survey
+
+STAGES = ("load", "clean", "stage1", "diagnostics", "stage2", "margins", "plot")
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 5_000_000)
+
+# --compare 时耗时增加超过该比例 (且绝对值超过 MIN_DELTA 秒，排除计时噪声) 的阶段标记为退化
+REGRESSION_THRESHOLD = 0.2
+MIN_DELTA = 0.05
+
+
+def run_pipeline(path, config, recorder, dpi=PLOT_DEFAULTS['fig_dpi']):
+    """按界面上的步骤运行一次完整分析，各阶段由 recorder 计时"""
+    name = path.lower()
+    with recorder.stage("load"):
+        with open(path, "rb") as buffer:
+            read_header(name, buffer)
+            df = read_columns(name, buffer, config_columns(config))
+
+    with recorder.stage("clean"):
+        df_clean, n_singletons = prune_singletons(prepare_frame(df[spec_columns(config)].dropna()), config['fe_vars'])
+        df_safe, col_map, reverse_map = safe_rename(df_clean)
+    del df
+
+    vce = VCE_TYPES[config['vce_mode']]
+    cluster = col_map[config['cluster_var']] if vce == "cluster" else None
+    interacts = [col_map[config['interact_var1']], col_map[config['interact_var2']]]
+    s2_controls = [col_map[c] for c in config['stage2_controls']]
+    with recorder.stage("stage1"):
+        model1 = fit_hdfe(df_safe, col_map[config['dep_var']], [col_map[c] for c in config['control_vars']],
+                          [col_map[c] for c in config['fe_vars']], vce=vce, cluster=cluster, singletons=n_singletons)
+        model1.summary_text(title="HDFE Linear regression (absorbing fixed effects)", name_map=reverse_map)
+
+    with recorder.stage("diagnostics"):
+        extreme = ResidualIndex(model1.resid.values).mask("sigma", 3.0)
+        diag = ResidualDiagnostics(model1.resid.values)
+        for fig in (diag.histogram_figure(), diag.qq_figure()):
+            figure_png(fig, 100)
+            plt.close(fig)
+
+    with recorder.stage("stage2"):
+        data_all = with_columns(df_safe, resid_sat=model1.resid.values)
+        design, is_cat = stage2_design(data_all, interacts, s2_controls)
+        cp = stage2_cross_products(design, data_all, cluster)
+        model_all, model_trim = cp.fit(vce), cp.excluding(extreme).fit(vce)
+        coef_frame(model_trim, reverse_map)
+
+    with recorder.stage("margins"):
+        margins = margins_frame(interaction_margins(model_trim, data_all, interacts, is_cat, s2_controls,
+                                                    rows=~extreme))
+
+    with recorder.stage("plot", dpi=dpi):
+        fig = margins_figure(margins, interacts[0], interacts[1], {'fig_dpi': dpi})
+        figure_png(fig, dpi)
+        plt.close(fig)
+    return {'n_obs': len(df_clean), 'n_singletons': n_singletons, 'n_extreme': int(extreme.sum()), 'n_clusters': model_trim.n_clusters}
+
+
+def bench_size(job):
+    """单个样本量的基准 (在新进程中执行)：生成并写出数据文件 (不计入阶段耗时)，再分阶段运行"""
+    n, fmt = job['n'], job['format']
+    t0 = time.perf_counter()
+    df = make_survey(n, seed=job['seed'])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"survey.{fmt}")
+        write_survey(df, path)
+        del df
+        setup_seconds = time.perf_counter() - t0
+        file_mb = os.path.getsize(path) / 1024 ** 2
+        # 新进程中第一次绘图要加载字体缓存等，先画一张空图，避免计入诊断阶段
+        fig = plt.figure()
+        figure_png(fig, 10)
+        plt.close(fig)
+        recorder = StageRecorder(trace_python=job['trace_python'])
+        info = run_pipeline(path, default_config(), recorder, dpi=job['dpi'])
+    return {'n': n, 'format': fmt, 'file_mb': file_mb, 'setup_seconds': setup_seconds, **info,
+            'total_seconds': recorder.total_seconds(), 'process_peak_rss_mb': (peak_rss() or 0) / 1024 ** 2 or None,
+            'stages': recorder.records}
+
+
+def environment():
+    """版本信息：git 提交号与主要依赖的版本"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def load_results(path):
+    """读取 JSON lines 结果文件，每个 (样本量, 格式) 取最后一次"""
+    latest = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                latest[(rec['n'], rec['format'])] = rec
+    return latest
+
+
+def stage_table(records):
+    """结果 -> 宽表 (行：样本量，列：各阶段耗时)"""
+    rows = {}
+    for rec in records:
+        row = {s['stage']: s['seconds'] for s in rec['stages']}
+        row['total'] = rec['total_seconds']
+        row['peak_rss_mb'] = rec['process_peak_rss_mb']
+        rows[rec['n']] = row
+    table = pd.DataFrame.from_dict(rows, orient="index").rename_axis("n")
+    return table[[c for c in STAGES if c in table.columns] + ['total', 'peak_rss_mb']]
+
+
+def compare(records, baseline, threshold=REGRESSION_THRESHOLD, min_delta=MIN_DELTA):
+    """与基线结果对比：各阶段耗时之比 (当前 / 基线)，超过 1 + threshold 且多用 min_delta 秒以上的记为退化"""
+    rows, regressions = [], []
+    for rec in records:
+        base = baseline.get((rec['n'], rec['format']))
+        if base is None:
+            continue
+        base_stages = {s['stage']: s['seconds'] for s in base['stages']}
+        for s in rec['stages']:
+            if s['stage'] not in base_stages or base_stages[s['stage']] <= 0:
+                continue
+            ratio = s['seconds'] / base_stages[s['stage']]
+            rows.append({'n': rec['n'], 'stage': s['stage'], 'baseline': base_stages[s['stage']],
+                         'current': s['seconds'], 'ratio': ratio})
+            if ratio > 1 + threshold and s['seconds'] - base_stages[s['stage']] > min_delta:
+                regressions.append((rec['n'], s['stage'], ratio))
+    return pd.DataFrame(rows), regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="两阶段残差回归的分阶段性能基准 (合成数据)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="样本量 (默认 1万~500万)")
+    parser.add_argument("--format", choices=["dta", "csv"], default="dta", help="数据文件格式 (默认 dta)")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据的随机种子")
+    parser.add_argument("--dpi", type=int, default=PLOT_DEFAULTS['fig_dpi'], help="导出图像的 DPI")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="同时记录 Python 分配峰值 (tracemalloc 会明显拖慢 pandas/patsy，耗时不宜与未开启时对比)")
+    parser.add_argument("-o", "--output", default="bench_results.jsonl", help="结果文件 (JSON lines，追加写入)")
+    parser.add_argument("--compare", help="与之对比的旧结果文件")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="退化阈值 (默认 0.2，即慢 20%%)")
+    args = parser.parse_args(argv)
+
+    # 先读取基线，以便 --compare 与 -o 为同一文件时与上一次结果对比
+    baseline = load_results(args.compare) if args.compare else None
+    env = environment()
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    records = []
+    for n in args.sizes:
+        print(f"N={n} ...", file=sys.stderr)
+        job = {'n': n, 'format': args.format, 'seed': args.seed, 'dpi': args.dpi,
+               'trace_python': args.tracemalloc}
+        # 每个样本量一个新进程：进程峰值内存只反映该样本量
+        with make_pool(1) as pool:
+            rec = {'timestamp': stamp, **env, **pool.submit(bench_size, job).result()}
+        records.append(rec)
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    with pd.option_context("display.width", 200, "display.float_format", "{:.3f}".format):
+        print(stage_table(records).to_string())
+        if baseline is not None:
+            table, regressions = compare(records, baseline, args.threshold)
+            if len(table):
+                print(table.to_string(index=False))
+            for n, stage, ratio in regressions:
+                print(f"退化: N={n} {stage} 耗时为基线的 {ratio:.2f} 倍", file=sys.stderr)
+            return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""命令行批量运行 (无需浏览器与 Streamlit 服务)
+
+用法:
+    python cli.py 数据.dta analysis_config.json [更多配置.json ...] -o 输出目录 [-j 进程数]
+
+配置文件即界面“配置管理”中导出的 analysis_config.json。数据文件只按所有配置
+涉及的列读取一次；各配置在进程池中并行运行，结果写入输出目录下以配置文件名命名的子目录：
+第一阶段摘要、第二阶段系数表 (CSV/HTML)、方案对比表、检验结果 (配置含 tests 时)、预测边际 (CSV/Excel)、
+esttab 风格的合并表 (两个方案与预测边际；RTF/DOCX/LaTeX/Excel) 与 PNG 图。
+"""
+import argparse
+import json
+import os
+import sys
+
+import matplotlib
+matplotlib.use("Agg")
+import pandas as pd
+
+from estimates import EXPORT_FORMATS, esttab
+from loader import read_columns, read_header
+from pipeline import config_columns, map_jobs, run_analysis
+from plots import FigureSpec, apply_font, plot_settings
+
+
+def write_outputs(result, config, out_dir):
+    """将一次分析的结果写入 out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "stage1_summary.txt"), "w", encoding="utf-8") as f:
+        f.write(result['stage1_summary'])
+    if result['dof_table'] is not None:
+        result['dof_table'].to_csv(os.path.join(out_dir, "stage1_dof.csv"), index=False, encoding="utf-8-sig")
+    coefs = result['coefs']
+    coefs.to_csv(os.path.join(out_dir, "stage2_coefficients.csv"), index=False, encoding="utf-8-sig")
+    with open(os.path.join(out_dir, "stage2_coefficients.html"), "w", encoding="utf-8") as f:
+        f.write(coefs.to_html(index=False))
+    result['comparison'].to_csv(os.path.join(out_dir, "stage2_comparison.csv"), encoding="utf-8-sig")
+    if result['tests'] is not None:
+        result['tests'].to_csv(os.path.join(out_dir, "stage2_tests.csv"), index=False, encoding="utf-8-sig")
+    table = esttab(result['estimates'], digits=config.get('esttab_digits', 4))
+    for fmt in EXPORT_FORMATS.values():
+        with open(os.path.join(out_dir, f"stage2_esttab.{fmt}"), "wb") as f:
+            f.write(table.export(fmt))
+
+    margins = result['margins']
+    margins.to_csv(os.path.join(out_dir, "margins_data.csv"), index=False, encoding="utf-8-sig")
+    with pd.ExcelWriter(os.path.join(out_dir, "margins_data.xlsx"), engine="openpyxl") as writer:
+        margins.to_excel(writer, index=False, sheet_name="margins")
+    settings = plot_settings(config)
+    apply_font(settings['font_choice'])
+    spec = FigureSpec('margins', margins, {'col1': config['interact_var1'], 'col2': config['interact_var2'],
+                                          'settings': settings})
+    with open(os.path.join(out_dir, "margins_plot.png"), "wb") as f:
+        f.write(spec.render("png", settings['fig_dpi']))
+
+
+def run_config_job(job):
+    """单个配置的完整分析与输出 (在工作进程中执行)"""
+    try:
+        result = run_analysis(job['data'], job['config'])
+        write_outputs(result, job['config'], job['out_dir'])
+        return {'name': job['name'], 'n_obs': result['n_obs'], 'n_singletons': result['n_singletons'],
+                'n_extreme': result['n_extreme'], 'error': None}
+    except Exception as e:
+        return {'name': job['name'], 'error': str(e)}
+
+
+def output_names(paths):
+    """各配置的输出子目录名 (配置文件名，重名时追加序号)"""
+    names, seen = [], {}
+    for p in paths:
+        stem = os.path.splitext(os.path.basename(p))[0]
+        seen[stem] = seen.get(stem, 0) + 1
+        names.append(stem if seen[stem] == 1 else f"{stem}_{seen[stem]}")
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="政务服务满意度两阶段残差回归 (命令行批量运行)")
+    parser.add_argument("data", help="数据文件 (.dta / .csv / .xlsx)")
+    parser.add_argument("configs", nargs="+", help="配置文件 (界面导出的 analysis_config.json)")
+    parser.add_argument("-o", "--output", default="output", help="输出目录 (默认 ./output)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="并行进程数 (默认 CPU 核数；1 表示顺序执行)")
+    args = parser.parse_args(argv)
+
+    configs = []
+    for path in args.configs:
+        with open(path, encoding="utf-8") as f:
+            configs.append(json.load(f))
+
+    name = args.data.lower()
+    with open(args.data, "rb") as buffer:
+        columns = read_header(name, buffer).columns
+        needed = list(dict.fromkeys(c for cfg in configs for c in config_columns(cfg)))
+        missing = [c for c in needed if c not in columns]
+        if missing:
+            parser.error(f"数据文件中缺少变量: {', '.join(missing)}")
+        df = read_columns(name, buffer, needed)
+    print(f"已读取 {len(df)} 行 × {len(needed)} 列", file=sys.stderr)
+
+    jobs = [{'name': n, 'config': cfg, 'data': df[config_columns(cfg)], 'out_dir': os.path.join(args.output, n)}
+            for n, cfg in zip(output_names(args.configs), configs)]
+    outputs = map_jobs(run_config_job, jobs, max_workers=args.jobs,
+                       progress=lambda i, n: print(f"[{i}/{n}]", file=sys.stderr))
+
+    n_failed = 0
+    for out in outputs:
+        if out['error'] is not None:
+            n_failed += 1
+            print(f"✗ {out['name']}: {out['error']}", file=sys.stderr)
+        else:
+            print(f"✓ {out['name']}: N={out['n_obs']}, 单例 {out['n_singletons']}, 极端值 {out['n_extreme']}")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""跨会话共享的数据集缓存：按文件内容哈希索引，LRU 淘汰，受内存预算约束
+
+Streamlit 每次控件交互都会重新执行 main()，而模块只在进程内导入一次，
+因此模块级的缓存实例天然被所有会话共享：两位分析人员上传同一文件只解析一次。
+缓存中的 DataFrame 被多个会话共用，调用方必须把它当作只读对象。
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# 默认内存预算 (MB)，可通过环境变量 APP_DATASET_CACHE_MB 配置
+DEFAULT_BUDGET_MB = float(os.environ.get("APP_DATASET_CACHE_MB", "1024"))
+
+
+def content_hash(data):
+    """文件字节内容的哈希 (blake2b，比 sha256 更快)"""
+    h = hashlib.blake2b(digest_size=16)
+    view = memoryview(data)
+    step = 8 << 20
+    for i in range(0, len(view), step):
+        h.update(view[i:i + step])
+    return h.hexdigest()
+
+
+def estimate_nbytes(obj):
+    """缓存条目的内存占用：DataFrame/Series 含 object 列中的字符串，其余对象取 nbytes 属性"""
+    if hasattr(obj, "memory_usage"):
+        return int(np.sum(obj.memory_usage(index=True, deep=True)))
+    return int(getattr(obj, "nbytes", 1024))
+
+
+def _root(arr):
+    """视图所引用的底层数组"""
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+    return arr
+
+
+def deep_nbytes(obj, seen=None, depth=0):
+    """对象中数组数据的内存占用 (递归进入容器与对象属性)
+
+    seen 记录已计入的底层数组，视图与被多处引用的数据只计一次。
+    """
+    seen = set() if seen is None else seen
+    if depth > 5 or obj is None or isinstance(obj, (str, bytes, int, float, bool, type)) or callable(obj):
+        return 0
+    if isinstance(obj, np.ndarray):
+        root = _root(obj)
+        if id(root) in seen:
+            return 0
+        seen.add(id(root))
+        return int(root.nbytes)
+    if isinstance(obj, pd.DataFrame):
+        return sum(deep_nbytes(obj[c], seen, depth + 1) for c in obj.columns)
+    if isinstance(obj, pd.Series):
+        values = obj.array
+        if isinstance(values, pd.Categorical):
+            return deep_nbytes(values.codes, seen, depth + 1) + deep_nbytes(values.categories.to_numpy(), seen, depth + 1)
+        if pd.api.types.is_numeric_dtype(obj) or pd.api.types.is_bool_dtype(obj):
+            return deep_nbytes(obj.to_numpy(), seen, depth + 1)
+        if id(values) in seen:
+            return 0
+        seen.add(id(values))
+        return int(obj.memory_usage(index=False, deep=True))
+    if isinstance(obj, dict):
+        return sum(deep_nbytes(v, seen, depth + 1) for v in obj.values())
+    if isinstance(obj, (list, tuple, set)):
+        return sum(deep_nbytes(v, seen, depth + 1) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return deep_nbytes(vars(obj), seen, depth + 1)
+    return 0
+
+
+def memory_report(items, shared=()):
+    """各项的数组数据占用 (字节)
+
+    shared 中的对象 (如多个会话共用的基础数据) 先行登记，其他项对它们的引用不重复计入。
+    返回 (各项字节数 dict, 共享对象字节数)。
+    """
+    seen = set()
+    shared_bytes = sum(deep_nbytes(obj, seen) for obj in shared)
+    sizes = {name: deep_nbytes(obj, seen) for name, obj in items}
+    return sizes, shared_bytes
+
+
+class DatasetCache:
+    """线程安全的 LRU 缓存，按字节预算淘汰最久未使用的条目"""
+
+    def __init__(self, budget_bytes, sizeof=estimate_nbytes):
+        self.budget_bytes = int(budget_bytes)
+        self.sizeof = sizeof
+        self._items = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.RLock()
+        self._inflight = {}  # key -> Event，避免并发会话重复解析同一文件
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(sz for _, sz in self._items.values())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._items:
+                del self._items[key]
+            if size > self.budget_bytes:
+                # 单个条目超出预算时不缓存，直接返回给调用方
+                return value
+            self._items[key] = (value, size)
+            self._evict()
+        return value
+
+    def _evict(self):
+        total = sum(sz for _, sz in self._items.values())
+        while total > self.budget_bytes and len(self._items) > 1:
+            _, (_, sz) = self._items.popitem(last=False)
+            total -= sz
+
+    def get_or_load(self, key, loader):
+        """命中则直接返回；否则调用 loader() 解析并写入缓存。返回 (value, 是否命中)"""
+        while True:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return self._items[key][0], True
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # 其他会话正在解析同一文件，等待其完成后重试
+            event.wait()
+        try:
+            value = loader()
+            self.put(key, value)
+            return value, False
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def resize(self, budget_bytes):
+        with self._lock:
+            self.budget_bytes = int(budget_bytes)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "nbytes": sum(sz for _, sz in self._items.values()),
+                    "budget_bytes": self.budget_bytes, "hits": self.hits, "misses": self.misses}
+
+
+_dataset_cache = DatasetCache(DEFAULT_BUDGET_MB * 1024 ** 2)
+
+
+def get_dataset_cache():
+    """进程级共享的数据集缓存实例"""
+    return _dataset_cache
@@ -0,0 +1,104 @@
+"""残差诊断图的汇总计算 (与样本量无关的绘图开销)
+
+直方图按分箱计数绘制，核密度由线性分箱 + FFT 卷积得到，Q-Q 图只取固定数量的分位点
+(两端尾部的次序统计量逐个保留，中间部分等距抽取)。汇总结果只依赖残差向量，
+每次第一阶段回归后计算一次并缓存；绘图只使用汇总结果，点数不随 N 增长。
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy import stats
+from scipy.signal import fftconvolve
+
+# 直方图最多分箱数
+MAX_BINS = 200
+
+# 核密度网格点数
+KDE_GRID = 1024
+
+# Q-Q 图：中间部分抽取的点数、两端各保留的次序统计量个数
+QQ_POINTS = 1000
+QQ_TAIL = 100
+
+
+def histogram(x, max_bins=MAX_BINS):
+    """分箱计数 (分箱规则同 numpy/seaborn 的 'auto'，箱数不超过 max_bins)；返回 (计数, 边界)"""
+    edges = np.histogram_bin_edges(x, bins="auto")
+    if len(edges) - 1 > max_bins:
+        edges = np.linspace(edges[0], edges[-1], max_bins + 1)
+    counts, edges = np.histogram(x, bins=edges)
+    return counts, edges
+
+
+def binned_kde(x, grid_size=KDE_GRID, cut=3.0):
+    """高斯核密度 (Scott 带宽，同 scipy.stats.gaussian_kde / seaborn)
+
+    先把样本线性分配到等距网格上，再与离散化的高斯核做 FFT 卷积，复杂度 O(N + M log M)。
+    返回 (网格, 密度)。
+    """
+    n = len(x)
+    bw = float(np.std(x, ddof=1)) * n ** (-1 / 5)
+    lo, hi = float(x.min()) - cut * bw, float(x.max()) + cut * bw
+    grid = np.linspace(lo, hi, grid_size)
+    delta = grid[1] - grid[0]
+    # 线性分箱：每个样本按距离分给相邻的两个网格点
+    pos = (x - lo) / delta
+    left = np.clip(np.floor(pos).astype(np.int64), 0, grid_size - 2)
+    frac = pos - left
+    weights = np.bincount(left, 1 - frac, minlength=grid_size) + np.bincount(left + 1, frac, minlength=grid_size)
+    half = min(int(np.ceil(cut * bw / delta)), grid_size - 1)
+    offsets = np.arange(-half, half + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bw) ** 2) / (bw * np.sqrt(2 * np.pi))
+    density = fftconvolve(weights, kernel, mode="same") / n
+    return grid, np.clip(density, 0, None)
+
+
+def qq_points(x, n_points=QQ_POINTS, tail=QQ_TAIL):
+    """Q-Q 图的分位点：返回 (次序号, 样本分位数)
+
+    两端各 tail 个次序统计量全部保留，中间等距抽取 n_points 个。
+    (对上千个次序做 np.partition 反而比一次 np.sort 慢得多，故直接排序。)
+    """
+    n = len(x)
+    if n <= n_points + 2 * tail:
+        ranks = np.arange(n)
+    else:
+        middle = np.linspace(tail, n - tail - 1, n_points).round().astype(np.int64)
+        ranks = np.unique(np.concatenate([np.arange(tail), middle, np.arange(n - tail, n)]))
+    return ranks, np.sort(x)[ranks]
+
+
+class ResidualDiagnostics:
+    """残差诊断图所需的全部汇总量 (计算一次，可重复绘图)"""
+
+    def __init__(self, resid):
+        x = np.asarray(resid, dtype=float)
+        self.n = len(x)
+        self.mean = float(x.mean())
+        self.std = float(x.std(ddof=1))
+        self.counts, self.edges = histogram(x)
+        self.kde_grid, self.kde_density = binned_kde(x)
+        ranks, self.qq_sample = qq_points(x)
+        # 绘图位置 i/(N+1)，与 Stata qnorm 一致
+        self.qq_theory = stats.norm.ppf((ranks + 1) / (self.n + 1))
+
+    def histogram_figure(self, figsize=(6, 4)):
+        fig, ax = plt.subplots(figsize=figsize)
+        widths = np.diff(self.edges)
+        ax.bar(self.edges[:-1], self.counts, width=widths, align="edge", color="skyblue", edgecolor="white", linewidth=0.3)
+        # 密度换算为计数尺度 (同 seaborn histplot(kde=True))
+        ax.plot(self.kde_grid, self.kde_density * self.n * widths.mean(), color="steelblue")
+        ax.set_xlabel("resid_sat")
+        ax.set_ylabel("Count")
+        ax.set_title("Histogram of Residuals")
+        return fig
+
+    def qq_figure(self, figsize=(6, 4)):
+        fig, ax = plt.subplots(figsize=figsize)
+        ax.plot(self.qq_theory, self.qq_sample, "o", color="skyblue", markersize=3)
+        # 参考线：均值、标准差与样本相同的正态分布 (Stata qnorm)
+        z = self.qq_theory[[0, -1]]
+        ax.plot(z, self.mean + self.std * z, color="red")
+        ax.set_xlabel("Theoretical quantiles")
+        ax.set_ylabel("Ordered Values")
+        ax.set_title("Probability Plot")
+        return fig
@@ -0,0 +1,285 @@
+"""估计结果存储与 esttab 风格的多模型表格 (Stata 的 estimates store / esttab)
+
+每次存储只保留紧凑摘要：系数、标准误、t、p 与少量统计量 (N、R² 等)，不含残差与数据。
+表格按变量名 (Stata 写法，如 2.A#2.B) 对齐各模型的列；每个模型的格式化结果按格式选项缓存，
+导出任意多个模型只是格式化与拼接，不重新拟合。输出 RTF / DOCX / LaTeX / Excel，
+DOCX 直接写出 OOXML (zip + XML)，不依赖 python-docx。
+"""
+import io
+import zipfile
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from hypothesis import coef_label
+
+# 显著性星号 (esttab 默认：* p<0.05, ** p<0.01, *** p<0.001)
+DEFAULT_STARS = ((0.05, "*"), (0.01, "**"), (0.001, "***"))
+
+SCALAR_LABELS = {"N": "N", "r2": "R-sq", "r2_a": "adj. R-sq", "r2_w": "within R-sq", "N_clust": "N_clust"}
+
+EXPORT_FORMATS = {"RTF (Word)": "rtf", "DOCX": "docx", "LaTeX": "tex", "Excel": "xlsx"}
+
+
+def _level_text(value):
+    """取值的显示文本 (整数值的浮点数去掉 .0，与系数名中的水平写法一致)"""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class StoredEstimates:
+    """一个已存储模型的紧凑摘要"""
+
+    def __init__(self, name, labels, b, se, p, t=None, scalars=None):
+        self.name = name
+        self.labels = list(labels)
+        self.b = np.asarray(b, dtype=float)
+        self.se = np.asarray(se, dtype=float)
+        self.p = np.asarray(p, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.t = self.b / self.se if t is None else np.asarray(t, dtype=float)
+        self.scalars = dict(scalars or {})
+        self._formatted = {}
+
+    @classmethod
+    def from_result(cls, result, name, reverse_map=None):
+        """由 regression.RegressionResult 构建 (项名转为 Stata 写法的原始变量名)"""
+        scalars = {"N": result.nobs, "r2": result.rsquared, "r2_a": result.rsquared_adj,
+                   "r2_w": result.rsquared_within, "N_clust": result.n_clusters}
+        return cls(name, [coef_label(n, reverse_map) for n in result.params.index], result.params.values,
+                   result.bse.values, result.pvalues.values, result.tvalues.values,
+                   {k: v for k, v in scalars.items() if v is not None and not pd.isna(v)})
+
+    @classmethod
+    def from_margins(cls, margins, name, reverse_map=None, nobs=None):
+        """由 margins.Margins 构建 (同 Stata 的 margins, post)，每个格子一行，如 margins:1.A#2.B
+
+        行名带方程名前缀 margins:，以免与同名的交互项系数对齐到同一行。
+        """
+        sf = margins.summary_frame()
+        over = list(margins.grid.columns)
+        reverse_map = reverse_map or {}
+        labels = ["margins:" + "#".join(f"{_level_text(row[v])}.{reverse_map.get(v, v)}" for v in over)
+                  for _, row in sf.iterrows()]
+        scalars = {"N": nobs} if nobs is not None else {}
+        return cls(name, labels, sf['margin'].values, sf['se'].values, sf['p'].values, sf['t'].values, scalars)
+
+    def formatted(self, stat="t", digits=4, stars=DEFAULT_STARS):
+        """{变量: (系数文本, 星号, 统计量文本)}，按格式选项缓存"""
+        key = (stat, digits, tuple(stars))
+        if key not in self._formatted:
+            values = self.t if stat == "t" else self.se
+            cells = {}
+            for label, b, v, p in zip(self.labels, self.b, values, self.p):
+                mark = ""
+                for level, symbol in stars:
+                    if p < level:
+                        mark = symbol
+                cells[label] = (f"{b:.{digits}f}", mark, f"({v:.{digits}f})")
+            self._formatted[key] = cells
+        return self._formatted[key]
+
+
+class EstimatesStore:
+    """会话中的 estimates store：按名称保存模型摘要 (同名覆盖，保持存储顺序)"""
+
+    def __init__(self):
+        self._items = OrderedDict()
+
+    def store(self, est):
+        self._items.pop(est.name, None)
+        self._items[est.name] = est
+
+    def drop(self, names):
+        for n in names:
+            self._items.pop(n, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def names(self):
+        return list(self._items)
+
+    def get(self, names=None):
+        return [self._items[n] for n in (self._items if names is None else names)]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, name):
+        return name in self._items
+
+
+class EstTable:
+    """拼好的多模型表：表头、系数行 (系数 + 统计量两行) 与统计量行"""
+
+    def __init__(self, headers, rows, scalar_rows, notes):
+        self.headers = headers          # 模型名
+        self.rows = rows                # [(变量, [(系数, 星号, 统计量) 或 None, ...])]
+        self.scalar_rows = scalar_rows  # [(标签, [文本, ...])]
+        self.notes = notes
+
+    def lines(self, star_fmt=lambda s: s):
+        """系数部分展开为文本行 [(首列, [单元格...])]，每个变量占系数、统计量两行；star_fmt 决定星号的写法"""
+        out = []
+        for label, cells in self.rows:
+            out.append((label, [c[0] + star_fmt(c[1]) if c else "" for c in cells]))
+            out.append(("", [c[2] if c else "" for c in cells]))
+        return out
+
+    def to_frame(self):
+        lines = self.lines()
+        data = [[label] + cells for label, cells in lines] + [[label] + cells for label, cells in self.scalar_rows]
+        columns = [""] + [f"({i}) {h}" for i, h in enumerate(self.headers, 1)]
+        return pd.DataFrame(data, columns=columns)
+
+    def to_excel(self):
+        buf = io.BytesIO()
+        frame = self.to_frame()
+        notes = pd.DataFrame([[n] + [""] * (frame.shape[1] - 1) for n in self.notes], columns=frame.columns)
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            pd.concat([frame, notes], ignore_index=True).to_excel(writer, index=False, sheet_name="esttab")
+        return buf.getvalue()
+
+    def to_latex(self):
+        m = len(self.headers)
+        tex = lambda s: (str(s).replace("\\", "\\textbackslash{}").replace("_", "\\_").replace("#", "\\#")
+                         .replace("&", "\\&").replace("%", "\\%"))
+        row = lambda first, cells: tex(first).ljust(20) + "".join(f"&{c:>14s}" for c in cells) + "\\\\"
+        lines = ["{", "\\def\\sym#1{\\ifmmode^{#1}\\else\\(^{#1}\\)\\fi}",
+                 f"\\begin{{tabular}}{{l*{{{m}}}{{c}}}}", "\\hline\\hline",
+                 row("", [f"\\multicolumn{{1}}{{c}}{{({i})}}" for i in range(1, m + 1)]),
+                 row("", [f"\\multicolumn{{1}}{{c}}{{{tex(h)}}}" for h in self.headers]), "\\hline"]
+        lines += [row(label, cells) for label, cells in self.lines(lambda s: f"\\sym{{{s}}}" if s else "")]
+        if self.scalar_rows:
+            lines.append("\\hline")
+            lines += [row(label, cells) for label, cells in self.scalar_rows]
+        lines.append("\\hline\\hline")
+        lines += [f"\\multicolumn{{{m + 1}}}{{l}}{{\\footnotesize {tex(n)}}}\\\\" for n in self.notes]
+        lines += ["\\end{tabular}", "}"]
+        return "\n".join(lines) + "\n"
+
+    def to_rtf(self):
+        def rtf(s):
+            out = []
+            for ch in str(s):
+                code = ord(ch)
+                if ch in "\\{}":
+                    out.append("\\" + ch)
+                elif code < 128:
+                    out.append(ch)
+                else:
+                    # \uN 取有符号 16 位值，BMP 之外的字符写成代理对
+                    data = ch.encode("utf-16-le")
+                    for i in range(0, len(data), 2):
+                        unit = int.from_bytes(data[i:i + 2], "little")
+                        out.append(f"\\u{unit - 65536 if unit > 32767 else unit}?")
+            return "".join(out)
+
+        m = len(self.headers)
+        widths = [2800] + [1600] * m
+        bounds = np.cumsum(widths)
+
+        def row(cells, top=False, bottom=False):
+            border = ("\\clbrdrt\\brdrs\\brdrw10" if top else "") + ("\\clbrdrb\\brdrs\\brdrw10" if bottom else "")
+            head = "\\trowd\\trgaph108\\trleft0" + "".join(f"{border}\\cellx{x}" for x in bounds)
+            aligns = ["\\ql"] + ["\\qc"] * (len(cells) - 1)
+            body = "".join(f"\\pard\\intbl{a} {rtf(c)}\\cell" for a, c in zip(aligns, cells))
+            return head + body + "\\row"
+
+        lines = ["{\\rtf1\\ansi\\deff0{\\fonttbl{\\f0\\fnil Times New Roman;}}\\fs20",
+                 row([""] + [f"({i})" for i in range(1, m + 1)], top=True),
+                 row([""] + self.headers, bottom=True)]
+        body = [[label] + cells for label, cells in self.lines()]
+        body += [[label] + cells for label, cells in self.scalar_rows]
+        for i, cells in enumerate(body):
+            last = i == len(body) - 1
+            first_scalar = bool(self.scalar_rows) and i == 2 * len(self.rows)
+            lines.append(row(cells, top=first_scalar, bottom=last))
+        lines += [f"\\pard\\ql\\fs16 {rtf(n)}\\par" for n in self.notes]
+        lines.append("}")
+        return "\n".join(lines)
+
+    def to_docx(self):
+        """最小的 Word 文档 (三线表)"""
+        def cell(text, top=False, bottom=False, left_align=False):
+            borders = "".join(f'<w:{side} w:val="single" w:sz="8" w:space="0" w:color="000000"/>'
+                              for side, on in (("top", top), ("bottom", bottom)) if on)
+            jc = "left" if left_align else "center"
+            return (f'<w:tc><w:tcPr><w:tcBorders>{borders}</w:tcBorders></w:tcPr>'
+                    f'<w:p><w:pPr><w:jc w:val="{jc}"/></w:pPr><w:r><w:t xml:space="preserve">{escape(str(text))}'
+                    f'</w:t></w:r></w:p></w:tc>')
+
+        def row(cells, top=False, bottom=False):
+            return "<w:tr>" + "".join(cell(c, top, bottom, i == 0) for i, c in enumerate(cells)) + "</w:tr>"
+
+        m = len(self.headers)
+        rows = [row([""] + [f"({i})" for i in range(1, m + 1)], top=True), row([""] + self.headers, bottom=True)]
+        body = [[label] + cells for label, cells in self.lines()]
+        body += [[label] + cells for label, cells in self.scalar_rows]
+        for i, cells in enumerate(body):
+            first_scalar = bool(self.scalar_rows) and i == 2 * len(self.rows)
+            rows.append(row(cells, top=first_scalar, bottom=i == len(body) - 1))
+        notes = "".join(f'<w:p><w:r><w:rPr><w:sz w:val="16"/></w:rPr><w:t xml:space="preserve">{escape(n)}</w:t></w:r></w:p>'
+                        for n in self.notes)
+        ns = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+        document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {ns}><w:body>'
+                    f'<w:tbl><w:tblPr><w:tblW w:w="0" w:type="auto"/></w:tblPr>{"".join(rows)}</w:tbl>'
+                    f'{notes}<w:sectPr/></w:body></w:document>')
+        content_types = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-'
+                         'officedocument.wordprocessingml.document.main+xml"/></Types>')
+        rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+                'officeDocument" Target="word/document.xml"/></Relationships>')
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("[Content_Types].xml", content_types)
+            z.writestr("_rels/.rels", rels)
+            z.writestr("word/document.xml", document)
+        return buf.getvalue()
+
+    def export(self, fmt):
+        """按格式导出为字节 (rtf / docx / tex / xlsx)"""
+        if fmt == "rtf":
+            return self.to_rtf().encode("ascii")
+        if fmt == "tex":
+            return self.to_latex().encode("utf-8")
+        if fmt == "docx":
+            return self.to_docx()
+        if fmt == "xlsx":
+            return self.to_excel()
+        raise ValueError(f"未知的导出格式: {fmt}")
+
+
+def esttab(models, stat="t", digits=4, stars=DEFAULT_STARS, scalars=("N", "r2_a"), keep=None):
+    """把若干 StoredEstimates 拼成一张表 (变量按首次出现的顺序对齐，_cons 放在最后)
+
+    stat: "t" 或 "se" (括号中的统计量)；keep: 只保留的变量 (Stata 写法)。
+    """
+    columns = [est.formatted(stat, digits, stars) for est in models]
+    order = list(dict.fromkeys(label for est in models for label in est.labels))
+    if "_cons" in order:
+        order.remove("_cons")
+        order.append("_cons")
+    if keep is not None:
+        keep = set(keep)
+        order = [label for label in order if label in keep]
+    rows = [(label, [col.get(label) for col in columns]) for label in order]
+
+    def scalar_text(name, value):
+        if value is None or pd.isna(value):
+            return ""
+        return f"{int(value)}" if name in ("N", "N_clust") else f"{value:.{digits}f}"
+
+    scalar_rows = [(SCALAR_LABELS.get(s, s), [scalar_text(s, est.scalars.get(s)) for est in models]) for s in scalars]
+    notes = ["t statistics in parentheses" if stat == "t" else "Standard errors in parentheses",
+             ", ".join(f"{symbol} p<{level:g}" for level, symbol in stars)]
+    return EstTable([est.name for est in models], rows, scalar_rows, notes)
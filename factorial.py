@@ -0,0 +1,211 @@
+"""分类变量全因子交互的稀疏设计矩阵，对应 Stata 的 i.a##i.b##i.c ...
+
+patsy 的 C(a)*C(b)*C(c) 为完全交叉的每个格子生成一列稠密哑变量，高阶交互时绝大多数元素为 0。
+这里按整数编码直接构造 CSR 稀疏矩阵：每行在每个交互项中至多一个非零元，
+样本中不存在的格子 (Stata 标注为 empty) 不生成列，共线列由 rmcoll 在 X'X 上剔除。
+列名与 patsy 完全一致 (C(a)[T.2]:C(b)[T.3] ...)，列顺序也与 patsy 相同，因此二阶交互的结果与原公式路径一致。
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype)
+
+
+def _level_codes(values, levels):
+    """按给定水平编码；出现未知水平时报错"""
+    codes = pd.Categorical(values, categories=levels).codes.astype(np.int64)
+    if (codes < 0).any():
+        raise ValueError("预测数据中出现估计样本中不存在的水平")
+    return codes
+
+
+class FactorialDesign:
+    """第二阶段设定 dep ~ i.f1##i.f2##... + controls (不依赖数据)"""
+
+    def __init__(self, dep, factors, controls=()):
+        self.dep = dep
+        self.factors = list(factors)
+        self.controls = list(controls)
+
+    def __str__(self):
+        return self.formula
+
+    @property
+    def formula(self):
+        """Stata 写法的设定 (用于显示与缓存标识)"""
+        rhs = "##".join(f"i.{f}" for f in self.factors)
+        if self.controls:
+            rhs += " " + " ".join(self.controls)
+        return f"{self.dep} ~ {rhs}"
+
+    def matrices(self, data):
+        """由数据构造 (y, X 稀疏 CSR, FactorialDesignInfo)"""
+        info = FactorialDesignInfo(self, data)
+        y = np.asarray(data[self.dep], dtype=float)
+        if np.isnan(y).any():
+            raise ValueError(f"因变量 {self.dep} 含缺失值")
+        return y, info.sparse_matrix(data), info
+
+
+class FactorialDesignInfo:
+    """在估计样本上确定的水平、非空格子与列名 (作用同 patsy 的 DesignInfo，用于预测)"""
+
+    def __init__(self, design, data):
+        self.design = design
+        self.levels = {}
+        for f in design.factors:
+            _, uniques = pd.factorize(data[f], sort=True)
+            self.levels[f] = np.asarray(uniques)
+        self.cat_controls = [c for c in design.controls if not _is_numeric(data[c])]
+        self.num_controls = [c for c in design.controls if _is_numeric(data[c])]
+        for c in self.cat_controls:
+            _, uniques = pd.factorize(data[c], sort=True)
+            self.levels[c] = np.asarray(uniques)
+
+        # 交互项按阶数排列 (与 patsy 相同：主效应、分类控制变量、二阶交互……，数值控制变量在最后)
+        codes = {f: _level_codes(data[f], self.levels[f]) for f in design.factors}
+        self.terms = []  # (变量元组, 各格子对应的列号，空格子为 -1)
+        self.empty = []  # 样本中不存在的格子 (Stata: empty cells)
+        names = ["Intercept"]
+        offset = 1
+        subsets = [(f,) for f in design.factors] + [(c,) for c in self.cat_controls]
+        subsets += [s for order in range(2, len(design.factors) + 1)
+                    for s in itertools.combinations(design.factors, order)]
+        for subset in subsets:
+            if subset[0] in codes:
+                counts = np.bincount(self._cells(subset, codes)[1], minlength=self._n_cells(subset))
+            else:
+                counts = np.bincount(_level_codes(data[subset[0]], self.levels[subset[0]]),
+                                     minlength=len(self.levels[subset[0]]))[1:]
+            present = counts > 0
+            columns = np.where(present, np.cumsum(present) - 1 + offset, -1)
+            self.terms.append((subset, columns))
+            cell_names = self._cell_names(subset)
+            names += [nm for nm, p in zip(cell_names, present) if p]
+            self.empty += [nm for nm, p in zip(cell_names, present) if not p]
+            offset += int(present.sum())
+        self.column_names = names + self.num_controls
+
+    def _prefix(self, var):
+        return f"C({var})" if var in self.design.factors else var
+
+    def _n_cells(self, subset):
+        return int(np.prod([len(self.levels[f]) - 1 for f in subset]))
+
+    def _cells(self, subset, codes):
+        """各行在交互项中的格子号 (第一个变量变化最快，同 patsy)；返回 (行号, 格子号)"""
+        valid = np.ones(len(codes[subset[0]]), dtype=bool)
+        cell = np.zeros(len(valid), dtype=np.int64)
+        stride = 1
+        for f in subset:
+            c = codes[f]
+            valid &= c > 0
+            cell += (c - 1) * stride
+            stride *= len(self.levels[f]) - 1
+        rows = np.flatnonzero(valid)
+        return rows, cell[rows]
+
+    def _cell_names(self, subset):
+        labels = [[f"{self._prefix(f)}[T.{lvl}]" for lvl in self.levels[f][1:]] for f in subset]
+        # itertools.product 最后一个变量变化最快，反转后即第一个变量最快
+        return [":".join(reversed(combo)) for combo in itertools.product(*reversed(labels))]
+
+    def sparse_matrix(self, data):
+        """估计样本的 CSR 设计矩阵"""
+        n = len(data)
+        codes = {f: _level_codes(data[f], self.levels[f]) for f in self.levels}
+        rows, cols = [np.arange(n)], [np.zeros(n, dtype=np.int64)]
+        for subset, columns in self.terms:
+            if len(subset) == 1 and subset[0] in self.cat_controls:
+                r = np.flatnonzero(codes[subset[0]] > 0)
+                cell = codes[subset[0]][r] - 1
+            else:
+                r, cell = self._cells(subset, codes)
+            col = columns[cell]
+            keep = col >= 0
+            rows.append(r[keep])
+            cols.append(col[keep])
+        n_cat = len(self.column_names) - len(self.num_controls)
+        X = sparse.csr_matrix((np.ones(sum(len(r) for r in rows)), (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(n, n_cat))
+        if self.num_controls:
+            Z = np.column_stack([np.asarray(data[c], dtype=float) for c in self.num_controls])
+            X = sparse.hstack([X, sparse.csr_matrix(Z)], format="csr")
+        return X
+
+    def build(self, frame, means=None):
+        """预测用的稠密设计矩阵 (行数通常很少，如边际效应的网格)
+
+        means: {变量: 各非基准水平的比例}，该变量的哑变量取比例而非 0/1 (Stata margins, atmeans)。
+        """
+        means = means or {}
+        n = len(frame)
+        indicators = {}
+        for var, levels in self.levels.items():
+            if var in means:
+                indicators[var] = np.broadcast_to(np.asarray(means[var], dtype=float), (n, len(levels) - 1))
+            else:
+                indicators[var] = np.eye(len(levels))[_level_codes(frame[var], levels)][:, 1:]
+        X = np.zeros((n, len(self.column_names)))
+        X[:, 0] = 1.0
+        for subset, columns in self.terms:
+            block = indicators[subset[0]]
+            for f in subset[1:]:
+                block = (indicators[f][:, :, None] * block[:, None, :]).reshape(n, -1)
+            present = columns >= 0
+            X[:, columns[present]] = block[:, present]
+        for j, c in enumerate(self.num_controls):
+            X[:, len(self.column_names) - len(self.num_controls) + j] = np.asarray(frame[c], dtype=float)
+        return X
+
+    def level_means(self, var, values):
+        """变量各非基准水平在 values 中的比例 (供 build 的 means 参数)"""
+        levels = self.levels[var]
+        return np.bincount(_level_codes(values, levels), minlength=len(levels))[1:] / len(values)
+
+    def average_rows(self, data, grid, over, joint=True):
+        """grid 每个格子上设计矩阵行的样本平均 (over 中的变量取格子的值，其余变量取 data 中的观测值)
+
+        每一列都是若干变量哑变量的乘积，对样本求平均时只需非 over 变量的 (联合) 分布，
+        因此不必为每个格子复制一份 N 行数据：
+          joint=True  —— 平均边际 (Stata margins 默认的 asobserved)，按联合分布计算；
+          joint=False —— atmeans，其他分类变量的哑变量各取样本比例再相乘。
+        """
+        m, n = len(grid), len(data)
+        codes = {v: _level_codes(data[v], self.levels[v]) for v in self.levels if v not in over}
+        ind = {v: np.eye(len(self.levels[v]))[_level_codes(grid[v], self.levels[v])][:, 1:] for v in over}
+        X = np.zeros((m, len(self.column_names)))
+        X[:, 0] = 1.0
+        for subset, columns in self.terms:
+            dims = [len(self.levels[f]) - 1 for f in subset]
+            rest = [f for f in subset if f not in over]
+            # 非 over 变量部分：按 subset 中的顺序排列各轴
+            if not rest:
+                P = np.ones([1] * len(subset))
+            elif joint or len(rest) == 1:
+                r, cell = self._cells(tuple(rest), codes)
+                shape = [len(self.levels[f]) - 1 for f in rest]
+                P = (np.bincount(cell, minlength=int(np.prod(shape))) / n).reshape(shape, order="F")
+            else:
+                P = np.ones([])
+                for f in rest:
+                    P = np.multiply.outer(P, np.bincount(codes[f], minlength=len(self.levels[f]))[1:] / n)
+            T = P.reshape([d if f in rest else 1 for f, d in zip(subset, dims)])[None]
+            for axis, f in enumerate(subset):
+                if f in over:
+                    shape = [m] + [1] * len(subset)
+                    shape[axis + 1] = dims[axis]
+                    T = T * ind[f].reshape(shape)
+            T = np.broadcast_to(T, [m] + dims)
+            # 展平时第一个变量变化最快 (与列顺序一致)
+            block = T.transpose([0] + list(range(len(subset), 0, -1))).reshape(m, -1)
+            present = columns >= 0
+            X[:, columns[present]] = block[:, present]
+        for j, c in enumerate(self.num_controls):
+            X[:, len(self.column_names) - len(self.num_controls) + j] = float(np.asarray(data[c], dtype=float).mean())
+        return X
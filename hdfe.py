@@ -0,0 +1,282 @@
+"""高维固定效应 (HDFE) 吸收估计，对应 Stata 的 reghdfe ..., absorb()
+
+固定效应不再展开为 C() 哑变量列，而是以整数分组编码保存，
+通过交替投影 (Method of Alternating Projections) 对 y 与控制变量逐组去均值。
+内存只与样本量和固定效应水平数成线性关系。
+估计前可迭代剔除单例观测 (prune_singletons)；被其他维度嵌套的固定效应整体冗余，去均值时跳过。
+"""
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from regression import RegressionResult, rmcoll, sandwich
+
+
+def factorize(values):
+    """将任意取值编码为 0..L-1 的整数 (int64)，返回 (codes, 水平数)
+
+    分类类型直接使用其整数编码，取值范围不大的整数列直接平移，
+    只需一次 bincount 去掉空水平，无须哈希或排序。
+    """
+    if isinstance(values, pd.Categorical):
+        raw = values.codes.astype(np.int64)
+    else:
+        values = np.asarray(values)
+        if values.dtype.kind in "iu" and len(values) and int(values.max()) - int(values.min()) <= 4 * len(values):
+            raw = values.astype(np.int64) - int(values.min())
+        else:
+            raw = None
+    if raw is None or (len(raw) and raw.min() < 0):
+        codes, uniques = pd.factorize(values, sort=True)
+        return codes.astype(np.int64), len(uniques)
+    present = np.bincount(raw) > 0
+    return (np.cumsum(present) - 1)[raw], int(present.sum())
+
+
+def is_nested(inner, outer):
+    """判断分组 inner 是否嵌套于 outer (inner 的每个水平只对应一个 outer 水平)
+
+    为 inner 的每个水平记下任一观测的 outer 取值，再检查所有观测是否一致，只需线性时间。
+    """
+    outer_of = np.empty(int(inner.max()) + 1, dtype=np.int64)
+    outer_of[inner] = outer
+    return bool((outer_of[inner] == outer).all())
+
+
+def count_components(a, b):
+    """两组固定效应构成二部图的连通分量数 (reghdfe 中的 mobility groups)"""
+    na, nb = int(a.max()) + 1, int(b.max()) + 1
+    graph = sparse.coo_matrix((np.ones(len(a), dtype=np.int8), (a, na + b)), shape=(na + nb, na + nb))
+    n_comp, _ = connected_components(graph, directed=False)
+    return n_comp
+
+
+def singleton_mask(codes, maxiter=1000):
+    """迭代剔除单例 (singleton)：返回 (保留观测的布尔掩码, 迭代轮数)
+
+    某一吸收维度中只含一个观测的组，其固定效应恰好拟合该观测，对估计没有信息却占用自由度；
+    剔除后其他维度又可能出现新的单例，因此反复剔除直至不再出现 (与 reghdfe 的默认行为一致)。
+    各维度的组内样本数随剔除递减更新，每轮只需一次 bincount。
+    """
+    n = len(codes[0]) if codes else 0
+    keep = np.ones(n, dtype=bool)
+    counts = [np.bincount(c) for c in codes]
+    for it in range(1, maxiter + 1):
+        drop = np.zeros(n, dtype=bool)
+        for c, cnt in zip(codes, counts):
+            drop |= cnt[c] == 1
+        drop &= keep
+        if not drop.any():
+            return keep, it
+        keep &= ~drop
+        for c, cnt in zip(codes, counts):
+            cnt -= np.bincount(c[drop], minlength=len(cnt))
+    raise RuntimeError(f"单例剔除未在 {maxiter} 轮内结束")
+
+
+def prune_singletons(df, fe_cols):
+    """剔除 df 中在 fe_cols 任一维度上为单例的观测 (迭代)，返回 (剔除后的数据, 剔除的观测数)
+
+    第一阶段之前调用：回归问题更小，吸收自由度与 reghdfe 一致；没有单例时原样返回 df，不复制。
+    """
+    if not fe_cols or not len(df):
+        return df, 0
+    keep, _ = singleton_mask([factorize(df[c].values)[0] for c in fe_cols])
+    n_drop = int(len(keep) - keep.sum())
+    return (df[keep] if n_drop else df), n_drop
+
+
+class FixedEffects:
+    """一组被吸收的固定效应 (每个维度保存整数编码与组内样本数)"""
+
+    def __init__(self, codes, names=None):
+        self.codes = [np.asarray(c, dtype=np.int64) for c in codes]
+        self.names = list(names) if names is not None else [f"fe{i}" for i in range(len(self.codes))]
+        self.n_levels = [int(c.max()) + 1 if len(c) else 0 for c in self.codes]
+        self.counts = [np.bincount(c, minlength=L).astype(float) for c, L in zip(self.codes, self.n_levels)]
+
+    @classmethod
+    def from_frame(cls, df, fe_cols):
+        return cls([factorize(df[c].values)[0] for c in fe_cols], names=fe_cols)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nobs(self):
+        return len(self.codes[0]) if self.codes else 0
+
+    def subset(self, mask):
+        """按布尔掩码/行号取子样本，并重新压缩编码"""
+        return FixedEffects([factorize(c[mask])[0] for c in self.codes], names=self.names)
+
+    def _sweep(self, M):
+        """对每个固定效应维度依次减去组均值，返回本轮最大组均值绝对值"""
+        delta = 0.0
+        for codes, counts, L in zip(self.codes, self.counts, self.n_levels):
+            for j in range(M.shape[1]):
+                means = np.bincount(codes, weights=M[:, j], minlength=L) / counts
+                M[:, j] -= means[codes]
+                delta = max(delta, float(np.abs(means).max()))
+        return delta
+
+    def demean(self, M, tol=1e-10, maxiter=10000, callback=None):
+        """交替投影去均值；M 为 (N, p) 数组，返回去均值后的副本与迭代次数
+
+        callback(迭代次数) 在每轮迭代后调用，可用于汇报进度 (抛出异常即可中止)。
+        """
+        M = np.array(M, dtype=float, copy=True)
+        if M.ndim == 1:
+            M = M[:, None]
+        if not self.codes:
+            return M - M.mean(axis=0), 1
+        scale = max(float(np.abs(M).max()), 1.0)
+        self._sweep(M)
+        if len(self.codes) == 1:
+            return M, 1
+        for it in range(2, maxiter + 1):
+            if self._sweep(M) <= tol * scale:
+                return M, it
+            if callback is not None:
+                callback(it)
+        raise RuntimeError(f"固定效应去均值未在 {maxiter} 次迭代内收敛")
+
+    def nested_in(self):
+        """被其他维度完全嵌套的维度：{维度序号: 嵌套于其中的更细维度序号}
+
+        如 服务大厅 ⊂ 服务大厅所在区 时，区的哑变量可由服务大厅的哑变量线性表示，整体冗余，
+        去均值时可以跳过。两个维度的分组完全相同时只保留靠前的一个。
+        """
+        out = {}
+        for i in range(len(self)):
+            for j in range(len(self)):
+                if i == j or self.n_levels[j] < self.n_levels[i]:
+                    continue
+                if self.n_levels[j] == self.n_levels[i] and j > i:
+                    continue
+                if is_nested(self.codes[j], self.codes[i]):
+                    out[i] = j
+                    break
+        return out
+
+    def without(self, dims):
+        """去掉 dims 中的维度 (共享编码，不复制)"""
+        drop = set(dims)
+        return FixedEffects([c for i, c in enumerate(self.codes) if i not in drop],
+                            names=[nm for i, nm in enumerate(self.names) if i not in drop])
+
+    def dof_table(self, cluster_codes=None):
+        """吸收自由度明细 (与 reghdfe 输出的 Absorbed degrees of freedom 表一致)
+
+        第一维不冗余；其余每一维与之前各维分别构成二部图，冗余数取连通分量数的最大值
+        (reghdfe 的 pairwise 规则：前两维精确，更多维时为保守的下界；嵌套于之前某一维的粗分组整体冗余)；
+        嵌套于聚类变量的固定效应整体视为冗余。
+        """
+        rows = []
+        for i, (name, codes, L) in enumerate(zip(self.names, self.codes, self.n_levels)):
+            redundant = max((count_components(self.codes[j], codes) for j in range(i)), default=0)
+            nested = cluster_codes is not None and is_nested(codes, cluster_codes)
+            if nested:
+                redundant = L
+            rows.append({"absvar": name, "categories": L, "redundant": redundant,
+                         "num_coefs": L - redundant, "nested": nested})
+        return pd.DataFrame(rows, columns=["absvar", "categories", "redundant", "num_coefs", "nested"])
+
+    def absorbed_dof(self, cluster_codes=None):
+        if not self.codes:
+            return 0
+        return int(self.dof_table(cluster_codes)["num_coefs"].sum())
+
+
+def build_exog(df, controls):
+    """用 patsy 构造控制变量矩阵 (分类控制变量按处理编码展开)，不含常数项"""
+    if not controls:
+        return np.empty((len(df), 0)), []
+    X = patsy.dmatrix("1 + " + " + ".join(controls), df, NA_action="raise", return_type="dataframe")
+    X = X.drop(columns="Intercept")
+    return X.values.astype(float), list(X.columns)
+
+
+def fit_hdfe(df, dep, controls, fe_cols, vce="unadjusted", cluster=None, fe=None, tol=1e-10, callback=None,
+             singletons=0):
+    """吸收固定效应的 OLS，等价于 reghdfe dep controls, absorb(fe_cols) vce(...)
+
+    vce: "unadjusted" / "robust" / "cluster"；cluster 为聚类变量列名。
+    fe: 可传入预先编码好的 FixedEffects 以复用分组编码。
+    callback: 去均值每轮迭代后的回调 (见 FixedEffects.demean)。
+    singletons: 调用前由 prune_singletons 剔除的单例观测数 (只写入摘要)；
+    df 中仍含单例时照常估计，相当于 reghdfe 的 keepsingletons。
+    返回 RegressionResult，其 resid 为 reghdfe resid() 所得的残差 (与 df 索引对齐)。
+    """
+    n = len(df)
+    y = df[dep].values.astype(float)
+    X, names = build_exog(df, controls)
+    if fe is None:
+        fe = FixedEffects.from_frame(df, fe_cols)
+    if len(fe) == 0:
+        # 无固定效应时常数项作为普通回归元保留
+        X = np.column_stack([np.ones(n), X])
+        names = ["Intercept"] + names
+
+    cluster_codes = None
+    if vce == "cluster":
+        if cluster is None:
+            raise ValueError("vce(cluster) 需要指定聚类变量")
+        cluster_codes, _ = factorize(df[cluster].values)
+
+    # 被其他维度嵌套的粗分组整体冗余，去均值时跳过 (投影不变，少一个维度的交替迭代)
+    nested = fe.nested_in() if len(fe) > 1 else {}
+    if len(fe):
+        M, n_iter = fe.without(nested).demean(np.column_stack([y, X]), tol=tol, callback=callback)
+        yt, Xt = M[:, 0], M[:, 1:]
+    else:
+        yt, Xt, n_iter = y, X, 0
+
+    # 去均值后方差几乎为零的列 (组内不变) 以及共线列按 Stata 规则剔除
+    XtX = Xt.T @ Xt
+    keep = rmcoll(XtX) if X.shape[1] else np.zeros(0, dtype=bool)
+    if len(fe) and X.shape[1]:
+        raw_var = ((X - X.mean(axis=0)) ** 2).sum(axis=0)
+        keep &= np.diag(XtX) > 1e-9 * np.maximum(raw_var, 1e-300)
+    omitted = [nm for nm, k in zip(names, keep) if not k]
+    names = [nm for nm, k in zip(names, keep) if k]
+    Xt = Xt[:, keep]
+    XtX = XtX[np.ix_(keep, keep)]
+
+    bread = np.linalg.inv(XtX) if Xt.shape[1] else np.zeros((0, 0))
+    b = bread @ (Xt.T @ yt)
+    e = yt - Xt @ b
+
+    df_a = fe.absorbed_dof(cluster_codes) if len(fe) else 0
+    K = Xt.shape[1] + df_a
+    cov, df_inf, G = sandwich(bread, Xt, e, vce=vce, clusters=cluster_codes, df_k=K)
+
+    rss = float(e @ e)
+    tss = float(((y - y.mean()) ** 2).sum())
+    r2 = 1 - rss / tss if tss > 0 else np.nan
+    r2_a = 1 - (1 - r2) * (n - 1) / (n - K) if n > K else np.nan
+    tss_w = float(yt @ yt) if len(fe) else tss
+    r2_w = 1 - rss / tss_w if tss_w > 0 else np.nan
+
+    extra = {}
+    if len(fe):
+        extra["Absorbed FE"] = ", ".join(f"{nm}({L})" for nm, L in zip(fe.names, fe.n_levels))
+        extra["Absorbed DoF"] = df_a
+        extra["MAP iterations"] = n_iter
+        if nested:
+            extra["Nested FE"] = ", ".join(f"{fe.names[j]} ⊂ {fe.names[i]}" for i, j in nested.items())
+    if singletons:
+        extra["Singletons dropped"] = singletons
+    result = RegressionResult(
+        params=pd.Series(b, index=names),
+        cov=pd.DataFrame(cov, index=names, columns=names),
+        nobs=n, df_resid=int(df_inf), vce=vce,
+        resid=pd.Series(e, index=df.index, name="resid_sat"),
+        rsquared=r2, rsquared_adj=r2_a, rsquared_within=r2_w,
+        n_clusters=G, omitted=omitted, extra=extra,
+    )
+    result.df_absorbed = df_a
+    result.dof_table = fe.dof_table(cluster_codes) if len(fe) else None
+    return result
@@ -0,0 +1,270 @@
+"""线性约束检验 (Stata 的 test / lincom)，由拟合结果缓存的系数与协方差直接计算
+
+命令按 Stata 的写法、使用原始 (中文) 变量名书写，每行一条：
+    test 2.窗口服务人员性别#2.办事公众性别 = 2.窗口服务人员性别
+    test (2.a#2.b = 0) (2.a#3.b = 0)          —— 联合检验
+    test 2.a 3.a                               —— 各系数均为 0
+    lincom 2.a + 2.a#2.b
+系数名为 水平.变量 (分类变量)、变量 或 c.变量 (连续变量)，交互项以 # 连接 (顺序不限)，常数项为 _cons；
+名称中含运算符时写作 _b[名称]。所有命令的约束堆叠为一个矩阵 R，R·b 与 R·V·R' 只计算一次，
+各命令取其中对应的块：test 给出 Wald F 统计量，lincom 给出估计值、标准误、t 值与置信区间。
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from regression import translate_name
+
+_TOKEN = re.compile(r"\s*(_b\[[^\]]*\]|[+\-*/=()]|[^\s+\-*/=()]+)")
+_LEVEL = re.compile(r"(?:C\((.+?)\)|(.+?))\[T\.(.+)\]")
+_INT_LEVEL = re.compile(r"^(\d+)\.0\.")
+
+
+def coef_label(name, reverse_map=None):
+    """项名 -> Stata 写法 (C(v_1)[T.2]:v_3 -> 2.性别#c.年龄，Intercept -> _cons)"""
+    if name == "Intercept":
+        return "_cons"
+    parts = str(name).split(":")
+    out = []
+    for part in parts:
+        m = _LEVEL.fullmatch(part)
+        if m:
+            var = m.group(1) or m.group(2)
+            out.append(f"{m.group(3)}.{translate_name(var, reverse_map)}")
+        else:
+            var = translate_name(part, reverse_map)
+            out.append(f"c.{var}" if len(parts) > 1 else var)
+    return "#".join(out)
+
+
+def _lookup_key(label):
+    """交互项各部分去掉 c. 前缀 (水平 2.0 记作 2) 后排序，使 a#b 与 b#a、年龄 与 c.年龄 指向同一系数"""
+    parts = (p.strip() for p in label.strip().split("#"))
+    return tuple(sorted(_INT_LEVEL.sub(r"\1.", p[2:] if p.startswith("c.") else p) for p in parts))
+
+
+class Hypothesis:
+    """一条命令：test 检验 R·b = r，lincom 估计 R·b - r (r 为表达式中常数项的相反数)"""
+
+    def __init__(self, command, kind, R, r):
+        self.command = command
+        self.kind = kind
+        self.R = np.atleast_2d(np.asarray(R, dtype=float))
+        self.r = np.atleast_1d(np.asarray(r, dtype=float))
+
+
+class HypothesisParser:
+    """把 Stata 写法的 test / lincom 命令解析为约束矩阵
+
+    names: 模型的项名 (model.params.index)；omitted: 因共线/空格子被剔除的项名。
+    """
+
+    def __init__(self, names, reverse_map=None, omitted=()):
+        self.names = list(names)
+        self.k = len(self.names)
+        self.index = {_lookup_key(coef_label(n, reverse_map)): i for i, n in enumerate(self.names)}
+        for i, n in enumerate(self.names):
+            self.index.setdefault(_lookup_key(n), i)
+        self.omitted = {_lookup_key(coef_label(n, reverse_map)) for n in omitted} | \
+            {_lookup_key(n) for n in omitted}
+
+    def labels(self, reverse_map=None):
+        return [coef_label(n, reverse_map) for n in self.names]
+
+    # --- 词法与表达式 ---
+    def _tokens(self, text):
+        tokens, pos = [], 0
+        text = text.strip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if not m:
+                raise ValueError(f"无法解析: {text[pos:]}")
+            tokens.append(m.group(1))
+            pos = m.end()
+        return tokens
+
+    def _coef(self, token):
+        name = token[3:-1] if token.startswith("_b[") else token
+        key = _lookup_key(name)
+        if key in self.index:
+            return self.index[key]
+        if key in self.omitted:
+            raise ValueError(f"系数 {name} 因共线或空格子已被剔除 (constrained to zero)")
+        raise ValueError(f"模型中没有系数 {name}")
+
+    def _expr(self, tokens, pos):
+        """线性表达式 -> (系数向量, 常数, 下一个位置)"""
+        vec, const, pos = self._term(tokens, pos)
+        while pos < len(tokens) and tokens[pos] in "+-":
+            sign = -1.0 if tokens[pos] == "-" else 1.0
+            v, c, pos = self._term(tokens, pos + 1)
+            vec, const = vec + sign * v, const + sign * c
+        return vec, const, pos
+
+    def _term(self, tokens, pos):
+        v, c, pos = self._factor(tokens, pos)
+        while pos < len(tokens) and tokens[pos] in "*/":
+            op = tokens[pos]
+            v2, c2, pos = self._factor(tokens, pos + 1)
+            if op == "/":
+                if v2.any() or c2 == 0:
+                    raise ValueError("只能除以非零常数")
+                v, c = v / c2, c / c2
+            elif v.any() and v2.any():
+                raise ValueError("约束必须是系数的线性组合")
+            elif v2.any():
+                v, c = c * v2, c * c2
+            else:
+                v, c = c2 * v, c2 * c
+        return v, c, pos
+
+    def _factor(self, tokens, pos):
+        if pos >= len(tokens):
+            raise ValueError("表达式不完整")
+        tok = tokens[pos]
+        if tok == "(":
+            v, c, pos = self._expr(tokens, pos + 1)
+            if pos >= len(tokens) or tokens[pos] != ")":
+                raise ValueError("括号不匹配")
+            return v, c, pos + 1
+        if tok in "+-":
+            v, c, pos = self._factor(tokens, pos + 1)
+            return (-v, -c, pos) if tok == "-" else (v, c, pos)
+        try:
+            return np.zeros(self.k), float(tok), pos + 1
+        except ValueError:
+            pass
+        vec = np.zeros(self.k)
+        vec[self._coef(tok)] = 1.0
+        return vec, 0.0, pos + 1
+
+    def _equation(self, tokens, pos):
+        """exp [= exp] -> (R 行, r, 下一个位置)；省略右边时为 = 0"""
+        v, c, pos = self._expr(tokens, pos)
+        if pos < len(tokens) and tokens[pos] == "=":
+            v2, c2, pos = self._expr(tokens, pos + 1)
+            v, c = v - v2, c - c2
+        if not v.any():
+            raise ValueError("约束中不含任何系数")
+        return v, -c, pos
+
+    # --- 命令 ---
+    def _test(self, text):
+        tokens = self._tokens(text)
+        if not tokens:
+            raise ValueError("缺少约束")
+        if "=" not in tokens and not set(tokens) & set("+-*/()"):
+            # coeflist：各系数均为 0
+            R = np.zeros((len(tokens), self.k))
+            for i, tok in enumerate(tokens):
+                R[i, self._coef(tok)] = 1.0
+            return R, np.zeros(len(tokens))
+        if tokens[0] == "(":
+            try:
+                return self._equation_list(tokens)
+            except ValueError as e:
+                # 也可能是以括号开头的单个约束，如 (a + b) / 2 = c
+                error = e
+        else:
+            error = None
+        try:
+            v, r, pos = self._equation(tokens, 0)
+            if pos != len(tokens):
+                raise ValueError(f"多余的内容: {' '.join(tokens[pos:])}")
+        except ValueError:
+            if error is not None:
+                raise error from None
+            raise
+        return v[None], np.array([r])
+
+    def _equation_list(self, tokens):
+        """(exp = exp) (exp = exp) ... -> 联合约束"""
+        rows, pos = [], 0
+        while pos < len(tokens):
+            if tokens[pos] != "(":
+                raise ValueError("联合检验的每个约束需用括号括起")
+            v, r, pos = self._equation(tokens, pos + 1)
+            if pos >= len(tokens) or tokens[pos] != ")":
+                raise ValueError("括号不匹配")
+            rows.append((v, r))
+            pos += 1
+        return np.array([v for v, _ in rows]), np.array([r for _, r in rows])
+
+    def _lincom(self, text):
+        tokens = self._tokens(text)
+        v, c, pos = self._expr(tokens, 0)
+        if pos != len(tokens):
+            raise ValueError(f"多余的内容: {' '.join(tokens[pos:])}")
+        if not v.any():
+            raise ValueError("表达式中不含任何系数")
+        return v[None], np.array([-c])
+
+    def parse(self, command):
+        """解析一条命令；不以 test/lincom 开头时，含 = 的视为 test，否则视为 lincom"""
+        command = command.strip()
+        word, _, rest = command.partition(" ")
+        if word in ("test", "lincom"):
+            kind = word
+        else:
+            kind, rest = ("test" if "=" in command else "lincom"), command
+        try:
+            R, r = self._test(rest) if kind == "test" else self._lincom(rest)
+        except ValueError as e:
+            raise ValueError(f"{command}: {e}") from None
+        return Hypothesis(command, kind, R, r)
+
+    def parse_lines(self, text):
+        """多行文本 (每行一条命令，// 之后为注释) -> [Hypothesis]"""
+        commands = [line.split("//")[0].strip() for line in str(text).splitlines()]
+        return [self.parse(c) for c in commands if c]
+
+
+def evaluate(model, hypotheses, alpha=0.05):
+    """一次计算全部约束：d = R·b - r，S = R·V·R'，各命令取对应的块
+
+    test 的统计量为 F = d'S⁻d / q (q 为约束的秩，多余的约束按 Stata 的方式剔除)，自由度 (q, df_resid)；
+    单个约束时同时给出估计值、标准误与 t 值 (t² = F)。
+    """
+    if not hypotheses:
+        return pd.DataFrame()
+    R = np.vstack([h.R for h in hypotheses])
+    r = np.concatenate([h.r for h in hypotheses])
+    d = R @ model.params.values - r
+    S = R @ model.cov.values @ R.T
+    df = model.df_resid
+    q_t = stats.t.ppf(1 - alpha / 2, df)
+    rows, start = [], 0
+    for h in hypotheses:
+        block = slice(start, start + len(h.r))
+        start += len(h.r)
+        d_h, S_h = d[block], S[block, block]
+        row = {'命令': h.command, '类型': h.kind, '约束数': len(h.r)}
+        if len(h.r) == 1:
+            se = float(np.sqrt(max(S_h[0, 0], 0.0)))
+            t = d_h[0] / se if se > 0 else np.nan
+            row.update({'估计值': d_h[0], '标准误': se, 't值': t,
+                        'CI下限': d_h[0] - q_t * se, 'CI上限': d_h[0] + q_t * se})
+        if h.kind == "test":
+            q = int(np.linalg.matrix_rank(S_h))
+            F = float(d_h @ np.linalg.pinv(S_h) @ d_h) / q if q else np.nan
+            row.update({'F值': F, 'df1': q, 'df2': df, 'p值': stats.f.sf(F, q, df) if q else np.nan})
+        else:
+            row['p值'] = 2 * stats.t.sf(abs(row['t值']), df)
+        rows.append(row)
+    cols = ['命令', '类型', '约束数', '估计值', '标准误', 't值', 'F值', 'df1', 'df2', 'p值', 'CI下限', 'CI上限']
+    return pd.DataFrame(rows).reindex(columns=cols)
+
+
+def bootstrap_pvalues(wcb, hypotheses, progress=None, **kwargs):
+    """野聚类自助 p 值 (bootstrap.WildClusterBootstrap)；只适用于单个约束，联合检验返回 NaN
+
+    progress(已完成数, 总数) 在每条命令后调用；kwargs 传给 wcb.test (reps/weights/seed/max_workers)。
+    """
+    out = []
+    for i, h in enumerate(hypotheses):
+        out.append(wcb.test(h.R[0], h.r[0], **kwargs)['p_boot'] if len(h.r) == 1 else np.nan)
+        if progress:
+            progress(i + 1, len(hypotheses))
+    return out
@@ -0,0 +1,149 @@
+"""后台任务：长时间的拟合在线程池中运行，不阻塞界面
+
+Streamlit 每次控件交互都会中断并重跑脚本，在脚本中同步执行的拟合会被打断、结果丢失。
+这里把第一/二阶段、自助法、批量分析等放到进程级共享的线程池中执行 (numpy 计算期间释放 GIL，
+批量任务内部另有进程池)；每个会话持有自己的任务登记表，重跑时按任务标识挂接到仍在运行的任务上。
+取消是协作式的：任务函数通过 job.progress()/job.check() 汇报进度，在这些检查点上响应取消。
+"""
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# 后台线程数，可通过环境变量 APP_JOB_WORKERS 配置
+DEFAULT_WORKERS = int(os.environ.get("APP_JOB_WORKERS", "4"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class JobCancelled(Exception):
+    """任务在检查点上发现已被取消"""
+
+
+class Job:
+    """一个后台任务：状态、进度与结果"""
+
+    def __init__(self, kind, key, label=""):
+        self.kind = kind
+        self.key = key
+        self.label = label
+        self.status = QUEUED
+        self.fraction = None  # 0~1；None 表示进度未知
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def check(self):
+        """检查点：已请求取消时抛出 JobCancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, fraction=None, message=None):
+        """汇报进度 (同时作为取消检查点)"""
+        self.check()
+        if fraction is not None:
+            self.fraction = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def counter(self, text):
+        """适配 pipeline.map_jobs 的 progress(done, total) 回调"""
+        return lambda done, total: self.progress(done / total, f"{text} {done}/{total}")
+
+    def cancel(self):
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            # 尚未开始执行的任务直接标记为已取消
+            self._finish(CANCELLED)
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _finish(self, status):
+        self.status = status
+        self.finished = time.time()
+        self._done.set()
+
+    def run(self, func):
+        if self._cancel.is_set():
+            self._finish(CANCELLED)
+            return
+        self.status = RUNNING
+        self.started = time.time()
+        try:
+            self.result = func(self)
+        except JobCancelled:
+            self._finish(CANCELLED)
+        except Exception as e:
+            self.error = str(e)
+            self.traceback = traceback.format_exc()
+            self._finish(FAILED)
+        else:
+            self._finish(DONE)
+
+
+_executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="analysis-job")
+
+
+class JobRegistry:
+    """单个会话的任务登记表：每类任务 (kind) 只保留最近一个"""
+
+    def __init__(self, executor=None):
+        self.executor = executor or _executor
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, key, func, label=""):
+        """提交任务 func(job)
+
+        同类任务正在运行且标识相同时直接返回该任务 (挂接)，标识不同时取消旧任务后提交新任务。
+        """
+        with self._lock:
+            job = self._jobs.get(kind)
+            if job is not None and job.active:
+                if job.key == key:
+                    return job
+                job.cancel()
+            job = Job(kind, key, label)
+            self._jobs[kind] = job
+            job.future = self.executor.submit(job.run, func)
+            return job
+
+    def get(self, kind):
+        with self._lock:
+            return self._jobs.get(kind)
+
+    def pop_finished(self, kind):
+        """已结束的任务 (成功、失败或取消) 取出并从登记表中移除；否则返回 None"""
+        with self._lock:
+            job = self._jobs.get(kind)
+            if job is None or job.active:
+                return None
+            del self._jobs[kind]
+            return job
+
+    def active(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.active]
+
+    def cancel_all(self):
+        for job in self.active():
+            job.cancel()
@@ -0,0 +1,155 @@
+"""数据文件读取 (.dta / .csv / .xlsx)
+
+两阶段读取：先只读表头与值标签 (用于填充侧边栏选择框)，
+再按所选变量投影、分块读取，并在读取过程中压缩数值类型，
+使内存峰值只与所选列的规模相关，而与问卷题项总数无关。
+"""
+import numpy as np
+import pandas as pd
+
+# 分块读取的默认行数
+DEFAULT_CHUNKSIZE = 200_000
+
+# 字符串列的取值数不超过行数的该比例时编码为分类类型 (自由文本列保持原样)
+CATEGORY_MAX_RATIO = 0.5
+
+
+def _rewind(buffer):
+    if hasattr(buffer, "seek"):
+        buffer.seek(0)
+    return buffer
+
+
+class TableSchema:
+    """数据表的表头信息：列名、变量标签与值标签"""
+
+    def __init__(self, columns, variable_labels=None, value_labels=None):
+        self.columns = list(columns)
+        self.variable_labels = dict(variable_labels or {})
+        self.value_labels = dict(value_labels or {})
+
+    @property
+    def nbytes(self):
+        # 粗略估计，供缓存预算使用
+        n_labels = sum(len(v) for v in self.value_labels.values())
+        return 200 * (len(self.columns) + n_labels) + 1024
+
+
+def read_header(name, buffer):
+    """只读取表头与值标签，不读取数据行"""
+    _rewind(buffer)
+    if name.endswith('.dta'):
+        with pd.read_stata(buffer, iterator=True) as reader:
+            variable_labels = reader.variable_labels()
+            label_sets = reader.value_labels()
+            # 变量 -> 值标签集名称 (label values 的对应关系)；取不到时按同名标签集匹配
+            lbllist = getattr(reader, '_lbllist', None) or list(variable_labels)
+        value_labels = {var: label_sets[lbl] for var, lbl in zip(variable_labels, lbllist) if lbl in label_sets}
+        return TableSchema(list(variable_labels), variable_labels, value_labels)
+    elif name.endswith('.csv'):
+        return TableSchema(pd.read_csv(buffer, nrows=0).columns)
+    import openpyxl
+    wb = openpyxl.load_workbook(buffer, read_only=True, data_only=True)
+    try:
+        header = next(wb.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+    finally:
+        wb.close()
+    return TableSchema([c for c in header if c is not None])
+
+
+def downcast_series(s):
+    """在不损失精度的前提下把数值列压缩到最小类型"""
+    if pd.api.types.is_bool_dtype(s) or not pd.api.types.is_numeric_dtype(s):
+        return s
+    if pd.api.types.is_integer_dtype(s):
+        return pd.to_numeric(s, downcast='integer')
+    values = s.to_numpy()
+    finite = values[~np.isnan(values)]
+    if len(finite) == len(values) and len(finite) and np.all(finite == np.round(finite)) \
+            and np.abs(finite).max() < 2 ** 31:
+        return pd.to_numeric(s, downcast='integer')
+    if s.dtype != np.float32 and np.array_equal(finite.astype(np.float32).astype(s.dtype), finite):
+        return s.astype(np.float32)
+    return s
+
+
+def downcast_frame(df):
+    return df.apply(downcast_series) if len(df.columns) else df
+
+
+def encode_categorical(s):
+    """字符串列 -> pandas 分类类型 (最小整数编码 + 排序后的类别表)；已是分类类型的去掉未出现的类别"""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s.cat.remove_unused_categories()
+    if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)):
+        return s
+    if s.nunique() > CATEGORY_MAX_RATIO * max(len(s), 1):
+        return s
+    try:
+        categories = sorted(s.dropna().unique())
+    except TypeError:
+        # 混合类型的列无法排序，保持原样
+        return s
+    return pd.Series(pd.Categorical(s, categories=categories), index=s.index, name=s.name)
+
+
+def compact_frame(df):
+    """数值列无损压缩、字符串列编码为分类类型"""
+    if not len(df.columns):
+        return df
+    return df.apply(lambda s: encode_categorical(downcast_series(s)))
+
+
+def _iter_excel_chunks(buffer, columns, chunksize):
+    import openpyxl
+    wb = openpyxl.load_workbook(buffer, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        idx = [header.index(c) for c in columns]
+        chunk = []
+        for row in rows:
+            chunk.append([row[i] if i < len(row) else None for i in idx])
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=columns).infer_objects()
+                chunk = []
+        if chunk or not columns:
+            yield pd.DataFrame(chunk, columns=columns).infer_objects()
+    finally:
+        wb.close()
+
+
+def iter_chunks(name, buffer, columns, chunksize=DEFAULT_CHUNKSIZE):
+    """按列投影、分块迭代读取数据"""
+    _rewind(buffer)
+    columns = list(columns)
+    if name.endswith('.dta'):
+        with pd.read_stata(buffer, columns=columns, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield chunk
+    elif name.endswith('.csv'):
+        with pd.read_csv(buffer, usecols=columns, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield chunk[columns]
+    else:
+        yield from _iter_excel_chunks(buffer, columns, chunksize)
+
+
+def read_columns(name, buffer, columns, chunksize=DEFAULT_CHUNKSIZE):
+    """只读取所选列，分块读取并逐块压缩数值类型"""
+    chunks = [downcast_frame(c) for c in iter_chunks(name, buffer, columns, chunksize)]
+    if not chunks:
+        return pd.DataFrame(columns=list(columns))
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].reset_index(drop=True)
+    # 各块压缩后的类型可能不同，合并后再统一压缩一次，并把字符串列编码为分类类型
+    return compact_frame(df.infer_objects())
+
+
+def read_table(name, buffer):
+    """按扩展名解析上传的数据文件 (读取全部列)"""
+    _rewind(buffer)
+    if name.endswith('.dta'):
+        return pd.read_stata(buffer)
+    elif name.endswith('.csv'):
+        return pd.read_csv(buffer)
+    return pd.read_excel(buffer)
@@ -0,0 +1,132 @@
+"""残差极端值阈值规则与阈值探索
+
+残差只排序一次：任意阈值下被标记的样本数是一次二分查找，
+被标记的行号是排序索引的一个切片，无须扫描全表或复制 DataFrame。
+"""
+import numpy as np
+import pandas as pd
+
+# 界面选项 -> 规则标识
+RULES = {"k·σ (标准差)": "sigma", "k·MAD (中位数绝对偏差)": "mad", "百分位 (剔除最大 p%)": "percentile"}
+
+# MAD 换算为正态分布标准差的系数
+MAD_SCALE = 1.4826
+
+
+class ResidualIndex:
+    """按偏离程度排序的残差索引"""
+
+    def __init__(self, resid):
+        self.resid = np.asarray(resid, dtype=float)
+        self.n = len(self.resid)
+        self.mean = float(self.resid.mean())
+        self.std = float(self.resid.std(ddof=1))
+        self.median = float(np.median(self.resid))
+        self._sorted = {}
+
+    def _deviation(self, rule):
+        """规则对应的偏离度量：σ/百分位规则使用 |e| (与 Stata 中 abs(res) 一致)，MAD 规则使用 |e - 中位数|"""
+        if rule == "mad":
+            return np.abs(self.resid - self.median)
+        return np.abs(self.resid)
+
+    def _index(self, rule):
+        """(升序偏离值, 对应行号)；每种度量只排序一次"""
+        key = "mad" if rule == "mad" else "abs"
+        if key not in self._sorted:
+            dev = self._deviation(rule)
+            order = np.argsort(dev, kind="stable")
+            self._sorted[key] = (dev[order], order)
+        return self._sorted[key]
+
+    @property
+    def mad(self):
+        return float(np.median(self._index("mad")[0])) * MAD_SCALE
+
+    def cutoff(self, rule, value):
+        """规则参数 -> 偏离度量上的阈值 (偏离值严格大于阈值者为极端值)"""
+        if rule == "sigma":
+            return value * self.std
+        if rule == "mad":
+            return value * self.mad
+        if rule == "percentile":
+            dev = self._index(rule)[0]
+            n_flag = int(np.floor(self.n * value / 100.0))
+            return dev[self.n - n_flag - 1] if n_flag > 0 else np.inf
+        raise ValueError(f"未知的阈值规则: {rule}")
+
+    def _position(self, rule, value):
+        dev, _ = self._index(rule)
+        return int(np.searchsorted(dev, self.cutoff(rule, value), side="right"))
+
+    def count(self, rule, value):
+        """被标记为极端值的样本数 (二分查找)"""
+        return self.n - self._position(rule, value)
+
+    def flagged_rows(self, rule, value):
+        """被标记行的行号 (排序索引的切片，偏离最大者在后)"""
+        return self._index(rule)[1][self._position(rule, value):]
+
+    def mask(self, rule, value):
+        m = np.zeros(self.n, dtype=bool)
+        m[self.flagged_rows(rule, value)] = True
+        return m
+
+    def curve(self, rule, values):
+        """一组阈值参数对应的被标记样本数"""
+        dev, _ = self._index(rule)
+        cuts = np.array([self.cutoff(rule, v) for v in values])
+        return self.n - np.searchsorted(dev, cuts, side="right")
+
+
+def extreme_mask(resid, rule, value):
+    """单个阈值下的极端值掩码，与 ResidualIndex(resid).mask(rule, value) 相同但不排序
+
+    只需一个阈值时 (如设定曲线中每个规格各有一组残差) 直接比较，百分位规则用 O(n) 的选择算法。
+    """
+    resid = np.asarray(resid, dtype=float)
+    n = len(resid)
+    if rule == "sigma":
+        return np.abs(resid) > value * float(resid.std(ddof=1))
+    if rule == "mad":
+        dev = np.abs(resid - float(np.median(resid)))
+        return dev > value * float(np.median(dev)) * MAD_SCALE
+    if rule == "percentile":
+        n_flag = int(np.floor(n * value / 100.0))
+        if n_flag <= 0:
+            return np.zeros(n, dtype=bool)
+        dev = np.abs(resid)
+        return dev > np.partition(dev, n - n_flag - 1)[n - n_flag - 1]
+    raise ValueError(f"未知的阈值规则: {rule}")
+
+
+def default_grid(rule):
+    """各规则的阈值参数扫描网格"""
+    if rule == "percentile":
+        return np.round(np.linspace(0.0, 5.0, 26), 2)
+    return np.round(np.linspace(2.0, 5.0, 31), 2)
+
+
+def coefficient_path(cp, index, rule, values, vce="unadjusted", terms=None, alpha=0.05):
+    """阈值变化时第二阶段系数的变化路径
+
+    从标记最少的阈值开始，逐步剔除新增的极端值行，每一步只对交叉积做增量 downdate。
+    返回长表：阈值参数、剔除数、变量、系数、CI。
+    """
+    rows = []
+    current, removed = cp, 0
+    for value in sorted(values, key=lambda v: index.count(rule, v)):
+        flagged = index.flagged_rows(rule, value)
+        # flagged 按偏离升序排列，阈值放宽时新增的行位于切片开头
+        new_rows = flagged[:len(flagged) - removed]
+        if len(new_rows):
+            current = current.downdate(new_rows)
+            removed = len(flagged)
+        res = current.fit(vce)
+        ci = res.conf_int(alpha)
+        for term in (terms if terms is not None else res.params.index):
+            if term not in res.params.index:
+                continue
+            rows.append({'阈值': value, '剔除数': removed, '变量': term, '系数': res.params[term],
+                         'CI下限': ci.loc[term, 0], 'CI上限': ci.loc[term, 1]})
+    return pd.DataFrame(rows)
@@ -0,0 +1,172 @@
+"""分阶段计时与内存采样
+
+每个阶段记录墙钟时间、CPU 时间、进程常驻内存 (RSS) 的峰值，以及可选的 Python 分配峰值
+(tracemalloc，含 numpy 数组)；RSS 由后台线程按固定间隔采样 (读 /proc/self/statm，
+不可用时退回 getrusage 的进程峰值)。性能基准 (bench.py) 与界面的“性能”面板使用同一套记录；
+界面每次运行的记录另以 JSON lines 追加到日志文件，也可对单次运行采集 cProfile。
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 ** 2
+
+# RSS 采样间隔 (秒)
+SAMPLE_INTERVAL = 0.01
+
+
+def current_rss():
+    """当前进程的常驻内存 (字节)；取不到时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """进程启动以来的峰值常驻内存 (字节)；取不到时返回 None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """后台线程按 interval 采样 RSS，记录期间的最大值"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and rss > (self.peak or 0):
+                self.peak = rss
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        rss = current_rss()
+        if rss is None:
+            # 无法读取当前 RSS (非 Linux)：以进程峰值代替
+            self.peak = peak_rss()
+        elif rss > (self.peak or 0):
+            self.peak = rss
+        return False
+
+
+class StageRecorder:
+    """按阶段记录耗时与内存：with recorder.stage("stage1"): ...
+
+    trace_python=True 时在阶段期间开启 tracemalloc 记录 Python 分配峰值；它会使 pandas/patsy 中
+    大量小对象的分配明显变慢，默认只采样 RSS。
+    每个阶段一条记录 (dict)，依次存于 records。
+    """
+
+    def __init__(self, trace_python=False, sample_interval=SAMPLE_INTERVAL):
+        self.trace_python = trace_python
+        self.sample_interval = sample_interval
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, **extra):
+        own_trace = self.trace_python and not tracemalloc.is_tracing()
+        if own_trace:
+            tracemalloc.start()
+        if self.trace_python:
+            tracemalloc.reset_peak()
+        t0, c0 = time.perf_counter(), time.process_time()
+        error = None
+        try:
+            with RssSampler(self.sample_interval) as sampler:
+                yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record = {'stage': name, 'seconds': time.perf_counter() - t0, 'cpu_seconds': time.process_time() - c0,
+                      'py_peak_mb': tracemalloc.get_traced_memory()[1] / MB if self.trace_python else None,
+                      'rss_peak_mb': sampler.peak / MB if sampler.peak is not None else None,
+                      'rss_end_mb': (current_rss() or 0) / MB or None, **extra}
+            if error is not None:
+                record['error'] = error
+            if own_trace:
+                tracemalloc.stop()
+            self.records.append(record)
+
+    def total_seconds(self):
+        return sum(r['seconds'] for r in self.records)
+
+
+# 每次运行的结构化日志 (JSON lines)，可通过环境变量 APP_PERF_LOG 配置
+DEFAULT_LOG = os.environ.get("APP_PERF_LOG", "perf_log.jsonl")
+
+
+def run_record(records, **meta):
+    """一次运行的日志记录：时间戳、元信息、总耗时与各阶段记录"""
+    return {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), **meta,
+            'total_seconds': sum(r['seconds'] for r in records), 'stages': list(records)}
+
+
+def append_jsonl(path, record):
+    """追加一行 JSON (写日志失败不影响分析，返回是否成功)"""
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        return True
+    except OSError:
+        return False
+
+
+class ProfileCapture:
+    """cProfile 采集：with ProfileCapture() as prof: ...
+
+    cProfile 只覆盖调用线程；在其他线程中运行的任务不在统计范围内。
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        return False
+
+    def text(self, limit=60, sort="cumulative"):
+        """按 sort 排序的前 limit 个函数 (pstats 文本)"""
+        buf = io.StringIO()
+        pstats.Stats(self.profile, stream=buf).sort_stats(sort).print_stats(limit)
+        return buf.getvalue()
+
+    def dump(self):
+        """.prof 文件内容 (与 Profile.dump_stats 相同，可用 snakeviz / pstats 打开)"""
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
@@ -0,0 +1,495 @@
+"""两阶段残差回归流程 (与界面解耦，可在后台进程或命令行中调用)
+
+第一阶段：吸收固定效应的回归，提取残差 resid_sat；
+第二阶段：resid_sat ~ A##B(##...) + 控制变量，并计算预测边际 (margins, atmeans)。
+"""
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from estimates import StoredEstimates
+from hdfe import FixedEffects, fit_hdfe, prune_singletons, singleton_mask
+from hypothesis import HypothesisParser, evaluate
+from loader import compact_frame
+from margins import compute_margins, default_at
+from outliers import RULES as OUTLIER_RULES, ResidualIndex, extreme_mask
+from factorial import FactorialDesign
+from regression import translate_name
+from suffstats import CrossProducts
+
+# 界面上的 VCE 选项与估计引擎参数的对应关系
+VCE_TYPES = {"不使用": "unadjusted", "vce(robust)": "robust", "vce(cluster)": "cluster"}
+
+# 界面选择框中表示“未选择”的占位值
+PLACEHOLDERS = ("(不使用)", "(不使用聚类)", "(未选择)")
+
+
+# --- 辅助函数：处理中文列名 ---
+def safe_rename(df):
+    """将中文列名映射为安全变量名 (v1, v2...)，避免 patsy 公式报错"""
+    col_map = {col: f"v_{i}" for i, col in enumerate(df.columns)}
+    reverse_map = {v: k for k, v in col_map.items()}
+    # 浅拷贝后仅替换列名，不复制底层数据
+    df_safe = df.copy(deep=False)
+    df_safe.columns = [col_map[c] for c in df.columns]
+    return df_safe, col_map, reverse_map
+
+
+def with_columns(df, **columns):
+    """在浅拷贝上附加列 (如残差)，不复制原有列的数据"""
+    out = df.copy(deep=False)
+    for name, values in columns.items():
+        out[name] = values
+    return out
+
+
+def is_categorical(series, threshold=15, n_unique=None):
+    """判断是否为分类变量 (n_unique 为预先算好的取值数，可省去一次 nunique 扫描)"""
+    # 如果是 object 类型或者是 category 类型，或者是数值类型但唯一值很少
+    if pd.api.types.is_object_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype) \
+            or pd.api.types.is_string_dtype(series):
+        return True
+    if pd.api.types.is_numeric_dtype(series) and (series.nunique() if n_unique is None else n_unique) < threshold:
+        return True
+    return False
+
+
+def prepare_frame(df):
+    """分析样本预处理 (每个数据集/变量选择只需一次)：数值列压缩到最小类型，字符串列编码为分类类型
+
+    剔除缺失值后原本含 NaN 的浮点列通常可以进一步压缩为整数。
+    """
+    return compact_frame(df)
+
+
+def column_cardinality(df):
+    """各列取值数，供 is_categorical 复用"""
+    return {c: int(df[c].nunique()) for c in df.columns}
+
+
+def outlier_settings(spec):
+    """规格中的极端值规则 (outlier_rule 为界面选项，outlier_k / outlier_pct 为阈值参数)，缺省 3σ
+
+    返回 (规则标识, 阈值参数)，供 outliers.extreme_mask / ResidualIndex.mask 使用。
+    """
+    rule = OUTLIER_RULES.get(spec.get('outlier_rule'), "sigma")
+    value = spec.get('outlier_pct', 1.0) if rule == "percentile" else spec.get('outlier_k', 3.0)
+    return rule, value
+
+
+# --- 第二阶段 ---
+def stage2_design(data, interacts, safe_controls, cardinality=None):
+    """构建第二阶段设定 resid ~ A##B##... + Controls；自动判断交互变量是否按分类变量处理
+
+    交互变量全部按分类处理时返回稀疏的全因子设计 (factorial.FactorialDesign)，
+    否则返回 patsy 公式 (A * B * ...)。返回 (设定, 各交互变量是否按分类处理)；
+    str(设定) 为公式文本，可用作缓存标识。
+    cardinality: 预先缓存的各列取值数 (列名 -> 取值数)
+    """
+    cardinality = cardinality or {}
+    is_cat = [is_categorical(data[v], n_unique=cardinality.get(v)) for v in interacts]
+    if all(is_cat):
+        return FactorialDesign("resid_sat", interacts, safe_controls), is_cat
+    formula = "resid_sat ~ " + " * ".join(f"C({v})" if c else v for v, c in zip(interacts, is_cat))
+    if safe_controls:
+        formula += " + " + " + ".join(safe_controls)
+    return formula, is_cat
+
+
+def stage2_cross_products(design, data, cluster=None):
+    """按设定 (FactorialDesign 或 patsy 公式) 构建交叉积"""
+    if isinstance(design, FactorialDesign):
+        return CrossProducts.from_design(design, data, cluster)
+    return CrossProducts.from_formula(design, data, cluster)
+
+
+def fit_ols(design, data, vce="unadjusted", cluster=None):
+    """OLS (经由充分统计量引擎)，按 vce 选择协方差类型"""
+    if vce == "cluster" and cluster is None:
+        raise ValueError("vce(cluster) 需要指定聚类变量")
+    return stage2_cross_products(design, data, cluster if vce == "cluster" else None).fit(vce)
+
+
+def coef_frame(model, reverse_map=None, alpha=0.05):
+    """系数表 (变量名替换回中文)"""
+    coef_df = pd.DataFrame({
+        '变量': model.params.index,
+        '系数': model.params.values,
+        '标准误': model.bse.values,
+        't值': model.tvalues.values,
+        'p值': model.pvalues.values
+    })
+    ci = model.conf_int(alpha)
+    coef_df['CI下限'] = ci[0].values
+    coef_df['CI上限'] = ci[1].values
+    if reverse_map:
+        coef_df['变量'] = [translate_name(v, reverse_map) for v in coef_df['变量']]
+    return coef_df
+
+
+def side_by_side(models, reverse_map=None):
+    """多个模型的系数并排对比 (列按模型名分组，行按变量对齐)"""
+    parts = {}
+    for name, model in models.items():
+        parts[name] = pd.DataFrame({'系数': model.params, '标准误': model.bse, 'p值': model.pvalues})
+    table = pd.concat(parts, axis=1)
+    if reverse_map:
+        table.index = [translate_name(v, reverse_map) for v in table.index]
+    nobs = pd.DataFrame({(name, '系数'): [model.nobs] for name, model in models.items()}, index=['N'])
+    return pd.concat([table, nobs])
+
+
+def interaction_margins(model, data, interacts, is_cat, safe_controls, how="atmeans", at=None, rows=None):
+    """margins A#B：前两个交互变量各取值组合上的预测边际 (margins.Margins)
+
+    分类变量取全部水平，连续变量取 at 中给定的值 (未给定时取分位数)；
+    其余交互变量与控制变量按 how (atmeans / asobserved) 处理。
+    rows: 估计样本的布尔掩码 (如剔除极端值后)，逐列取子集，无须先复制整个数据表。
+    """
+    at = at or {}
+    column = (lambda c: data[c]) if rows is None else (lambda c: data[c][rows])
+    grid_at = {v: at.get(v) or default_at(column(v), c) for v, c in zip(interacts[:2], is_cat[:2])}
+    return compute_margins(model, data, grid_at, list(safe_controls) + list(interacts[2:]), how, rows)
+
+
+def margins_frame(margins, alpha=0.05):
+    """预测边际表 (绘图与导出使用的列名)"""
+    sf = margins.summary_frame(alpha)
+    cols = list(margins.grid.columns) + ['margin', 'se', 'ci_lower', 'ci_upper']
+    return sf[cols].rename(columns={'margin': 'predicted_resid'})
+
+
+def predictive_margins(model, data, safe_interact1, safe_interact2, safe_controls, alpha=0.05, rows=None,
+                       how="atmeans", at=None, is_cat=(True, True), factors=()):
+    """两个交互变量各取值组合上的预测值及置信区间 (margins A#B, atmeans 或 asobserved)
+
+    factors: 参与 ## 交互的其他变量。
+    """
+    m = interaction_margins(model, data, [safe_interact1, safe_interact2] + list(factors), list(is_cat),
+                            safe_controls, how, at, rows)
+    return margins_frame(m, alpha)
+
+
+# --- 批量运行 ---
+def stage1_key(spec):
+    """第一阶段规格的标识：相同标识的规格共享同一次拟合"""
+    return (spec['dep_var'], tuple(spec.get('control_vars', [])), tuple(spec.get('fe_vars', [])),
+            spec.get('vce_mode', "不使用"), spec.get('cluster_var') if spec.get('vce_mode') == "vce(cluster)" else None)
+
+
+def spec_interacts(spec):
+    """规格的全部交互变量 (interact_var1、interact_var2 及 ## 中的其他变量 interact_extra)"""
+    return [spec['interact_var1'], spec['interact_var2']] + list(spec.get('interact_extra', []))
+
+
+def spec_label(spec):
+    return spec.get('label') or " × ".join(spec_interacts(spec))
+
+
+def spec_columns(spec):
+    """规格涉及的全部原始列名"""
+    cols = [spec['dep_var']] + list(spec.get('control_vars', [])) + list(spec.get('fe_vars', [])) \
+        + spec_interacts(spec) + list(spec.get('stage2_controls', []))
+    if spec.get('vce_mode') == "vce(cluster)" and spec.get('cluster_var'):
+        cols.append(spec['cluster_var'])
+    return list(dict.fromkeys(cols))
+
+
+def run_stage2_job(job):
+    """单个第二阶段任务 (在工作进程中执行，只返回紧凑的表格结果)"""
+    data = job['data']
+    i1, i2, *extra = job['interacts']
+    design, is_cat = stage2_design(data, job['interacts'], job['controls'])
+    model = fit_ols(design, data, vce=job['vce'], cluster=job['cluster'])
+    alpha = job['alpha']
+    out = {'label': job['label'], 'nobs': int(model.nobs), 'coefs': coef_frame(model, alpha=alpha),
+           'interact': (i1, i2), 'margins': None}
+    out['margins'] = predictive_margins(model, data, i1, i2, job['controls'], alpha, how=job.get('margins_type', "atmeans"),
+                                        is_cat=is_cat, factors=extra)
+    return out
+
+
+def make_pool(max_workers=None):
+    """进程池 (spawn 方式启动，避免在多线程的 Streamlit 服务进程中 fork)"""
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), mp_context=mp.get_context("spawn"))
+
+
+def map_jobs(func, jobs, max_workers=None, progress=None):
+    """在进程池上执行任务；max_workers=1 时直接在当前进程顺序执行
+
+    progress(已完成数, 总数) 在每个任务完成后调用；回调抛出异常即中止其余任务。
+    """
+    results = []
+    if max_workers == 1 or len(jobs) <= 1:
+        for i, job in enumerate(jobs):
+            results.append(func(job))
+            if progress:
+                progress(i + 1, len(jobs))
+        return results
+    pool = make_pool(min(max_workers or os.cpu_count(), len(jobs)))
+    try:
+        for i, res in enumerate(pool.map(func, jobs)):
+            results.append(res)
+            if progress:
+                progress(i + 1, len(jobs))
+    except BaseException:
+        # progress 回调抛出异常 (如任务被取消) 时，丢弃尚未开始的任务而不是等它们全部完成
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return results
+
+
+def run_batch(df, specs, remove_extreme=True, ci_level=0.95, max_workers=None, progress=None):
+    """批量运行多组交互规格
+
+    df 使用原始 (中文) 列名；所有规格在共同的无缺失样本上估计，
+    第一阶段规格相同的只拟合一次并复用残差，第二阶段在进程池中并行。
+    返回 dict: coefs / margins 合并表、第一阶段拟合次数等。
+    """
+    cols = list(dict.fromkeys(c for spec in specs for c in spec_columns(spec)))
+    df_clean = prepare_frame(df[cols].dropna())
+    # 按全部规格的固定效应剔除单例：共同样本中任一规格的任一维度都不再有单例
+    all_fes = list(dict.fromkeys(f for spec in specs for f in spec.get('fe_vars', [])))
+    df_clean, n_singletons = prune_singletons(df_clean, all_fes)
+    df_safe, col_map, reverse_map = safe_rename(df_clean)
+
+    stage1 = {}
+    for spec in specs:
+        key = stage1_key(spec)
+        if key in stage1:
+            continue
+        vce = VCE_TYPES[spec.get('vce_mode', "不使用")]
+        cluster = col_map[spec['cluster_var']] if vce == "cluster" else None
+        res = fit_hdfe(df_safe, col_map[spec['dep_var']], [col_map[c] for c in spec.get('control_vars', [])],
+                       [col_map[c] for c in spec.get('fe_vars', [])], vce=vce, cluster=cluster,
+                       singletons=n_singletons)
+        stage1[key] = (res, res.resid.values)
+
+    jobs = []
+    for spec in specs:
+        res, resid = stage1[stage1_key(spec)]
+        # 极端值规则随规格给出 (与第二阶段标签页相同的 σ / MAD / 百分位规则)
+        extreme = extreme_mask(resid, *outlier_settings(spec))
+        vce = VCE_TYPES[spec.get('vce_mode', "不使用")]
+        s2_cols = spec_interacts(spec) + list(spec.get('stage2_controls', []))
+        if vce == "cluster":
+            s2_cols.append(spec['cluster_var'])
+        safe_cols = list(dict.fromkeys(col_map[c] for c in s2_cols))
+        data = df_safe[safe_cols].assign(resid_sat=resid)
+        if remove_extreme:
+            data = data[~extreme]
+        jobs.append({
+            'label': spec_label(spec), 'data': data,
+            'interacts': [col_map[c] for c in spec_interacts(spec)],
+            'controls': [col_map[c] for c in spec.get('stage2_controls', [])],
+            'vce': vce, 'cluster': col_map[spec['cluster_var']] if vce == "cluster" else None,
+            'alpha': 1 - ci_level,
+        })
+
+    outputs = map_jobs(run_stage2_job, jobs, max_workers=max_workers, progress=progress)
+
+    coef_tables, margin_tables = [], []
+    for out in outputs:
+        coefs = out['coefs']
+        coefs['变量'] = [translate_name(v, reverse_map) for v in coefs['变量']]
+        coefs.insert(0, 'N', out['nobs'])
+        coefs.insert(0, '规格', out['label'])
+        coef_tables.append(coefs)
+        if out['margins'] is not None:
+            # 各规格的交互变量不同，统一整理为长表
+            m, (a, b) = out['margins'], out['interact']
+            margin_tables.append(pd.DataFrame({
+                '规格': out['label'],
+                '变量A': reverse_map[a], 'A取值': m[a].values,
+                '变量B': reverse_map[b], 'B取值': m[b].values,
+                'predicted_resid': m['predicted_resid'].values,
+                'ci_lower': m['ci_lower'].values, 'ci_upper': m['ci_upper'].values,
+            }))
+    return {
+        'coefs': pd.concat(coef_tables, ignore_index=True) if coef_tables else pd.DataFrame(),
+        'margins': pd.concat(margin_tables, ignore_index=True) if margin_tables else pd.DataFrame(),
+        'n_obs': len(df_clean),
+        'n_singletons': n_singletons,
+        'n_stage1_fits': len(stage1),
+        'n_specs': len(specs),
+    }
+
+
+# --- 子样本 (异质性) 分析 ---
+def subgroup_labels(series, n_bins=4):
+    """子样本划分：分类变量按各类别；连续变量按分位数分箱
+
+    返回有序的分类序列：类别顺序为原取值的自然顺序 (数值按大小、分类类型按其类别顺序)，
+    分箱按区间先后；只在生成“子样本”标签时转为文本。
+    """
+    if is_categorical(series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series.cat.remove_unused_categories()
+        return series.astype("category")
+    return pd.qcut(series, n_bins, duplicates='drop').cat.remove_unused_categories()
+
+
+def interaction_rows(coefs):
+    """系数表中的交互项 (项名含 ':')"""
+    return coefs[coefs['变量'].str.contains(':', regex=False)]
+
+
+def run_subgroup_job(job):
+    """单个子样本的两阶段估计 (在工作进程中执行)"""
+    data = job['data']
+    try:
+        res1 = fit_hdfe(data, job['dep'], job['controls'], job['fes'], vce=job['vce'], cluster=job['cluster'],
+                        fe=FixedEffects(job['fe_codes'], names=job['fes']), singletons=job['singletons'])
+        data = data.assign(resid_sat=res1.resid.values)
+        if job['remove_extreme']:
+            data = data[~extreme_mask(data['resid_sat'].values, job['rule'], job['value'])]
+        design, _ = stage2_design(data, job['interacts'], job['stage2_controls'])
+        model = fit_ols(design, data, vce=job['vce'], cluster=job['cluster'])
+        return {'group': job['group'], 'nobs': int(model.nobs), 'coefs': coef_frame(model, alpha=job['alpha']), 'error': None}
+    except Exception as e:
+        return {'group': job['group'], 'nobs': len(data), 'coefs': None, 'error': str(e)}
+
+
+def run_subgroups(df, spec, by, n_bins=4, remove_extreme=True, ci_level=0.95, max_workers=None, progress=None):
+    """按 by 的每个类别 (或分位数区间) 拆分样本，并行地对所有子样本运行两阶段回归
+
+    固定效应分组编码在全样本上只计算一次，各子样本直接取子集。
+    返回 (森林图数据表, 出错的子样本列表)。
+    """
+    cols = list(dict.fromkeys(spec_columns(spec) + [by]))
+    df_clean = prepare_frame(df[cols].dropna())
+    groups = subgroup_labels(df_clean[by], n_bins)
+    df_safe, col_map, reverse_map = safe_rename(df_clean)
+
+    safe_fes = [col_map[c] for c in spec.get('fe_vars', [])]
+    fe_full = FixedEffects.from_frame(df_safe, safe_fes)
+    vce = VCE_TYPES[spec.get('vce_mode', "不使用")]
+    safe_cols = list(dict.fromkeys(col_map[c] for c in spec_columns(spec)))
+    rule, value = outlier_settings(spec)
+
+    jobs = []
+    for g in groups.cat.categories:
+        mask = (groups == g).to_numpy(copy=True)
+        # 单例在每个子样本内迭代剔除 (全样本中不是单例的组在子样本中可能只剩一个观测)
+        keep, _ = singleton_mask([c[mask] for c in fe_full.codes])
+        n_singletons = int(len(keep) - keep.sum())
+        if n_singletons:
+            mask[np.flatnonzero(mask)[~keep]] = False
+        fe_sub = fe_full.subset(mask)
+        jobs.append({
+            'group': g, 'data': df_safe.loc[mask, safe_cols], 'fe_codes': fe_sub.codes,
+            'dep': col_map[spec['dep_var']], 'controls': [col_map[c] for c in spec.get('control_vars', [])],
+            'fes': safe_fes, 'vce': vce, 'cluster': col_map[spec['cluster_var']] if vce == "cluster" else None,
+            'interacts': [col_map[c] for c in spec_interacts(spec)],
+            'stage2_controls': [col_map[c] for c in spec.get('stage2_controls', [])],
+            'remove_extreme': remove_extreme, 'rule': rule, 'value': value, 'alpha': 1 - ci_level,
+            'singletons': n_singletons,
+        })
+
+    outputs = map_jobs(run_subgroup_job, jobs, max_workers=max_workers, progress=progress)
+
+    rows, failed = [], []
+    for out in outputs:
+        if out['error'] is not None:
+            failed.append((out['group'], out['error']))
+            continue
+        inter = interaction_rows(out['coefs']).copy()
+        inter['变量'] = [translate_name(v, reverse_map) for v in inter['变量']]
+        inter.insert(0, 'N', out['nobs'])
+        inter.insert(0, '子样本', f"{by}={out['group']}")
+        rows.append(inter)
+    table = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+    return table, failed
+
+
+# --- 按配置文件运行 (命令行 / 定时任务) ---
+def config_columns(config):
+    """配置 (analysis_config.json) 涉及的全部原始列名，含异质性过滤变量"""
+    cols = spec_columns(config)
+    if config.get('hetero_var'):
+        cols.append(config['hetero_var'])
+    return [c for c in dict.fromkeys(cols) if c not in PLACEHOLDERS]
+
+
+def apply_filter(df, config):
+    """按配置中的异质性过滤条件 (hetero_var / hetero_range / hetero_cats) 筛选样本"""
+    var = config.get('hetero_var')
+    if not var or var in PLACEHOLDERS:
+        return df
+    ser = df[var]
+    if pd.api.types.is_numeric_dtype(ser) and config.get('hetero_range'):
+        lo, hi = config['hetero_range']
+        return df[(ser >= lo) & (ser <= hi)]
+    if config.get('hetero_cats'):
+        return df[ser.isin(config['hetero_cats'])]
+    return df
+
+
+def run_analysis(df, config):
+    """按一个配置运行完整的两阶段分析 (与界面上逐步操作的结果一致)
+
+    df 使用原始 (中文) 列名。极端值规则取配置中的 outlier_rule / outlier_k / outlier_pct，
+    缺省为 3σ；remove_extreme 缺省为 True。预测边际按 margins_type (atmeans / asobserved，缺省 atmeans)
+    计算，连续交互变量的取值由 margins_at ({变量: [取值]}) 指定；tests 为 test/lincom 命令列表。
+    返回 dict：第一阶段摘要、吸收自由度表、第二阶段系数表、方案对比表、预测边际 (原始列名)、检验结果、
+    esttab 用的估计摘要 (两个方案与预测边际)、样本量及第一阶段之前剔除的单例观测数。
+    """
+    vce = VCE_TYPES[config.get('vce_mode', "不使用")]
+    if vce == "cluster" and config.get('cluster_var') not in df.columns:
+        raise ValueError("vce(cluster) 需要指定聚类变量")
+    df_clean = prepare_frame(apply_filter(df, config)[spec_columns(config)].dropna())
+    # 与 reghdfe 相同：第一阶段之前迭代剔除单例观测，两阶段使用同一样本
+    df_clean, n_singletons = prune_singletons(df_clean, config.get('fe_vars', []))
+    df_safe, col_map, reverse_map = safe_rename(df_clean)
+    safe_i1, safe_i2, *safe_extra = [col_map[c] for c in spec_interacts(config)]
+    safe_s2 = [col_map[c] for c in config.get('stage2_controls', [])]
+    cluster = col_map[config['cluster_var']] if vce == "cluster" else None
+
+    # 第一阶段
+    model1 = fit_hdfe(df_safe, col_map[config['dep_var']], [col_map[c] for c in config.get('control_vars', [])],
+                      [col_map[c] for c in config.get('fe_vars', [])], vce=vce, cluster=cluster,
+                      singletons=n_singletons)
+    data_all = with_columns(df_safe, resid_sat=model1.resid.values)
+
+    # 极端值
+    extreme = ResidualIndex(model1.resid.values).mask(*outlier_settings(config))
+
+    # 第二阶段：方案1/方案2 共用同一组交叉积
+    design, is_cat = stage2_design(data_all, [safe_i1, safe_i2] + safe_extra, safe_s2)
+    cp_full = stage2_cross_products(design, data_all, cluster)
+    model_all, model_trim = cp_full.fit(vce), cp_full.excluding(extreme).fit(vce)
+    remove_extreme = config.get('remove_extreme', True)
+    model2 = model_trim if remove_extreme else model_all
+    alpha = 1 - config.get('ci_level', 0.90)
+
+    rows = ~extreme if remove_extreme else None
+    at = {col_map[v]: values for v, values in (config.get('margins_at') or {}).items() if v in col_map}
+    margins2 = interaction_margins(model2, data_all, [safe_i1, safe_i2] + safe_extra, is_cat, safe_s2,
+                                   how=config.get('margins_type', "atmeans"), at=at, rows=rows)
+    margins = margins_frame(margins2, alpha).rename(columns=reverse_map)
+    estimates = [StoredEstimates.from_result(model_all, "方案1 (不删除极端值)", reverse_map),
+                 StoredEstimates.from_result(model_trim, "方案2 (删除极端值)", reverse_map),
+                 StoredEstimates.from_margins(margins2, "margins", reverse_map, model2.nobs)]
+    tests = None
+    if config.get('tests'):
+        commands = config['tests'] if isinstance(config['tests'], str) else "\n".join(config['tests'])
+        parser = HypothesisParser(model2.params.index, reverse_map, model2.omitted)
+        tests = evaluate(model2, parser.parse_lines(commands), alpha)
+    dof_table = model1.dof_table.replace({"absvar": reverse_map}) if model1.dof_table is not None else None
+    return {
+        'stage1_summary': model1.summary_text(title="HDFE Linear regression (absorbing fixed effects)",
+                                              name_map=reverse_map),
+        'dof_table': dof_table,
+        'coefs': coef_frame(model2, reverse_map, alpha),
+        'comparison': side_by_side({"方案1 (不删除极端值)": model_all, "方案2 (删除极端值)": model_trim}, reverse_map),
+        'margins': margins,
+        'tests': tests,
+        'estimates': estimates,
+        'n_obs': len(df_clean),
+        'n_singletons': n_singletons,
+        'n_extreme': int(extreme.sum()),
+    }
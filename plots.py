@@ -0,0 +1,196 @@
+"""交互效应预测边际图与设定曲线图 (与界面解耦，界面与命令行共用)
+
+图形参数与“配置管理”导出的 analysis_config.json 使用相同的键名。
+绘图分三层：数据 (预测边际表等) → 图形描述 FigureSpec (绘图函数、数据、样式参数与字体相关的 rcParams)
+→ 输出字节。输出按 (描述的内容哈希, 格式, DPI) 缓存：只改样式时只重绘图形、不重新估计；
+界面显示低 DPI 的预览，高 DPI 的 PNG/SVG/PDF 在导出时才生成。每次绘制后立即关闭图形。
+"""
+import io
+import json
+import os
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+
+from data_cache import DatasetCache, content_hash
+from speccurve import NONE_LABEL
+
+# 图形参数的默认值 (与界面控件的默认值一致)
+PLOT_DEFAULTS = {
+    'chart_type': "点图", 'show_ci': True, 'fig_width': 1000, 'fig_height': 600, 'fig_dpi': 200,
+    'font_choice': "默认", 'font_size': 12, 'legend_loc': "best", 'title_text': None, 'title_loc': "center",
+    'grid_off': False, 'line_style': "solid", 'line_color': "#1f77b4",
+    'xlabel_override': None, 'ylabel_override': None,
+}
+
+
+def plot_settings(config):
+    """从配置中取出图形参数，缺失的键使用默认值"""
+    return {k: config.get(k, v) for k, v in PLOT_DEFAULTS.items()}
+
+
+def apply_font(font_choice):
+    """设置中文字体 (“默认”时不修改)"""
+    if font_choice and font_choice != "默认":
+        plt.rcParams['font.sans-serif'] = [font_choice]
+        plt.rcParams['axes.unicode_minus'] = False
+
+
+def margins_figure(pred_df, col1, col2, settings, label1=None, label2=None):
+    """绘制两个分类交互变量的预测边际图
+
+    pred_df 含 col1、col2 两列取值及 predicted_resid / ci_lower / ci_upper；
+    label1、label2 为图例与坐标轴使用的变量名 (默认即列名)。
+    """
+    s = {**PLOT_DEFAULTS, **settings}
+    label1 = label1 or col1
+    label2 = label2 or col2
+    fig, ax = plt.subplots(figsize=(s['fig_width'] / 100, s['fig_height'] / 100), dpi=s['fig_dpi'])
+    sns.set_style("whitegrid" if not s['grid_off'] else "white")
+    plt.rcParams['font.size'] = s['font_size']
+    cats = sorted(pred_df[col1].unique())
+    pos_map = {v: i for i, v in enumerate(cats)}
+    for h in sorted(pred_df[col2].unique()):
+        sub = pred_df[pred_df[col2] == h]
+        x = [pos_map[v] for v in sub[col1]]
+        y = sub['predicted_resid']
+        if s['chart_type'] == "点图":
+            ax.scatter(x, y, label=f"{label2}={h}", color=s['line_color'])
+        elif s['chart_type'] == "折线图":
+            ax.plot(x, y, marker='o', label=f"{label2}={h}", linestyle=s['line_style'], color=s['line_color'])
+        else:  # 柱状图
+            ax.bar(x, y, label=f"{label2}={h}", color=s['line_color'], alpha=0.8)
+        if s['show_ci']:
+            yerr_lower = y - sub['ci_lower']
+            yerr_upper = sub['ci_upper'] - y
+            ax.errorbar(x, y, yerr=[yerr_lower, yerr_upper], fmt='none', ecolor='gray', capsize=4)
+    ax.set_xticks(list(range(len(cats))))
+    ax.set_xticklabels(cats)
+
+    ax.set_xlabel(s['xlabel_override'] or label1)
+    ax.set_ylabel(s['ylabel_override'] or "Predicted Residual")
+    ax.legend(title=label2, loc=s['legend_loc'])
+    ax.set_title(s['title_text'] or f"Interaction Effect: {label1} × {label2}", loc=s['title_loc'])
+    return fig
+
+
+def spec_curve_figure(table, term, significance=0.05, width=10, height=6):
+    """设定曲线图 (speccurve.run_spec_curve 的结果)
+
+    上图：term 在各规格下的系数按大小排序，附置信区间，p < significance 的规格着色；
+    下图：对应规格纳入了哪些控制变量与固定效应 (指示矩阵)。
+    """
+    sub = table[table['变量'] == term].sort_values('系数', kind="stable").reset_index(drop=True)
+    rows = {}
+    for col, prefix in (('控制变量', ""), ('固定效应', "FE: ")):
+        for text in sub[col]:
+            for v in text.split("、"):
+                if v != NONE_LABEL:
+                    rows.setdefault(prefix + v, None)
+    labels = list(rows)
+    fig, (ax, ax_ind) = plt.subplots(2, 1, sharex=True, figsize=(width, height),
+                                     gridspec_kw={'height_ratios': [3, max(1, 0.35 * len(labels))]})
+    x = range(len(sub))
+    colors = ['#d62728' if p < significance else '#7f7f7f' for p in sub['p值']]
+    ax.vlines(x, sub['CI下限'], sub['CI上限'], colors=colors, alpha=0.4, linewidth=1)
+    ax.scatter(x, sub['系数'], c=colors, s=12, zorder=3)
+    ax.axhline(0, color='black', linestyle='--', linewidth=1)
+    ax.set_ylabel("Coefficient")
+    ax.set_title(f"{term}  ({len(sub)} specifications, red: p < {significance:g})")
+
+    for i, (cs, fs) in enumerate(zip(sub['控制变量'], sub['固定效应'])):
+        included = set(cs.split("、")) | {"FE: " + f for f in fs.split("、")}
+        ys = [j for j, lab in enumerate(labels) if lab in included]
+        ax_ind.scatter([i] * len(ys), ys, marker='|', color=colors[i], s=40)
+    ax_ind.set_yticks(range(len(labels)))
+    ax_ind.set_yticklabels(labels)
+    ax_ind.set_ylim(-0.5, len(labels) - 0.5)
+    ax_ind.invert_yaxis()
+    ax_ind.set_xlabel("Specification (sorted by coefficient)")
+    fig.tight_layout()
+    return fig
+
+
+def figure_png(fig, dpi=None):
+    """将图形导出为 PNG 字节"""
+    return figure_bytes(fig, "png", dpi)
+
+
+def figure_bytes(fig, fmt="png", dpi=None):
+    """将图形导出为 fmt (png / svg / pdf) 字节"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=dpi or fig.dpi, bbox_inches='tight')
+    return buf.getvalue()
+
+
+# --- 图形描述与渲染缓存 ---
+# 界面预览使用的 DPI；导出使用用户设置的 fig_dpi
+PREVIEW_DPI = 80
+
+# 导出格式 (界面选项 -> 扩展名) 与 MIME 类型
+FIGURE_FORMATS = {"PNG": "png", "SVG": "svg", "PDF": "pdf"}
+FIGURE_MIME = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+
+# 渲染结果缓存的内存预算 (MB)，可通过环境变量 APP_FIGURE_CACHE_MB 配置
+FIGURE_CACHE_MB = float(os.environ.get("APP_FIGURE_CACHE_MB", "64"))
+
+# 影响中文字体显示的 rcParams；作为描述的一部分，渲染时在 rc_context 中恢复
+FONT_RC = ('font.family', 'font.sans-serif', 'axes.unicode_minus')
+
+
+def _margins(data, col1, col2, settings, label1=None, label2=None):
+    return margins_figure(data, col1, col2, settings, label1, label2)
+
+
+def _spec_curve(data, term, significance=0.05):
+    return spec_curve_figure(data, term, significance)
+
+
+# 描述中的 kind -> 绘图函数 (第一个参数为数据表，其余为样式参数)
+FIGURE_KINDS = {'margins': _margins, 'speccurve': _spec_curve}
+
+
+class FigureSpec:
+    """一张图的完整描述；内容相同的描述哈希相同，作为渲染缓存的键"""
+
+    def __init__(self, kind, data, options=None, rc=None):
+        if kind not in FIGURE_KINDS:
+            raise ValueError(f"未知的图形类型: {kind}")
+        self.kind = kind
+        self.data = data
+        self.options = dict(options or {})
+        # 默认取当前的字体设置 (界面上传字体、选择字体时修改的是全局 rcParams)
+        self.rc = dict(rc) if rc is not None else {k: plt.rcParams[k] for k in FONT_RC}
+        self._key = None
+
+    @property
+    def key(self):
+        if self._key is None:
+            data = pd.util.hash_pandas_object(self.data, index=True).values.tobytes()
+            meta = json.dumps([self.kind, list(map(str, self.data.columns)), self.options, self.rc],
+                              sort_keys=True, ensure_ascii=False, default=str)
+            self._key = content_hash(data + meta.encode("utf-8"))
+        return self._key
+
+    def render(self, fmt="png", dpi=None):
+        """绘制并导出为字节，随后关闭图形"""
+        with plt.rc_context(self.rc):
+            fig = FIGURE_KINDS[self.kind](self.data, **self.options)
+            try:
+                return figure_bytes(fig, fmt, dpi)
+            finally:
+                plt.close(fig)
+
+
+_figure_cache = DatasetCache(FIGURE_CACHE_MB * 1024 ** 2, sizeof=len)
+
+
+def get_figure_cache():
+    """进程级共享的渲染结果缓存 (内容哈希相同的图在各会话间共用)"""
+    return _figure_cache
+
+
+def render_cached(spec, fmt="png", dpi=PREVIEW_DPI):
+    """按 (描述哈希, 格式, DPI) 缓存的渲染结果；返回 (字节, 是否命中)"""
+    return _figure_cache.get_or_load((spec.key, fmt, int(dpi)), lambda: spec.render(fmt, dpi))
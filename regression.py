@@ -0,0 +1,192 @@
+"""回归结果容器与方差估计 (不依赖 Streamlit，可被命令行/后台任务复用)"""
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.linalg import solve_triangular
+
+
+_SAFE_NAME = re.compile(r"v_\d+")
+
+
+def translate_name(name, reverse_map):
+    """将项名中的安全变量名 (v_0, v_1...) 替换回原始列名"""
+    if not reverse_map:
+        return name
+    return _SAFE_NAME.sub(lambda m: str(reverse_map.get(m.group(0), m.group(0))), str(name))
+
+
+def rmcoll(XtX, tol=1e-8):
+    """按列顺序剔除共线列 (类似 Stata 的 _rmcoll)，返回保留列的布尔掩码"""
+    XtX = np.asarray(XtX, dtype=float)
+    k = XtX.shape[0]
+    keep = np.zeros(k, dtype=bool)
+    L = np.zeros((k, k))  # 已选列的增量 Cholesky 因子
+    sel = []
+    for j in range(k):
+        d = XtX[j, j]
+        if d <= 0:
+            continue
+        m = len(sel)
+        c = solve_triangular(L[:m, :m], XtX[sel, j], lower=True) if m else np.empty(0)
+        r = d - c @ c
+        if r <= tol * d:
+            continue
+        L[m, :m] = c
+        L[m, m] = np.sqrt(r)
+        sel.append(j)
+        keep[j] = True
+    return keep
+
+
+def sandwich(bread, X, e, vce="unadjusted", clusters=None, df_k=None, n_clusters=None):
+    """由 bread=(X'X)^-1 计算协方差矩阵，小样本修正与 Stata/reghdfe 一致
+
+    df_k: 用于自由度修正的参数个数 (含被吸收的固定效应)
+    返回 (cov, df_resid_for_inference, n_clusters)
+    """
+    n = X.shape[0]
+    k = X.shape[1] if df_k is None else df_k
+    if vce == "robust":
+        meat = (X * (e ** 2)[:, None]).T @ X
+        cov = bread @ meat @ bread * (n / (n - k))
+        return cov, n - k, None
+    if vce == "cluster":
+        codes = np.asarray(clusters)
+        G = int(codes.max()) + 1 if n_clusters is None else n_clusters
+        scores = np.zeros((G, X.shape[1]))
+        np.add.at(scores, codes, X * e[:, None])
+        meat = scores.T @ scores
+        q = (n - 1) / (n - k) * G / (G - 1)
+        cov = bread @ meat @ bread * q
+        return cov, G - 1, G
+    s2 = float(e @ e) / (n - k)
+    return bread * s2, n - k, None
+
+
+class RegressionResult:
+    """轻量回归结果：系数、协方差、残差及常用统计量
+
+    接口与 statsmodels 结果对象的常用部分保持一致 (params/bse/tvalues/pvalues/conf_int)，
+    以便界面与导出代码无须区分估计引擎。
+    """
+
+    def __init__(self, params, cov, nobs, df_resid, vce="unadjusted", resid=None,
+                 rsquared=np.nan, rsquared_adj=np.nan, rsquared_within=np.nan,
+                 n_clusters=None, omitted=(), extra=None):
+        self.params = params
+        self.cov = cov
+        self.nobs = int(nobs)
+        self.df_resid = df_resid
+        self.vce = vce
+        self.resid = resid
+        self.rsquared = rsquared
+        self.rsquared_adj = rsquared_adj
+        self.rsquared_within = rsquared_within
+        self.n_clusters = n_clusters
+        self.omitted = list(omitted)
+        self.extra = dict(extra or {})
+        # 由公式构建时保存设计信息 (patsy 或 FactorialDesignInfo) 及保留列，用于预测/边际效应
+        self.design_info = None
+        self.exog_keep = None
+
+    @property
+    def bse(self):
+        return pd.Series(np.sqrt(np.clip(np.diag(self.cov.values), 0, None)), index=self.params.index)
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        return pd.Series(2 * stats.t.sf(np.abs(self.tvalues.values), self.df_resid), index=self.params.index)
+
+    def cov_params(self):
+        return self.cov
+
+    def conf_int(self, alpha=0.05):
+        q = stats.t.ppf(1 - alpha / 2, self.df_resid)
+        b, se = self.params, self.bse
+        return pd.DataFrame({0: b - q * se, 1: b + q * se})
+
+    def design_matrix(self, exog, **build_kwargs):
+        """新数据的设计矩阵 (已去掉共线列)
+
+        设计信息为 factorial.FactorialDesignInfo 时，build_kwargs 传给其 build (如 means)。
+        """
+        if hasattr(self.design_info, "build"):
+            X = self.design_info.build(exog, **build_kwargs)
+        else:
+            import patsy
+            X = np.asarray(patsy.build_design_matrices([self.design_info], exog, NA_action="raise")[0])
+        if self.exog_keep is not None:
+            X = X[:, self.exog_keep]
+        return X
+
+    def get_prediction(self, exog, **build_kwargs):
+        """在新数据上预测均值并给出 delta 方法标准误 (接口同 statsmodels 的 get_prediction)"""
+        X = self.design_matrix(exog, **build_kwargs)
+        V = self.cov.values
+        return Prediction(X @ self.params.values, np.sqrt(np.einsum('ij,jk,ik->i', X, V, X)), self.df_resid)
+
+    def coef_table(self, alpha=0.05, name_map=None):
+        """系数表 (与第二阶段下载的表格列名一致)"""
+        ci = self.conf_int(alpha)
+        df = pd.DataFrame({
+            '变量': self.params.index,
+            '系数': self.params.values,
+            '标准误': self.bse.values,
+            't值': self.tvalues.values,
+            'p值': self.pvalues.values,
+            'CI下限': ci[0].values,
+            'CI上限': ci[1].values,
+        })
+        if name_map:
+            df['变量'] = [translate_name(v, name_map) for v in df['变量']]
+        return df
+
+    def summary_text(self, title="OLS", name_map=None):
+        """纯文本摘要 (代替 statsmodels 的 summary().as_text())"""
+        vce_label = {"robust": "Robust", "cluster": f"Cluster ({self.n_clusters} groups)"}.get(self.vce, "Unadjusted")
+        lines = [
+            title,
+            "=" * 78,
+            f"No. Observations: {self.nobs:>12d}    R-squared:          {self.rsquared:>10.4f}",
+            f"Df Residuals:     {self.df_resid:>12d}    Adj. R-squared:     {self.rsquared_adj:>10.4f}",
+            f"Covariance Type:  {vce_label:<12s}    Within R-squared:   {self.rsquared_within:>10.4f}",
+        ]
+        for k, v in self.extra.items():
+            lines.append(f"{k}: {translate_name(v, name_map)}")
+        lines.append("-" * 78)
+        lines.append(f"{'':<30s}{'coef':>10s}{'std err':>10s}{'t':>8s}{'P>|t|':>8s}{'[0.025':>10s}{'0.975]':>10s}")
+        lines.append("-" * 78)
+        ci = self.conf_int()
+        for name in self.params.index:
+            label = translate_name(name, name_map)
+            lines.append(f"{str(label)[:30]:<30s}{self.params[name]:>10.4f}{self.bse[name]:>10.4f}"
+                         f"{self.tvalues[name]:>8.3f}{self.pvalues[name]:>8.3f}{ci.loc[name, 0]:>10.4f}{ci.loc[name, 1]:>10.4f}")
+        if self.omitted:
+            lines.append("-" * 78)
+            lines.append("Omitted (collinear): " + ", ".join(translate_name(o, name_map) for o in self.omitted))
+        lines.append("=" * 78)
+        return "\n".join(lines)
+
+
+class Prediction:
+    """预测均值及其置信区间"""
+
+    def __init__(self, mean, se, df_resid):
+        self.predicted_mean = mean
+        self.se_mean = se
+        self.df_resid = df_resid
+
+    def summary_frame(self, alpha=0.05):
+        q = stats.t.ppf(1 - alpha / 2, self.df_resid)
+        return pd.DataFrame({
+            'mean': self.predicted_mean,
+            'mean_se': self.se_mean,
+            'mean_ci_lower': self.predicted_mean - q * self.se_mean,
+            'mean_ci_upper': self.predicted_mean + q * self.se_mean,
+        })
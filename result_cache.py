@@ -0,0 +1,181 @@
+"""拟合结果缓存：按 (数据指纹, 样本, 公式, 固定效应, VCE, 聚类变量) 索引
+
+结果以紧凑的数组形式 (系数、协方差、残差及少量元数据) 保存在进程级共享的 LRU 缓存中，
+分析人员刷新页面、另开标签页或切回之前的规格时直接复用，无须重新拟合。
+设置环境变量 APP_RESULT_CACHE_DIR 后另有磁盘层 (npz 文件)，服务重启后仍然有效。
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from data_cache import DatasetCache, content_hash
+from regression import RegressionResult
+
+# 内存层预算 (MB)，可通过环境变量 APP_RESULT_CACHE_MB 配置
+DEFAULT_BUDGET_MB = float(os.environ.get("APP_RESULT_CACHE_MB", "256"))
+
+# 磁盘层目录 (为空时不启用)
+DEFAULT_DIR = os.environ.get("APP_RESULT_CACHE_DIR") or None
+
+# 缓存格式版本：结果容器或估计方法变化时递增，使旧的磁盘缓存失效
+FORMAT_VERSION = 2
+
+
+def sample_fingerprint(index):
+    """估计样本的指纹 (行索引的哈希)：异质性过滤、缺失值剔除等都会改变它"""
+    return content_hash(pd.util.hash_array(np.asarray(index)))
+
+
+def result_key(data_digest, index, dep, controls, fe_cols, vce, cluster=None, col_map=None):
+    """第一阶段结果的缓存键
+
+    变量均使用原始列名；col_map 为其中涉及变量的安全名映射 (结果中的项名使用安全名)。
+    """
+    cols = [dep] + list(controls) + list(fe_cols) + ([cluster] if cluster else [])
+    payload = json.dumps([FORMAT_VERSION, data_digest, sample_fingerprint(index), dep, list(controls),
+                          list(fe_cols), vce, cluster, {c: (col_map or {}).get(c, c) for c in cols}],
+                         ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _to_builtin(obj):
+    """numpy 标量 -> Python 内置类型 (供 json 序列化)"""
+    return obj.item() if hasattr(obj, 'item') else str(obj)
+
+
+def pack_result(result):
+    """RegressionResult -> 紧凑数组字典 (可直接写入 npz，不依赖 pickle)"""
+    meta = {
+        'nobs': result.nobs, 'df_resid': result.df_resid, 'vce': result.vce,
+        'rsquared': result.rsquared, 'rsquared_adj': result.rsquared_adj, 'rsquared_within': result.rsquared_within,
+        'n_clusters': result.n_clusters, 'extra': result.extra,
+        'df_absorbed': getattr(result, 'df_absorbed', None),
+    }
+    packed = {
+        'meta': np.array(json.dumps(meta, ensure_ascii=False, default=_to_builtin)),
+        'names': np.array(list(result.params.index), dtype=str),
+        'params': result.params.values.astype(float),
+        'cov': result.cov.values.astype(float),
+        'omitted': np.array(result.omitted, dtype=str),
+    }
+    if result.resid is not None:
+        packed['resid'] = np.asarray(result.resid, dtype=float)
+    dof = getattr(result, 'dof_table', None)
+    if dof is not None:
+        packed['dof_absvar'] = np.array([str(a) for a in dof['absvar']], dtype=str)
+        packed['dof_counts'] = dof[['categories', 'redundant', 'num_coefs']].values.astype(np.int64)
+        packed['dof_nested'] = dof['nested'].values.astype(bool)
+    return packed
+
+
+def unpack_result(packed, index=None):
+    """紧凑数组字典 -> RegressionResult；index 为残差对齐的行索引"""
+    meta = json.loads(str(packed['meta']))
+    names = [str(n) for n in packed['names']]
+    resid = None
+    if 'resid' in packed:
+        resid = pd.Series(packed['resid'], index=index, name="resid_sat")
+    result = RegressionResult(
+        params=pd.Series(packed['params'], index=names),
+        cov=pd.DataFrame(packed['cov'], index=names, columns=names),
+        nobs=meta['nobs'], df_resid=meta['df_resid'], vce=meta['vce'], resid=resid,
+        rsquared=meta['rsquared'], rsquared_adj=meta['rsquared_adj'], rsquared_within=meta['rsquared_within'],
+        n_clusters=meta['n_clusters'], omitted=[str(o) for o in packed['omitted']], extra=meta['extra'],
+    )
+    result.df_absorbed = meta['df_absorbed']
+    result.dof_table = None
+    if 'dof_absvar' in packed:
+        counts = packed['dof_counts']
+        result.dof_table = pd.DataFrame({
+            'absvar': [str(a) for a in packed['dof_absvar']],
+            'categories': counts[:, 0], 'redundant': counts[:, 1], 'num_coefs': counts[:, 2],
+            'nested': packed['dof_nested'],
+        })
+    return result
+
+
+def packed_nbytes(packed):
+    return int(sum(np.asarray(a).nbytes for a in packed.values()))
+
+
+class ResultCache(DatasetCache):
+    """内存 LRU (按字节预算) + 可选磁盘层的拟合结果缓存"""
+
+    def __init__(self, budget_bytes, directory=None):
+        super().__init__(budget_bytes, sizeof=packed_nbytes)
+        self.directory = directory
+        self.disk_hits = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def _read_disk(self, key):
+        if not self.directory or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with np.load(self._path(key), allow_pickle=False) as f:
+                return {k: f[k] for k in f.files}
+        except (OSError, ValueError):
+            # 文件损坏或被并发写入截断时视为未命中
+            return None
+
+    def _write_disk(self, key, packed):
+        if not self.directory:
+            return
+        # 先写临时文件再原子替换，避免其他进程读到写了一半的文件
+        fd, tmp = tempfile.mkstemp(suffix=".npz", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **packed)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def get_or_fit(self, key, fit, index=None):
+        """命中则直接返回；否则依次查找磁盘层、调用 fit() 拟合并写入两层缓存
+
+        返回 (RegressionResult, 来源)，来源为 "memory" / "disk" / "fit"。
+        """
+        source = "memory"
+
+        def load():
+            nonlocal source
+            packed = self._read_disk(key)
+            if packed is not None:
+                source = "disk"
+                self.disk_hits += 1
+                return packed
+            source = "fit"
+            packed = pack_result(fit())
+            self._write_disk(key, packed)
+            return packed
+
+        packed, _ = self.get_or_load(key, load)
+        return unpack_result(packed, index), source
+
+    def clear(self, disk=False):
+        super().clear()
+        if disk and self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        out = super().stats()
+        out.update({"disk_hits": self.disk_hits, "directory": self.directory})
+        return out
+
+
+_result_cache = ResultCache(DEFAULT_BUDGET_MB * 1024 ** 2, DEFAULT_DIR)
+
+
+def get_result_cache():
+    """进程级共享的结果缓存实例"""
+    return _result_cache
@@ -0,0 +1,182 @@
+"""设定曲线 (specification curve)：第一阶段控制变量与固定效应取不同组合时交互项系数的分布
+
+回应“交互效应对纳入哪些控制变量是否稳健”：枚举 control_vars 与 fe_vars 的子集
+(组合数超过上限时随机抽取)，每个子集运行一次两阶段回归，收集交互项系数及置信区间。
+可以共享的计算只做一次：
+  * 同一组固定效应下，因变量与全部候选控制变量一起去均值一次，交叉积 M'M 也只算一次；
+    由 FWL 定理，各控制变量子集的第一阶段回归取 M'M 的子块求解，残差为 ỹ - X̃_S b；
+  * 所有规格共用同一个样本与第二阶段设计矩阵，X'X 与各聚类的 X_g'X_g 只构建一次，
+    每个规格只重算与残差有关的部分 (CrossProducts.with_response)，剔除极端值仍走低秩 downdate。
+任务按固定效应组合分配到进程池；组合数少于进程数时，同一组合的控制变量子集再拆块并行。
+"""
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from hdfe import FixedEffects, build_exog, factorize, prune_singletons
+from outliers import extreme_mask
+from pipeline import (VCE_TYPES, map_jobs, outlier_settings, prepare_frame, safe_rename, spec_columns, spec_interacts,
+                      stage2_cross_products, stage2_design)
+from regression import rmcoll, translate_name
+
+# 默认最多估计的规格数 (超过时随机抽取)
+DEFAULT_MAX_SPECS = 512
+
+# 列表中未包含任何变量时的显示文本
+NONE_LABEL = "(无)"
+
+
+def enumerate_subsets(controls, fes, max_specs=DEFAULT_MAX_SPECS, seed=0):
+    """controls 与 fes 的全部子集组合 [(控制变量, 固定效应)]，第一个为全部纳入的规格
+
+    组合数 2^(k_c + k_f) 超过 max_specs 时，在全部组合中不放回地随机抽取 (全部纳入的规格总在其中)。
+    """
+    controls, fes = list(controls), list(fes)
+    k = len(controls) + len(fes)
+    full = (1 << k) - 1
+    if max_specs is None or (1 << k) <= max_specs:
+        masks = [full] + [m for m in range(full - 1, -1, -1)]
+    else:
+        rng = np.random.default_rng(seed)
+        masks = [full]
+        seen = {full}
+        while len(masks) < max_specs:
+            for m in rng.integers(0, full, size=2 * max_specs, endpoint=False):
+                m = int(m)
+                if m not in seen:
+                    seen.add(m)
+                    masks.append(m)
+                    if len(masks) == max_specs:
+                        break
+    out = []
+    for m in masks:
+        bits = [(m >> i) & 1 for i in range(k)]
+        out.append((tuple(c for c, b in zip(controls, bits) if b),
+                    tuple(f for f, b in zip(fes, bits[len(controls):]) if b)))
+    return out
+
+
+def _run_fe_group(job):
+    """一组固定效应下的若干控制变量子集 (在工作进程中执行)：去均值一次，各子集由 M'M 的子块求解"""
+    fe = FixedEffects(job['fe_codes'], names=job['fes'])
+    # 与 fit_hdfe 相同：被其他维度嵌套的固定效应去均值时跳过
+    fe = fe.without(fe.nested_in())
+    M = np.column_stack([job['y'], job['X']])
+    M = fe.demean(M)[0] if len(fe) else M - M.mean(axis=0)
+    gram = M.T @ M
+    raw_var = job['raw_var']
+    cp2 = job['cp2']
+    rows = []
+    for spec_id, controls in job['subsets']:
+        try:
+            idx = np.array([j for c in controls for j in job['col_idx'][c]], dtype=np.int64)
+            if len(idx):
+                # 与 fit_hdfe 相同：剔除共线列及去均值后组内不变的列
+                sub = gram[np.ix_(idx + 1, idx + 1)]
+                keep = rmcoll(sub)
+                if len(fe):
+                    keep &= np.diag(sub) > 1e-9 * np.maximum(raw_var[idx], 1e-300)
+                idx = idx[keep]
+            if len(idx):
+                b = np.linalg.solve(gram[np.ix_(idx + 1, idx + 1)], gram[idx + 1, 0])
+                e = M[:, 0] - M[:, idx + 1] @ b
+            else:
+                e = M[:, 0].copy()
+            extreme = extreme_mask(e, job['rule'], job['value'])
+            cp = cp2.with_response(e)
+            if job['remove_extreme']:
+                cp = cp.excluding(extreme)
+            model = cp.fit(job['vce'])
+            ci = model.conf_int(job['alpha'])
+            for name in model.params.index:
+                if ':' not in name:
+                    continue
+                rows.append({'规格': spec_id, 'N': int(model.nobs), '极端值': int(extreme.sum()), '变量': name,
+                             '系数': model.params[name], '标准误': model.bse[name], 'p值': model.pvalues[name],
+                             'CI下限': ci.loc[name, 0], 'CI上限': ci.loc[name, 1], 'error': None})
+        except Exception as e:
+            rows.append({'规格': spec_id, 'error': str(e)})
+    return rows
+
+
+def run_spec_curve(df, spec, vary_controls=None, vary_fes=None, max_specs=DEFAULT_MAX_SPECS, seed=0,
+                   remove_extreme=True, ci_level=0.95, max_workers=None, progress=None):
+    """设定曲线：对 vary_controls / vary_fes (默认为全部控制变量 / 固定效应) 的子集运行两阶段回归
+
+    不在 vary 中的控制变量与固定效应始终纳入。所有规格在同一个无缺失样本上估计；
+    极端值规则取 spec 中的 outlier_rule / outlier_k / outlier_pct (缺省 3σ)。
+    返回 (长表：每个规格 × 交互项一行，含纳入的控制变量与固定效应；出错的规格列表)。
+    """
+    controls, fes = list(spec.get('control_vars', [])), list(spec.get('fe_vars', []))
+    vary_controls = controls if vary_controls is None else [c for c in controls if c in vary_controls]
+    vary_fes = fes if vary_fes is None else [f for f in fes if f in vary_fes]
+    fixed_controls = [c for c in controls if c not in vary_controls]
+    fixed_fes = [f for f in fes if f not in vary_fes]
+
+    df_clean = prepare_frame(df[spec_columns(spec)].dropna())
+    # 按全部候选固定效应剔除单例：任一固定效应子集下都不再有单例，所有规格仍在同一样本上估计
+    df_clean, _ = prune_singletons(df_clean, fes)
+    df_safe, col_map, reverse_map = safe_rename(df_clean)
+    vce = VCE_TYPES[spec.get('vce_mode', "不使用")]
+    cluster = col_map[spec['cluster_var']] if vce == "cluster" else None
+
+    # 第一阶段：全部候选控制变量的矩阵只构建一次，记录每个变量对应的列 (分类变量可能展开为多列)
+    safe_controls = [col_map[c] for c in controls]
+    X, names = build_exog(df_safe, safe_controls)
+    col_idx = {c: [j for j, nm in enumerate(names) if nm == s or nm.startswith(s + "[")]
+               for c, s in zip(controls, safe_controls)}
+    raw_var = ((X - X.mean(axis=0)) ** 2).sum(axis=0)
+    fe_codes = {f: factorize(df_safe[col_map[f]].values)[0] for f in fes}
+    y = df_safe[col_map[spec['dep_var']]].values.astype(float)
+
+    # 第二阶段：设计矩阵与 X'X、聚类块只构建一次 (因变量占位，各规格替换为自己的残差)
+    interacts = [col_map[c] for c in spec_interacts(spec)]
+    s2_controls = [col_map[c] for c in spec.get('stage2_controls', [])]
+    s2_cols = list(dict.fromkeys(interacts + s2_controls + ([cluster] if cluster else [])))
+    data2 = df_safe[s2_cols].assign(resid_sat=0.0)
+    design, _ = stage2_design(data2, interacts, s2_controls)
+    cp2 = stage2_cross_products(design, data2, cluster)
+
+    rule, value = outlier_settings(spec)
+
+    subsets = enumerate_subsets(vary_controls, vary_fes, max_specs, seed)
+    groups = {}
+    for spec_id, (cs, fs) in enumerate(subsets):
+        groups.setdefault(fs, []).append((spec_id, fixed_controls + list(cs)))
+    # 固定效应组合少于进程数时再拆块，使各进程都有任务 (每块各自去均值一次)
+    workers = max_workers or os.cpu_count() or 1
+    n_chunks = max(1, -(-workers // len(groups)))
+    jobs = []
+    for fs, members in groups.items():
+        fe_list = fixed_fes + list(fs)
+        size = -(-len(members) // n_chunks)
+        for start in range(0, len(members), size):
+            jobs.append({
+                'y': y, 'X': X, 'raw_var': raw_var, 'col_idx': col_idx,
+                'fe_codes': [fe_codes[f] for f in fe_list], 'fes': [col_map[f] for f in fe_list],
+                'subsets': members[start:start + size], 'cp2': cp2, 'vce': vce,
+                'rule': rule, 'value': value, 'remove_extreme': remove_extreme, 'alpha': 1 - ci_level,
+            })
+
+    outputs = map_jobs(_run_fe_group, jobs, max_workers=max_workers, progress=progress)
+
+    rows, failed = [], []
+    for row in itertools.chain.from_iterable(outputs):
+        cs, fs = subsets[row['规格']]
+        if row['error'] is not None:
+            failed.append((row['规格'], row['error']))
+            continue
+        row = dict(row)
+        del row['error']
+        row['控制变量'] = "、".join(fixed_controls + list(cs)) or NONE_LABEL
+        row['固定效应'] = "、".join(fixed_fes + list(fs)) or NONE_LABEL
+        row['变量'] = translate_name(row['变量'], reverse_map)
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    if len(table):
+        table = table.sort_values('规格', kind="stable").reset_index(drop=True)
+        first = ['规格', '控制变量', '固定效应']
+        table = table[first + [c for c in table.columns if c not in first]]
+    return table, failed
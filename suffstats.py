@@ -0,0 +1,190 @@
+"""第二阶段回归的充分统计量 (交叉积) 引擎
+
+设计矩阵只构建一次，缓存 X'X、X'y、y'y 以及各聚类的 X_g'X_g、X_g'y_g。
+剔除极端值 (通常不到 1% 的样本) 或换一个 σ 阈值时，只需从缓存中减去
+被剔除行的低秩贡献 (downdate)，无须重新解析公式、复制数据或重建设计矩阵，
+因此“不删除极端值 / 删除极端值” (do 文件中的方案1/方案2) 可以同时给出。
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+import patsy
+from scipy import sparse
+
+from regression import RegressionResult, rmcoll
+
+
+def _dense(M):
+    return M.toarray() if sparse.issparse(M) else np.asarray(M)
+
+
+class CrossProducts:
+    """OLS 的充分统计量；active 标记当前纳入估计的行
+
+    X 可以是稠密数组或 scipy 稀疏矩阵 (CSR)；稀疏时交叉积按稀疏乘法计算，
+    只有 k×k 的 X'X 与各聚类块是稠密的，n×k 的设计矩阵始终不展开。
+    """
+
+    def __init__(self, X, y, names, clusters=None, design_info=None):
+        self.X = X.tocsr().astype(float) if sparse.issparse(X) else np.asarray(X, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.names = list(names)
+        self.design_info = design_info
+        n, k = self.X.shape
+        self.active = np.ones(n, dtype=bool)
+        self.n_active = n
+        self.XtX = _dense(self.X.T @ self.X)
+        self.Xty = np.asarray(self.X.T @ self.y).ravel()
+        self.yty = float(self.y @ self.y)
+        self.ysum = float(self.y.sum())
+        self.empty = []
+        self.codes = None
+        if clusters is not None:
+            codes, labels = pd.factorize(np.asarray(clusters), sort=True)
+            self.codes, G = codes.astype(np.int64), len(labels)
+            self.cluster_labels = np.asarray(labels)
+            self.n_g = np.bincount(self.codes, minlength=G)
+            self.XtX_g = np.zeros((G, k, k))
+            self.Xty_g = np.zeros((G, k))
+            order = np.argsort(self.codes, kind="stable")
+            bounds = np.searchsorted(self.codes[order], np.arange(G + 1))
+            for g in range(G):
+                rows = order[bounds[g]:bounds[g + 1]]
+                Xg = self.X[rows]
+                self.XtX_g[g] = _dense(Xg.T @ Xg)
+                self.Xty_g[g] = np.asarray(Xg.T @ self.y[rows]).ravel()
+
+    @classmethod
+    def from_formula(cls, formula, data, cluster=None):
+        """由 patsy 公式构建 (cluster 为聚类变量列名)"""
+        y, X = patsy.dmatrices(formula, data, NA_action="raise", return_type="dataframe")
+        clusters = data[cluster].values if cluster is not None else None
+        return cls(X.values, y.values[:, 0], X.columns, clusters=clusters, design_info=X.design_info)
+
+    @classmethod
+    def from_design(cls, design, data, cluster=None):
+        """由 factorial.FactorialDesign 构建 (稀疏设计矩阵；样本中不存在的格子记入 empty)"""
+        y, X, info = design.matrices(data)
+        clusters = data[cluster].values if cluster is not None else None
+        cp = cls(X, y, info.column_names, clusters=clusters, design_info=info)
+        cp.empty = list(info.empty)
+        return cp
+
+    @property
+    def nobs(self):
+        return self.n_active
+
+    def downdate(self, rows):
+        """从当前估计样本中剔除 rows (行号)，返回新的充分统计量对象 (共享底层 X、y)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[self.active[rows]]
+        new = copy.copy(self)
+        new.active = self.active.copy()
+        new.active[rows] = False
+        new.n_active = self.n_active - len(rows)
+        # 被剔除的行通常很少，取出后按稠密处理
+        Xr, yr = _dense(self.X[rows]), self.y[rows]
+        new.XtX = self.XtX - Xr.T @ Xr
+        new.Xty = self.Xty - Xr.T @ yr
+        new.yty = self.yty - float(yr @ yr)
+        new.ysum = self.ysum - float(yr.sum())
+        if self.codes is not None:
+            cr = self.codes[rows]
+            G = len(self.n_g)
+            new.n_g = self.n_g - np.bincount(cr, minlength=G)
+            # 按聚类分组，每个涉及的聚类减去一次 Xr_g'Xr_g (不构造 r×k×k 的临时数组)
+            order = np.argsort(cr, kind="stable")
+            touched, starts = np.unique(cr[order], return_index=True)
+            bounds = np.append(starts, len(order))
+            new.XtX_g = self.XtX_g.copy()
+            for g, lo, hi in zip(touched, bounds[:-1], bounds[1:]):
+                Xg = Xr[order[lo:hi]]
+                new.XtX_g[g] -= Xg.T @ Xg
+            C = sparse.csr_matrix((np.ones(len(rows)), (cr, np.arange(len(rows)))), shape=(G, len(rows)))
+            new.Xty_g = self.Xty_g - C @ (Xr * yr[:, None])
+        return new
+
+    def with_response(self, y):
+        """同一设计矩阵、新的因变量 (如另一组第一阶段残差)，返回新的充分统计量对象
+
+        X'X 与各聚类的 X_g'X_g 只依赖设计矩阵，直接共享；只重算 X'y、y'y 与各聚类的 X_g'y_g，
+        均为一次 (稀疏) 矩阵乘法，不再逐聚类循环。
+        """
+        new = copy.copy(self)
+        new.y = np.asarray(y, dtype=float)
+        ya = np.where(self.active, new.y, 0.0)
+        new.Xty = np.asarray(self.X.T @ ya).ravel()
+        new.yty = float(ya @ ya)
+        new.ysum = float(ya.sum())
+        if self.codes is not None:
+            # 聚类指示矩阵 (G×n) 的稀疏结构只建一次，之后每次只替换非零值
+            if getattr(self, "_indicator", None) is None:
+                n = len(ya)
+                self._indicator = sparse.csr_matrix((np.ones(n), (self.codes, np.arange(n))), shape=(len(self.n_g), n))
+            ind = self._indicator
+            C = sparse.csr_matrix((ya[ind.indices], ind.indices, ind.indptr), shape=ind.shape)
+            new.Xty_g = _dense(C @ self.X)
+        return new
+
+    def excluding(self, mask):
+        """剔除布尔掩码 mask 为 True 的行 (相对于全部样本)"""
+        return self.downdate(np.flatnonzero(np.asarray(mask, dtype=bool) & self.active))
+
+    def cluster_blocks(self, keep=None):
+        """当前样本中非空聚类的交叉积块，供野聚类自助法、刀切法等复用"""
+        keep = np.ones(len(self.names), dtype=bool) if keep is None else keep
+        live = self.n_g > 0
+        return self.XtX_g[live][:, keep][:, :, keep], self.Xty_g[live][:, keep]
+
+    def live_clusters(self):
+        """当前样本中非空聚类的取值 (与 cluster_blocks 的顺序一致)"""
+        return self.cluster_labels[self.n_g > 0]
+
+    def fit(self, vce="unadjusted"):
+        """由充分统计量求解 OLS，协方差的小样本修正与 Stata reg 一致"""
+        if vce == "cluster" and self.codes is None:
+            raise ValueError("vce(cluster) 需要指定聚类变量")
+        keep = rmcoll(self.XtX)
+        names = [nm for nm, k in zip(self.names, keep) if k]
+        XtX = self.XtX[np.ix_(keep, keep)]
+        Xty = self.Xty[keep]
+        A = np.linalg.inv(XtX)
+        b = A @ Xty
+        n, k = self.n_active, int(keep.sum())
+        rss = max(self.yty - 2 * b @ Xty + b @ XtX @ b, 0.0)
+
+        G = None
+        if vce == "cluster":
+            XtX_g, Xty_g = self.cluster_blocks(keep)
+            S = Xty_g - XtX_g @ b
+            G = len(S)
+            cov = A @ (S.T @ S) @ A * ((n - 1) / (n - k) * G / (G - 1))
+            df_resid = G - 1
+        elif vce == "robust":
+            Xa = self.X[self.active][:, keep]
+            e = self.y[self.active] - Xa @ b
+            if sparse.issparse(Xa):
+                meat = _dense(Xa.T @ sparse.diags(e ** 2) @ Xa)
+            else:
+                meat = (Xa * (e ** 2)[:, None]).T @ Xa
+            cov = A @ meat @ A * (n / (n - k))
+            df_resid = n - k
+        else:
+            cov = A * (rss / (n - k))
+            df_resid = n - k
+
+        tss = self.yty - self.ysum ** 2 / n
+        r2 = 1 - rss / tss if tss > 0 else np.nan
+        result = RegressionResult(
+            params=pd.Series(b, index=names),
+            cov=pd.DataFrame(cov, index=names, columns=names),
+            nobs=n, df_resid=int(df_resid), vce=vce,
+            rsquared=r2, rsquared_adj=1 - (1 - r2) * (n - 1) / (n - k) if n > k else np.nan,
+            n_clusters=G, omitted=self.empty + [nm for nm, kk in zip(self.names, keep) if not kk],
+        )
+        result.design_info = self.design_info
+        result.exog_keep = keep
+        result.exog_names = self.names
+        result.rss = rss
+        return result
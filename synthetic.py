@@ -0,0 +1,173 @@
+"""合成问卷数据 (与真实调查数据结构相同，用于性能基准与演示，不含任何真实数据)
+
+结构与政务服务满意度调查一致：中文列名、Stata 值标签、多个需要吸收的固定效应
+(服务大厅嵌套于区、窗口工作人员数随样本量增长，组规模呈长尾分布)、聚类数很少的区、
+分类交互变量，以及注入的极端值和少量缺失值。数据由已知的参数生成：性别相同时满意度提高 INTERACTION_EFFECT，
+因此第二阶段交互项 (女#女) 系数的真值为 2 × INTERACTION_EFFECT。
+
+用法:
+    python synthetic.py 1000000 -o survey_synthetic.dta [--seed 0]
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+# 真实的交互效应 (窗口服务人员与办事公众性别相同时满意度的提高)
+INTERACTION_EFFECT = 2.0
+
+# 列名 -> 变量标签 (写入 .dta)
+VARIABLE_LABELS = {
+    '公众整体满意度': "公众对本次服务的整体满意度 (0-100)",
+    '公众年龄': "办事公众年龄",
+    '公众生活满意度': "公众生活满意度",
+    '受教育程度': "办事公众受教育程度",
+    '服务大厅所在区': "服务大厅所在区",
+    '服务大厅': "服务大厅编号",
+    '窗口工作人员编号': "窗口工作人员编号",
+    '调查月份': "调查月份",
+    '窗口服务人员性别': "窗口服务人员性别",
+    '办事公众性别': "办事公众性别",
+    '办理事项类型': "办理事项类型",
+}
+
+# 带值标签的整数编码列 -> {取值: 标签}；区的标签在生成时按区数补齐
+VALUE_LABELS = {
+    '公众生活满意度': {1: "非常不满意", 2: "不太满意", 3: "一般", 4: "比较满意", 5: "非常满意"},
+    '受教育程度': {1: "小学及以下", 2: "初中", 3: "高中/中专", 4: "大专", 5: "本科", 6: "研究生及以上"},
+    '窗口服务人员性别': {1: "男", 2: "女"},
+    '办事公众性别': {1: "男", 2: "女"},
+    '办理事项类型': {1: "个人事项", 2: "企业事项", 3: "社保医保", 4: "不动产登记"},
+}
+
+DISTRICT_NAMES = ["东城区", "西城区", "南城区", "北城区", "新城区", "老城区", "高新区", "开发区",
+                  "滨江区", "湖滨区", "山前区", "临港区", "城南区", "城北区", "江东区", "江西区"]
+
+
+def skewed_probs(k, exponent=1.1):
+    """长尾 (Zipf 型) 的组概率：第 i 组 ∝ 1 / i^exponent"""
+    w = 1.0 / np.arange(1, k + 1) ** exponent
+    return w / w.sum()
+
+
+def district_labels(n_districts):
+    return {i + 1: (DISTRICT_NAMES[i] if i < len(DISTRICT_NAMES) else f"第{i + 1}区") for i in range(n_districts)}
+
+
+def make_survey(n, seed=0, n_districts=12, halls_per_district=8, staff_per_hall=None,
+                outlier_share=0.01, missing_share=0.005):
+    """生成 n 行合成问卷数据 (整数编码 + 值标签，与 read_stata 前的 .dta 相同)
+
+    staff_per_hall: 每个服务大厅的窗口工作人员数 (缺省随 n 增长，使最小的组只有个位数样本)；
+    outlier_share: 注入极端值 (±8~15 个残差标准差) 的比例；missing_share: 各控制变量缺失的比例。
+    """
+    rng = np.random.default_rng(seed)
+    if staff_per_hall is None:
+        staff_per_hall = int(np.clip(n // (n_districts * halls_per_district * 40), 5, 400))
+
+    district = rng.choice(n_districts, size=n, p=skewed_probs(n_districts, 0.8)).astype(np.int16) + 1
+    hall_local = rng.choice(halls_per_district, size=n, p=skewed_probs(halls_per_district))
+    hall = (district.astype(np.int32) * 100 + hall_local + 1).astype(np.int32)
+    staff_local = rng.choice(staff_per_hall, size=n, p=skewed_probs(staff_per_hall, 1.3))
+    staff = hall.astype(np.int64) * 1000 + staff_local + 1
+    month = rng.integers(1, 13, size=n, dtype=np.int8)
+
+    age = rng.integers(18, 81, size=n).astype(float)
+    life = rng.choice(5, size=n, p=[0.05, 0.1, 0.3, 0.35, 0.2]).astype(np.int8) + 1
+    edu = rng.choice(6, size=n, p=[0.08, 0.2, 0.25, 0.2, 0.22, 0.05]).astype(np.int8) + 1
+    staff_gender = rng.integers(1, 3, size=n, dtype=np.int8)
+    public_gender = rng.integers(1, 3, size=n, dtype=np.int8)
+    task = rng.choice(4, size=n, p=[0.45, 0.25, 0.2, 0.1]).astype(np.int8) + 1
+
+    # 各层固定效应的真值 (取自同一随机数生成器，种子相同则数据相同)
+    fe_district = rng.normal(0, 4, n_districts + 1)
+    fe_hall = rng.normal(0, 3, (n_districts + 1) * 100 + halls_per_district + 1)
+    fe_staff = rng.normal(0, 2, staff_per_hall + 1)
+    fe_month = rng.normal(0, 1, 13)
+    y = (70 + fe_district[district] + fe_hall[hall] + fe_staff[staff_local + 1] + fe_month[month]
+         - 0.05 * age + 2.5 * life + 0.4 * edu - 1.0 * (task == 2)
+         + INTERACTION_EFFECT * (staff_gender == public_gender) + rng.normal(0, 8, n))
+    n_out = int(round(outlier_share * n))
+    if n_out:
+        rows = rng.choice(n, size=n_out, replace=False)
+        y[rows] += rng.choice([-1.0, 1.0], size=n_out) * rng.uniform(8, 15, size=n_out) * 8
+    y = np.round(y, 1)
+
+    df = pd.DataFrame({
+        '公众整体满意度': y,
+        '公众年龄': age,
+        '公众生活满意度': life,
+        '受教育程度': edu,
+        '服务大厅所在区': district,
+        '服务大厅': hall,
+        '窗口工作人员编号': staff,
+        '调查月份': month,
+        '窗口服务人员性别': staff_gender,
+        '办事公众性别': public_gender,
+        '办理事项类型': task,
+    })
+    if missing_share:
+        # 缺失只出现在连续变量上 (带值标签的编码列保持整数类型，以便写出值标签)
+        for col in ('公众整体满意度', '公众年龄'):
+            df.loc[rng.random(n) < missing_share, col] = np.nan
+    return df
+
+
+def value_labels(df):
+    """df 中各编码列的值标签 (区按实际区数补齐)"""
+    labels = {c: v for c, v in VALUE_LABELS.items() if c in df.columns}
+    if '服务大厅所在区' in df.columns:
+        labels['服务大厅所在区'] = district_labels(int(df['服务大厅所在区'].max()))
+    return labels
+
+
+def default_config():
+    """与合成数据配套的分析配置 (同“配置管理”导出的 analysis_config.json)"""
+    return {
+        'dep_var': '公众整体满意度',
+        'control_vars': ['公众年龄', '公众生活满意度', '受教育程度'],
+        'fe_vars': ['服务大厅', '窗口工作人员编号', '调查月份'],
+        'vce_mode': "vce(cluster)",
+        'cluster_var': '服务大厅所在区',
+        'interact_var1': '窗口服务人员性别',
+        'interact_var2': '办事公众性别',
+        'stage2_controls': ['公众年龄'],
+        'remove_extreme': True,
+        'ci_level': 0.95,
+    }
+
+
+def write_survey(df, path):
+    """写出数据文件：.dta 带变量标签与值标签；.csv / .xlsx 写入标签文本 (与读取 .dta 后看到的取值相同)"""
+    if path.endswith('.dta'):
+        df.to_stata(path, write_index=False, version=118, value_labels=value_labels(df),
+                    variable_labels={c: l for c, l in VARIABLE_LABELS.items() if c in df.columns})
+        return
+    labelled = df.copy()
+    for col, labels in value_labels(df).items():
+        labelled[col] = labelled[col].map(labels)
+    if path.endswith('.csv'):
+        labelled.to_csv(path, index=False, encoding="utf-8")
+    elif path.endswith('.xlsx'):
+        labelled.to_excel(path, index=False)
+    else:
+        raise ValueError(f"不支持的文件类型: {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成合成问卷数据")
+    parser.add_argument("n", type=int, help="样本量")
+    parser.add_argument("-o", "--output", default="survey_synthetic.dta", help="输出文件 (.dta / .csv / .xlsx)")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--districts", type=int, default=12, help="区 (聚类) 数")
+    parser.add_argument("--outliers", type=float, default=0.01, help="极端值比例")
+    args = parser.parse_args(argv)
+    df = make_survey(args.n, seed=args.seed, n_districts=args.districts, outlier_share=args.outliers)
+    write_survey(df, args.output)
+    print(f"已写入 {args.output}: {len(df)} 行 × {len(df.columns)} 列", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
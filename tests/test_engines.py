@@ -0,0 +1,152 @@
+"""自写估计引擎与 statsmodels 参考实现的一致性检验
+
+HDFE 吸收 (fit_hdfe) 对照 C() 哑变量 OLS；充分统计量引擎 (CrossProducts.fit / excluding) 与稀疏全因子设计
+对照 statsmodels OLS；asobserved 预测边际对照逐格子改写数据后的预测平均；test / lincom 对照 f_test / t_test。
+数据为 synthetic.make_survey 生成的合成问卷。
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.formula.api as smf
+
+from factorial import FactorialDesign
+from hdfe import fit_hdfe, prune_singletons
+from hypothesis import HypothesisParser, evaluate
+from outliers import extreme_mask
+from pipeline import interaction_margins, prepare_frame, safe_rename, stage2_cross_products, stage2_design, with_columns
+from synthetic import make_survey
+
+SM_COV = {"unadjusted": ("nonrobust", {}), "robust": ("HC1", {})}
+
+
+@pytest.fixture(scope="module")
+def survey():
+    """(安全列名的数据, 原始列名 -> 安全列名)；已剔除缺失与固定效应单例"""
+    df = prepare_frame(make_survey(3000, seed=7, staff_per_hall=6).dropna())
+    df, _ = prune_singletons(df, ['服务大厅', '窗口工作人员编号', '调查月份'])
+    df_safe, col_map, _ = safe_rename(df)
+    return df_safe, col_map
+
+
+@pytest.fixture(scope="module")
+def stage2(survey):
+    """第一阶段残差上的第二阶段数据与稀疏全因子设计 (A##B + 年龄)"""
+    df, cm = survey
+    model1 = fit_hdfe(df, cm['公众整体满意度'], [cm['公众年龄'], cm['公众生活满意度']], [cm['服务大厅'], cm['调查月份']])
+    data = with_columns(df, resid_sat=model1.resid.values)
+    a, b, age = cm['窗口服务人员性别'], cm['办事公众性别'], cm['公众年龄']
+    design, is_cat = stage2_design(data, [a, b], [age])
+    assert isinstance(design, FactorialDesign)
+    return data, design, is_cat, f"resid_sat ~ C({a}) * C({b}) + {age}"
+
+
+def sm_fit(formula, data, vce, cluster=None):
+    if vce == "cluster":
+        return smf.ols(formula, data).fit(cov_type="cluster", cov_kwds={'groups': np.asarray(data[cluster])})
+    cov_type, kwds = SM_COV[vce]
+    return smf.ols(formula, data).fit(cov_type=cov_type, cov_kwds=kwds or None)
+
+
+def assert_same(result, reference, names):
+    np.testing.assert_allclose(result.params[names].values, reference.params[names].values, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(result.bse[names].values, reference.bse[names].values, rtol=1e-6, atol=1e-10)
+
+
+# (吸收的固定效应, 参照回归的哑变量)：服务大厅嵌套于工作人员，其哑变量与工作人员哑变量完全共线，
+# statsmodels 的聚类小样本校正按设计矩阵列数而非秩计算 K，故参照回归只放满秩的哑变量
+@pytest.mark.parametrize("fes, dummies", [(['服务大厅', '调查月份'], ['服务大厅', '调查月份']),
+                                          (['窗口工作人员编号', '调查月份', '服务大厅'], ['窗口工作人员编号', '调查月份'])])
+@pytest.mark.parametrize("vce", ["unadjusted", "robust", "cluster"])
+def test_fit_hdfe_matches_dummy_ols(survey, fes, dummies, vce):
+    """吸收固定效应与 C() 哑变量的系数、标准误、残差自由度一致 (含嵌套固定效应)"""
+    df, cm = survey
+    dep, controls = cm['公众整体满意度'], [cm['公众年龄'], cm['公众生活满意度']]
+    safe_fes = [cm[f] for f in fes]
+    # 聚类变量不能嵌套固定效应 (否则 reghdfe 不计入冗余的吸收自由度，与哑变量回归不可比)
+    cluster = cm['办理事项类型'] if vce == "cluster" else None
+    result = fit_hdfe(df, dep, controls, safe_fes, vce=vce, cluster=cluster)
+    formula = f"{dep} ~ " + " + ".join(controls + [f"C({cm[f]})" for f in dummies])
+    reference = sm_fit(formula, df, vce, cluster)
+    assert_same(result, reference, controls)
+    if vce != "cluster":
+        assert result.df_resid == int(reference.df_resid)
+
+
+@pytest.mark.parametrize("vce", ["unadjusted", "robust", "cluster"])
+def test_cross_products_match_ols(stage2, survey, vce):
+    """全因子设计的充分统计量估计与 statsmodels 一致；excluding 与在剔除后的样本上重新估计一致"""
+    data, design, _, formula = stage2
+    cluster = survey[1]['服务大厅所在区']
+    cp = stage2_cross_products(design, data, cluster if vce == "cluster" else None)
+    full = cp.fit(vce)
+    assert_same(full, sm_fit(formula, data, vce, cluster), list(full.params.index))
+
+    extreme = extreme_mask(data['resid_sat'].values, "sigma", 2.0)
+    assert extreme.any()
+    trimmed = cp.excluding(extreme).fit(vce)
+    reference = sm_fit(formula, data[~extreme], vce, cluster)
+    assert_same(trimmed, reference, list(trimmed.params.index))
+    assert trimmed.nobs == int(reference.nobs)
+
+
+def brute_force_margins(reference, data, at):
+    """逐格子把 at 中的变量改写为该取值后对全部观测预测并平均"""
+    out = []
+    for values in pd.MultiIndex.from_product(list(at.values())):
+        frame = data.copy()
+        for var, v in zip(at, values):
+            frame[var] = v
+        out.append(float(np.asarray(reference.predict(frame)).mean()))
+    return np.array(out)
+
+
+def test_asobserved_margins_factorial(stage2):
+    """稀疏全因子设计下闭式计算的 asobserved 边际等于逐格子预测的平均 (剔除极端值后的样本)"""
+    data, design, is_cat, formula = stage2
+    a, b = design.factors[:2]
+    controls = list(design.controls)
+    rows = ~extreme_mask(data['resid_sat'].values, "sigma", 2.5)
+    model = stage2_cross_products(design, data).excluding(~rows).fit()
+    margins = interaction_margins(model, data, [a, b], is_cat, controls, how="asobserved", rows=rows)
+    sample = data[rows]
+    expected = brute_force_margins(smf.ols(formula, sample).fit(), sample,
+                                   {a: sorted(sample[a].unique()), b: sorted(sample[b].unique())})
+    np.testing.assert_allclose(margins.summary_frame()['margin'].values, expected, rtol=1e-8, atol=1e-10)
+
+
+def test_asobserved_margins_continuous(survey, stage2):
+    """含连续交互变量 (patsy 设计、按块累加) 的 asobserved 边际等于逐格子预测的平均"""
+    data, _, _, _ = stage2
+    cm = survey[1]
+    a, age, life = cm['窗口服务人员性别'], cm['公众年龄'], cm['公众生活满意度']
+    design, is_cat = stage2_design(data, [a, age], [life])
+    assert isinstance(design, str) and is_cat == [True, False]
+    model = stage2_cross_products(design, data).fit()
+    at = {age: [30.0, 50.0, 70.0]}
+    margins = interaction_margins(model, data, [a, age], is_cat, [life], how="asobserved", at=at)
+    expected = brute_force_margins(smf.ols(design, data).fit(), data, {a: sorted(data[a].unique()), age: at[age]})
+    np.testing.assert_allclose(margins.summary_frame()['margin'].values, expected, rtol=1e-8, atol=1e-10)
+
+
+def test_hypotheses_match_f_and_t_tests(stage2):
+    """test / lincom 的统计量与 statsmodels f_test / t_test 一致"""
+    data, design, _, formula = stage2
+    a, b = design.factors[:2]
+    model = stage2_cross_products(design, data).fit()
+    reference = smf.ols(formula, data).fit()
+    ta, tb, tab = f"C({a})[T.2]", f"C({b})[T.2]", f"C({a})[T.2]:C({b})[T.2]"
+    parser = HypothesisParser(model.params.index, None, model.omitted)
+    commands = [f"test 2.{a}#2.{b} = 2.{a}", f"test (2.{a} = 0) (2.{b} = 0)", f"lincom 2.{a} + 2.{a}#2.{b}"]
+    table = evaluate(model, parser.parse_lines("\n".join(commands)))
+
+    f1 = reference.f_test(f"{tab} = {ta}")
+    f2 = reference.f_test(f"{ta} = 0, {tb} = 0")
+    for row, f in zip(table.itertuples(), (f1, f2)):
+        assert row.df1 == int(f.df_num) and row.df2 == int(f.df_denom)
+        np.testing.assert_allclose([row.F值, row.p值], [float(np.squeeze(f.fvalue)), float(f.pvalue)], rtol=1e-6)
+
+    t = reference.t_test(f"{ta} + {tab} = 0")
+    row = table.iloc[2]
+    np.testing.assert_allclose([row['估计值'], row['标准误'], row['t值'], row['p值']],
+                               [float(np.squeeze(t.effect)), float(np.squeeze(t.sd)), float(np.squeeze(t.tvalue)),
+                                float(t.pvalue)], rtol=1e-6)